@@ -0,0 +1,860 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # Sentinel marking the end of the async engine's result stream
+
+
+class RetryLater(Exception):
+    """
+    Raised by a pool task that wants to be run again in `delay` seconds.
+
+    `resume` is a zero-argument callable that continues the task from where
+    it stopped (it carries the attempt state). Pools started through
+    `submit_retrying` park it on the delay queue and free the worker instead
+    of sleeping in it.
+    """
+
+    def __init__(self, delay, resume, reason=None):
+        super().__init__(reason or f"retry in {delay}s")
+        self.delay = max(0.0, float(delay))
+        self.resume = resume
+
+
+class RetryPolicy:
+    """
+    Retry and proxy rotation rules shared by the threaded fetches
+    (ProductScraper._attempt) and AsyncCrawlEngine, so both engines make
+    the same attempts before giving up on a URL.
+
+    A request is tried on up to `max_proxy_attempts` proxies; without a
+    proxy list every round uses a direct connection, and None means one
+    round per proxy. Each round makes up to `max_retries` attempts with a
+    linear backoff of `retry_delay * attempt`, and ends at once when the
+    proxy's circuit opens.
+    """
+
+    def __init__(self, max_retries=3, retry_delay=5, max_proxy_attempts=3):
+        self.max_retries = max(1, int(max_retries))
+        self.retry_delay = retry_delay
+        self.max_proxy_attempts = max_proxy_attempts
+
+    def proxy_rounds(self, proxies, max_proxy_attempts=None):
+        """Number of proxies (or direct connection rounds) to try"""
+        rounds = self.max_proxy_attempts if max_proxy_attempts is None else max_proxy_attempts
+        if rounds is None:
+            rounds = len(proxies) if proxies else 1
+        return max(1, int(rounds))
+
+    def round_over(self, attempt, proxy, proxy_manager=None):
+        """True when `attempt` attempts used up the current proxy's round"""
+        return attempt >= self.max_retries or bool(proxy_manager and not proxy_manager.is_available(proxy))
+
+    def backoff(self, attempt):
+        """Delay before the next attempt on the same proxy"""
+        return self.retry_delay * attempt
+
+
+class DelayQueue:
+    """
+    Heap of callbacks ordered by due time, run by a single daemon thread.
+
+    Callbacks should be quick (typically an `executor.submit`), since they
+    all run on the scheduler thread.
+    """
+
+    def __init__(self, name='retry-scheduler'):
+        self.name = name
+        self._heap = []
+        self._sequence = itertools.count()  # Tie-break so callbacks are never compared
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
+
+    def schedule(self, delay, callback):
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay), next(self._sequence), callback))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._condition.wait(timeout)
+                _, _, callback = heapq.heappop(self._heap)
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Delayed callback failed: {str(e)}")
+
+
+retry_queue = DelayQueue()
+
+
+def submit_retrying(executor, func, *args, delay_queue=None):
+    """
+    Submit `func(*args)` to `executor` and return a Future for its final
+    result.
+
+    Whenever the task raises RetryLater, its `resume` is put on the delay
+    queue and submitted again once due, so the worker is free to run other
+    tasks in the meantime. The executor must stay open until the returned
+    future is done.
+    """
+    delay_queue = delay_queue or retry_queue
+    outer = Future()
+
+    def run(call):
+        try:
+            executor.submit(call).add_done_callback(done)
+        except RuntimeError as e:  # Executor shut down while the retry was waiting
+            outer.set_exception(e)
+
+    def done(inner):
+        try:
+            result = inner.result()
+        except RetryLater as retry:
+            delay_queue.schedule(retry.delay, partial(run, retry.resume))
+        except BaseException as e:
+            outer.set_exception(e)
+        else:
+            outer.set_result(result)
+
+    run(partial(func, *args))
+    return outer
+
+
+class HostLimiter:
+    """
+    Caps the number of concurrent requests sent to a single host.
+
+    Every worker acquires a slot for the host it is about to hit and releases
+    it once the response (or error) is back, so a large worker pool never
+    hammers one host harder than `per_host_limit` allows. Listeners added
+    with `add_listener` are called after every release, e.g. to wake up
+    coroutines waiting for a slot.
+    """
+
+    def __init__(self, per_host_limit):
+        self.per_host_limit = max(1, int(per_host_limit))
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._listeners = []
+
+    def _semaphore(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+    def acquire(self, host):
+        self._semaphore(host).acquire()
+
+    def try_acquire(self, host):
+        """Take a slot if one is free, without waiting"""
+        return self._semaphore(host).acquire(blocking=False)
+
+    def release(self, host, notify=True):
+        self._semaphore(host).release()
+        if notify:
+            _notify(self._listeners)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+
+def _notify(listeners):
+    for callback in list(listeners):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning(f"Limiter listener failed: {str(e)}")
+
+
+class AdaptiveRateLimiter:
+    """
+    Process-wide AIMD concurrency controller keyed by host.
+
+    Each host starts at half the ceiling. Every healthy response raises the
+    host's limit by `1 / limit`, so it grows by roughly one request per
+    round-trip window. A throttling response (403/429/5xx) or a timeout
+    multiplies it by `decrease`, at most once per `cooldown` seconds so one
+    burst of in-flight failures only counts once. The limit never exceeds
+    `ceiling` or drops below `floor`.
+
+    With a `state_store`, decreases are published and other processes adopt
+    a lower shared limit on their next sync, so jobs hitting the same host
+    back off together. Limiters of one process are linked instead: a
+    decrease of one is applied to the host's limit in the others as well. The store may hit the database; `acquire` and
+    `release` do that inline, while the async engine passes `sync=False` /
+    `publish=False` and runs `sync`/`publish` in an executor instead.
+    Listeners are called after every release, like HostLimiter's.
+    """
+
+    THROTTLE_STATUSES = {403, 429, 500, 502, 503, 504}
+
+    def __init__(self, ceiling, initial=None, floor=1, decrease=0.5, cooldown=5.0,
+                 state_store=None, sync_interval=10.0, shared_ttl=120.0):
+        self.ceiling = max(1, int(ceiling))
+        self.floor = max(1, min(int(floor), self.ceiling))
+        self.initial = min(self.ceiling, max(self.floor, int(initial or (self.ceiling + 1) // 2)))
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.state_store = state_store
+        self.sync_interval = sync_interval
+        self.shared_ttl = shared_ttl
+        self._limits = {}
+        self._in_flight = {}
+        self._last_decrease = {}
+        self._last_sync = {}
+        self._condition = threading.Condition()
+        self._listeners = []
+        self._peers = []
+
+    def limit(self, host):
+        with self._condition:
+            return int(self._limits.get(host, self.initial))
+
+    def acquire(self, host):
+        self.sync(host)
+        with self._condition:
+            while self._in_flight.get(host, 0) >= int(self._limits.setdefault(host, float(self.initial))):
+                self._condition.wait()
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+
+    def try_acquire(self, host, sync=True):
+        """Take a slot if the host is below its limit, without waiting"""
+        if sync:
+            self.sync(host)
+        with self._condition:
+            if self._in_flight.get(host, 0) >= int(self._limits.setdefault(host, float(self.initial))):
+                return False
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            return True
+
+    def release(self, host, status=None, throttled=None, publish=True):
+        """
+        Return a slot. Pass the response status, or `throttled=True` for
+        timeouts; a release without either (e.g. a connection error that is
+        the proxy's fault) leaves the limit unchanged.
+
+        Returns the lowered limit when this release backed off, else None.
+        """
+        if throttled is None:
+            throttled = status in self.THROTTLE_STATUSES
+        published = None
+
+        with self._condition:
+            self._in_flight[host] = max(0, self._in_flight.get(host, 0) - 1)
+            limit = self._limits.setdefault(host, float(self.initial))
+            now = time.monotonic()
+
+            if throttled:
+                published = self._decrease(host, now)
+            elif status is not None and status < 400:
+                self._limits[host] = min(float(self.ceiling), limit + 1.0 / limit)
+
+            self._condition.notify_all()
+
+        _notify(self._listeners)
+        if published is not None:
+            for peer in self._peers:
+                peer.back_off(host)
+            if publish:
+                self.publish(host, published)
+        return published
+
+    def _decrease(self, host, now):
+        # Called with the condition held; returns the lowered limit, or None within the cooldown
+        if now - self._last_decrease.get(host, 0.0) < self.cooldown:
+            return None
+        self._limits[host] = max(float(self.floor), self._limits.setdefault(host, float(self.initial)) * self.decrease)
+        self._last_decrease[host] = now
+        logger.warning(f"Throttled by {host}, concurrency limit lowered to {int(self._limits[host])}")
+        return self._limits[host]
+
+    def back_off(self, host):
+        """Apply a decrease seen by a linked limiter; returns the lowered limit, or None within the cooldown"""
+        with self._condition:
+            return self._decrease(host, time.monotonic())
+
+    def link(self, other):
+        """Share decreases with another limiter of this process, in both directions"""
+        self._peers.append(other)
+        other._peers.append(self)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def publish(self, host, limit):
+        """Share a lowered limit with other processes"""
+        if not self.state_store:
+            return
+        try:
+            self.state_store.set(f'rate_limit:{host}', {'limit': limit, 'at': time.time()})
+        except Exception as e:
+            logger.warning(f"Could not publish rate limit for {host}: {str(e)}")
+
+    def sync(self, host):
+        """Adopt a lower limit recently published by another process"""
+        if not self.state_store:
+            return
+        now = time.monotonic()
+        with self._condition:
+            if now - self._last_sync.get(host, 0.0) < self.sync_interval:
+                return
+            self._last_sync[host] = now
+        try:
+            shared = self.state_store.get(f'rate_limit:{host}')
+        except Exception as e:
+            logger.warning(f"Could not read shared rate limit for {host}: {str(e)}")
+            return
+        if not shared or time.time() - shared.get('at', 0) > self.shared_ttl:
+            return
+        with self._condition:
+            current = self._limits.get(host, float(self.initial))
+            if shared['limit'] < current:
+                self._limits[host] = max(float(self.floor), float(shared['limit']))
+
+
+class ScraperStateStore:
+    """Shares rate limiter state between processes through the ScraperState table"""
+
+    def _close_thread_connection(self):
+        # Worker threads get their own connection; don't leave it open
+        if threading.current_thread() is not threading.main_thread():
+            from django.db import connection
+            connection.close()
+
+    def get(self, key):
+        from lcwaikiki.models import ScraperState
+        try:
+            return ScraperState.get_value(key)
+        finally:
+            self._close_thread_connection()
+
+    def set(self, key, value):
+        from lcwaikiki.models import ScraperState
+        try:
+            ScraperState.set_value(key, value)
+        finally:
+            self._close_thread_connection()
+
+
+# Config property holding the ceiling of each process-wide rate limiter, and its default
+RATE_LIMIT_POOLS = {
+    'requests': ('max_concurrent_requests', 5),
+    'listing': ('listing_max_concurrent_requests', 12),
+}
+_rate_limiters = {}
+_rate_limiter_lock = threading.Lock()
+
+
+def _rate_limit_config(pool='requests'):
+    """Return the active Config's (ceiling of `pool`, coordinate_rate_limits)"""
+    ceiling_property, ceiling = RATE_LIMIT_POOLS[pool]
+    coordinate = False
+    try:
+        from lcwaikiki.models import Config
+        config = Config.objects.filter(is_active=True).first() or Config.objects.first()
+        if config:
+            ceiling = getattr(config, ceiling_property)
+            if isinstance(config.brands, dict):
+                coordinate = bool(config.brands.get('stock_config', {}).get('coordinate_rate_limits', False))
+    except Exception as e:
+        logger.warning(f"Could not load rate limit configuration: {str(e)}")
+    return ceiling, coordinate
+
+
+def get_rate_limiter(pool='requests'):
+    """
+    Return the process-wide AdaptiveRateLimiter of a request pool. The
+    'requests' pool (product pages and inventory, threaded or async) is
+    capped at the active Config's max_concurrent_requests, the 'listing'
+    pool (listing pages) at listing_max_concurrent_requests. The pools are
+    linked, so a throttling response seen by one backs off the other too;
+    setting `coordinate_rate_limits` in the config's stock_config shares
+    backoffs with other processes via the DB.
+    """
+    with _rate_limiter_lock:
+        if pool not in _rate_limiters:
+            ceiling, coordinate = _rate_limit_config(pool)
+            limiter = AdaptiveRateLimiter(ceiling, state_store=ScraperStateStore() if coordinate else None)
+            for other in _rate_limiters.values():
+                limiter.link(other)
+            _rate_limiters[pool] = limiter
+        return _rate_limiters[pool]
+
+
+class SessionPool:
+    """
+    Hands out one `requests.Session` per (worker thread, proxy).
+
+    Sessions are never shared between threads, so nothing has to be locked
+    and per-request headers cannot leak from one worker into another, while
+    each worker still reuses its keep-alive/TLS connections to a host for as
+    long as it sticks to the same proxy. A worker only has one request in
+    flight at a time, so every adapter pool holds `pool_maxsize` connections
+    for each of up to `pool_connections` hosts.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=2):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._local = threading.local()
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _new_session(self, proxy):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if proxy:
+            session.proxies.update({'http': proxy, 'https': proxy})
+        return session
+
+    def get(self, proxy=None):
+        """Return the calling thread's session for `proxy` (None for a direct connection)"""
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        session = sessions.get(proxy)
+        if session is None:
+            session = sessions[proxy] = self._new_session(proxy)
+            with self._lock:
+                self._sessions.add(session)
+        return session
+
+    def close(self):
+        """
+        Close the connections of every session handed out so far. A session
+        used again afterwards opens new connections.
+        """
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.close()
+
+
+def host_of(url):
+    """Return the network location of a URL, used as the per-host limiter key"""
+    return urlparse(url).netloc
+
+
+class ThreadedCrawlEngine:
+    """
+    Producer/consumer crawl engine backed by a thread pool.
+
+    Work items are submitted lazily so that at most `max_in_flight` of them are
+    queued or running at any time, each call is wrapped in the per-host
+    limiter, and results are yielded in submission order. Items that finish
+    early are buffered until the ones before them are done, which keeps
+    downstream consumers (dedup, checkpoints, page positions) deterministic.
+    A task may raise RetryLater to wait on the delay queue without holding
+    a worker.
+
+    Each `map()` call runs on a thread pool of its own, unless an `executor`
+    is given: then all calls share it, and its threads (with their
+    keep-alive sessions) outlive a single call. The owner shuts it down.
+    """
+
+    def __init__(self, max_workers, max_in_flight=None, per_host_limit=None, limiter=None, executor=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_in_flight = max(self.max_workers, int(max_in_flight or self.max_workers * 2))
+        self.limiter = limiter or HostLimiter(per_host_limit or self.max_workers)
+        self.executor = executor
+
+    def _call(self, call, host):
+        if host is None:
+            return call()
+        self.limiter.acquire(host)
+        try:
+            return call()
+        except RetryLater as retry:
+            # The host slot is given back while the retry waits; take it again on resume
+            raise RetryLater(retry.delay, partial(self._call, retry.resume, host), str(retry)) from None
+        finally:
+            self.limiter.release(host)
+
+    def map(self, func, items, host_for=None, should_stop=None, ordered=True):
+        """
+        Run `func` over `items` concurrently and yield `(item, result, error)`
+        tuples in the order the items were given.
+
+        Args:
+            func: Callable executed in a worker thread for each item
+            items: Iterable of work items, consumed lazily
+            host_for: Optional callable mapping an item to the host it hits
+            should_stop: Optional callable; once it returns True no new items
+                are submitted and only the in-flight ones are drained
+            ordered: When False, results are yielded as they complete, so an
+                item waiting for a retry does not hold back the ones after it
+        """
+        items = iter(items)
+        pending = {}
+        next_submit = 0
+        next_yield = 0
+        exhausted = False
+
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_in_flight:
+                    if should_stop and should_stop():
+                        exhausted = True
+                        break
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    host = host_for(item) if host_for else None
+                    pending[next_submit] = (item, submit_retrying(executor, self._call, partial(func, item), host))
+                    next_submit += 1
+
+                if not pending:
+                    break
+
+                if ordered:
+                    key = next_yield
+                    next_yield += 1
+                else:
+                    done, _ = wait([future for _, future in pending.values()], return_when=FIRST_COMPLETED)
+                    key = next(key for key, (_, future) in pending.items() if future in done)
+                item, future = pending.pop(key)
+                result, error = None, None
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Crawl task {item!r} failed: {str(e)}")
+                    error = e
+                yield item, result, error
+        finally:
+            if self.executor is None:
+                executor.shutdown(wait=True)
+
+
+class FetchedResponse:
+    """
+    Minimal stand-in for `requests.Response` produced by the async engine.
+
+    Only the attributes the scrapers actually read are provided, so the same
+    parsing code works with responses from either engine.
+    """
+
+    def __init__(self, url, status_code, content, headers=None, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.encoding = encoding or 'utf-8'
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.content.decode(self.encoding, errors='replace')
+        return self._text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"HTTP {self.status_code} for url: {self.url}")
+
+
+class AsyncCrawlEngine:
+    """
+    asyncio/aiohttp crawl engine for I/O-bound fetches.
+
+    A single event loop runs on a background thread and keeps up to
+    `concurrency` requests on a pooled keep-alive connector, while the calling
+    thread consumes responses in submission order. Retry and proxy rotation
+    follow the same RetryPolicy as `ProductScraper.fetch`: each proxy (or
+    direct connection round) is tried `max_retries` times with a linear
+    backoff before the next one is picked.
+    With a `proxy_manager`, proxies are picked by health and every outcome is
+    reported back, and a blocked or timed-out proxy is abandoned at once.
+    Every attempt also takes a slot of the shared `limiter` (HostLimiter) and
+    `rate_limiter` (AdaptiveRateLimiter) when given, so async and threaded
+    crawls in one process stay under the same caps. The engine never changes
+    the rate limiter's ceiling, and keeps no more requests in flight than it
+    allows: `concurrency` is capped at that ceiling. Coroutines waiting for a
+    slot sleep on an event that the limiters' release listeners set, and the
+    rate limiter's database coordination runs in an executor, off the event
+    loop.
+    aiohttp is only imported when this engine is used.
+    """
+
+    def __init__(self, concurrency=100, per_host_limit=None, timeout=30, max_retries=3,
+                 retry_delay=5, proxies=None, max_proxy_attempts=3, headers_factory=None,
+                 proxy_manager=None, limiter=None, rate_limiter=None, retry_policy=None):
+        self.concurrency = max(1, int(concurrency))
+        if rate_limiter is not None:
+            self.concurrency = min(self.concurrency, rate_limiter.ceiling)
+        self.per_host_limit = int(per_host_limit or self.concurrency)
+        self.max_in_flight = self.concurrency * 2
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy(max_retries, retry_delay, max_proxy_attempts)
+        self.proxies = list(proxies or [])
+        self.headers_factory = headers_factory or (lambda: {})
+        self.proxy_manager = proxy_manager
+        self.limiter = limiter
+        self.rate_limiter = rate_limiter
+        self._slot_freed = None  # asyncio.Event of the running loop, set (and replaced) on every limiter release
+
+    @property
+    def _coordinated(self):
+        return self.rate_limiter is not None and self.rate_limiter.state_store is not None
+
+    def _try_acquire(self, host):
+        if self.limiter is not None and not self.limiter.try_acquire(host):
+            return False
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire(host, sync=False):
+            if self.limiter is not None:
+                # Held only for this check, so nobody waits for it; waking the waiters would spin
+                self.limiter.release(host, notify=False)
+            return False
+        return True
+
+    async def _acquire(self, host):
+        """Take a slot of both limiters, sleeping until a release frees one"""
+        if self._coordinated:
+            # The shared limit is read through the Django ORM, which must not run on the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.sync, host)
+        while not self._try_acquire(host):
+            await self._slot_freed.wait()
+
+    def _release(self, host, status=None, throttled=None):
+        if self.rate_limiter is not None:
+            lowered = self.rate_limiter.release(host, status, throttled=throttled, publish=False)
+            if lowered is not None and self._coordinated:
+                asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.publish, host, lowered)
+        if self.limiter is not None:
+            self.limiter.release(host)
+
+    def _wake_waiters(self):
+        slot_freed, self._slot_freed = self._slot_freed, asyncio.Event()
+        slot_freed.set()
+
+    def _watch_limiters(self):
+        """Wake waiting coroutines whenever a slot is released, from any thread; returns the unsubscribe callable"""
+        loop = asyncio.get_running_loop()
+        self._slot_freed = asyncio.Event()
+
+        def released():
+            try:
+                loop.call_soon_threadsafe(self._wake_waiters)
+            except RuntimeError:  # The loop has already closed
+                pass
+
+        limiters = [limiter for limiter in (self.limiter, self.rate_limiter) if limiter is not None]
+        for limiter in limiters:
+            limiter.add_listener(released)
+
+        def unsubscribe():
+            for limiter in limiters:
+                limiter.remove_listener(released)
+        return unsubscribe
+
+    def _pick_proxy(self, proxies_left):
+        if not proxies_left:
+            return None
+        if self.proxy_manager:
+            return self.proxy_manager.acquire(exclude=set(self.proxies) - set(proxies_left))
+        return random.choice(proxies_left)
+
+    def _report(self, proxy, latency=None, trip=False):
+        if not self.proxy_manager:
+            return
+        if latency is not None:
+            self.proxy_manager.report_success(proxy, latency)
+        else:
+            self.proxy_manager.report_failure(proxy, trip=trip)
+
+    async def _request(self, session, url, method='GET', payload=None, headers=None):
+        host = host_of(url)
+        proxies_left = list(self.proxies)
+        for _ in range(self.retry_policy.proxy_rounds(self.proxies)):
+            proxy = None
+            if self.proxies:
+                proxy = self._pick_proxy(proxies_left)
+                if proxy is None:
+                    break  # Every proxy has been tried
+                proxies_left.remove(proxy)
+
+            attempt = 0
+            while True:
+                attempt += 1
+                loop = asyncio.get_running_loop()
+                await self._acquire(host)
+                started = loop.time()
+                status = throttled = None
+                try:
+                    async with session.request(
+                        method, url, json=payload, proxy=proxy, headers={**self.headers_factory(), **(headers or {})}
+                    ) as response:
+                        status = response.status
+                        content = await response.read()
+                        # 304 only comes back for conditional requests
+                        if response.status in (200, 304):
+                            self._report(proxy, latency=loop.time() - started)
+                            return FetchedResponse(
+                                str(response.url), response.status, content,
+                                dict(response.headers), response.charset
+                            )
+                        logger.warning(f"HTTP {response.status} for {url} with proxy {proxy}, attempt {attempt}")
+                        self._report(proxy, trip=response.status == 403)
+                except asyncio.TimeoutError:
+                    throttled = True
+                    logger.warning(f"Timeout for {url} with proxy {proxy}, attempt {attempt}")
+                    self._report(proxy, trip=True)
+                except Exception as e:
+                    logger.warning(f"Request error for {url} with proxy {proxy}, attempt {attempt}: {str(e)}")
+                    self._report(proxy)
+                finally:
+                    self._release(host, status, throttled)
+
+                if self.retry_policy.round_over(attempt, proxy, self.proxy_manager):
+                    break  # Move on to the next proxy right away
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+
+        logger.error(f"All proxy attempts failed for {url}")
+        return None
+
+    async def _run(self, items, url_for, payload_for, method, results, window, should_stop, headers_for=None):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.per_host_limit,
+            ttl_dns_cache=300
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async def worker(seq, item, session):
+            try:
+                payload = payload_for(item) if payload_for else None
+                headers = headers_for(item) if headers_for else None
+                response = await self._request(session, url_for(item), method, payload, headers)
+                results.put((seq, item, response, None))
+            except Exception as e:
+                results.put((seq, item, None, e))
+
+        unsubscribe = self._watch_limiters()
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                tasks = set()
+                for seq, item in enumerate(items):
+                    if should_stop and should_stop():
+                        break
+                    # The window is released by the consumer, which bounds memory use
+                    await window.acquire()
+                    task = asyncio.create_task(worker(seq, item, session))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+        finally:
+            unsubscribe()
+
+    def map(self, items, url_for, should_stop=None, method='GET', payload_for=None, headers_for=None):
+        """
+        Fetch every item's URL and yield `(item, response, error)` tuples in the
+        order the items were given. `response` is a `FetchedResponse`, or None
+        when every retry and proxy failed. `headers_for` may add per-item
+        request headers, e.g. conditional request validators.
+        """
+        results = queue.Queue()
+        state = {}
+        ready = threading.Event()
+        cancelled = threading.Event()
+
+        def stop_requested():
+            return cancelled.is_set() or bool(should_stop and should_stop())
+
+        def release_window():
+            if 'loop' in state and not state['loop'].is_closed():
+                try:
+                    state['loop'].call_soon_threadsafe(state['window'].release)
+                except RuntimeError:
+                    pass
+
+        def run_loop():
+            async def main():
+                state['loop'] = asyncio.get_running_loop()
+                state['window'] = asyncio.Semaphore(self.max_in_flight)
+                ready.set()
+                await self._run(
+                    items, url_for, payload_for, method, results, state['window'], stop_requested, headers_for
+                )
+
+            try:
+                asyncio.run(main())
+            except Exception as e:
+                logger.error(f"Async crawl engine stopped: {str(e)}")
+            finally:
+                ready.set()
+                results.put(_DONE)
+
+        thread = threading.Thread(target=run_loop, name='async-crawl-engine', daemon=True)
+        thread.start()
+        ready.wait()
+
+        buffered = {}
+        next_yield = 0
+        done = False
+        try:
+            while not done or next_yield in buffered:
+                if next_yield not in buffered:
+                    message = results.get()
+                    if message is _DONE:
+                        done = True
+                        continue
+                    seq, item, response, error = message
+                    buffered[seq] = (item, response, error)
+                    continue
+
+                item, response, error = buffered.pop(next_yield)
+                next_yield += 1
+                release_window()
+                yield item, response, error
+        finally:
+            if not done:
+                # The consumer stopped early: stop scheduling and let in-flight requests drain
+                cancelled.set()
+                release_window()
+            else:
+                thread.join()
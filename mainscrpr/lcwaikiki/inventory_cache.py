@@ -0,0 +1,137 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from django.utils import timezone
+
+from .models import InventorySnapshot
+
+logger = logging.getLogger(__name__)
+
+# Default freshness of a cached inventory response per product tier, in seconds.
+# Overridden by `inventory_ttl` in the config's stock_config; 0 disables caching for a tier.
+DEFAULT_TTLS = {
+    'default': 3600,
+    'discounted': 1800,  # Discounted products sell out faster
+    'low_stock': 600,  # A size with only a few items left may sell out any minute
+}
+LOW_STOCK_THRESHOLD = 3
+
+
+def inventory_tier(size_data, discount_ratio=None):
+    """Freshness tier of a size: low_stock, discounted or default"""
+    stock = size_data.get('size_general_stock') or 0
+    if 0 < stock <= LOW_STOCK_THRESHOLD:
+        return 'low_stock'
+    if discount_ratio:
+        return 'discounted'
+    return 'default'
+
+
+class InventoryCache:
+    """
+    TTL cache of store inventory responses keyed by size reference and city.
+
+    Lookups go to an in-process LRU first and then to the InventorySnapshot
+    table, which keeps responses across runs and between processes. The
+    caller passes the maximum acceptable age per lookup, so freshness can
+    differ by product tier while the entries are shared. New entries reach
+    the table when flush() is called.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (size_reference, city_id) -> (fetched_at, data)
+        self._pending = {}  # Entries not yet written to InventorySnapshot, same shape
+        self._lock = threading.Lock()
+
+    def get_many(self, max_ages, city_id):
+        """
+        Return the cached responses still fresh enough, keyed by size reference.
+
+        Args:
+            max_ages: Maximum age in seconds keyed by size reference
+            city_id: City the inventory is for
+        """
+        city_id = str(city_id)
+        now = timezone.now()
+        found = {}
+        missing = []
+        with self._lock:
+            for ref, max_age in max_ages.items():
+                if max_age <= 0:
+                    continue
+                entry = self._entries.get((ref, city_id))
+                if entry and (now - entry[0]).total_seconds() <= max_age:
+                    self._entries.move_to_end((ref, city_id))
+                    found[ref] = entry[1]
+                else:
+                    missing.append(ref)
+
+        if missing:
+            try:
+                snapshots = InventorySnapshot.objects.filter(
+                    city_id=city_id, size_reference__in=missing
+                ).values_list('size_reference', 'data', 'fetched_at')
+                for ref, data, fetched_at in snapshots:
+                    if (now - fetched_at).total_seconds() <= max_ages[ref]:
+                        found[ref] = data
+                        self._remember(ref, city_id, fetched_at, data)
+            except Exception as e:
+                logger.warning(f"Could not read cached inventory: {str(e)}")
+        return found
+
+    def set_many(self, inventories, city_id):
+        """
+        Cache fresh responses, keyed by size reference.
+
+        They are served from memory at once; the InventorySnapshot rows are
+        only written by the next flush(), so a thread that fetches inventory
+        can leave the database writes to another.
+        """
+        city_id = str(city_id)
+        now = timezone.now()
+        for ref, data in inventories.items():
+            self._remember(ref, city_id, now, data)
+        with self._lock:
+            for ref, data in inventories.items():
+                self._pending[(ref, city_id)] = (now, data)
+
+    def flush(self):
+        """Write the responses cached since the last flush with a single upsert"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            InventorySnapshot.objects.bulk_create(
+                [
+                    InventorySnapshot(size_reference=ref, city_id=city_id, data=data, fetched_at=fetched_at)
+                    for (ref, city_id), (fetched_at, data) in pending.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['size_reference', 'city_id'],
+                update_fields=['data', 'fetched_at'],
+            )
+        except Exception as e:
+            logger.warning(f"Could not store cached inventory: {str(e)}")
+
+    def _remember(self, ref, city_id, fetched_at, data):
+        with self._lock:
+            self._entries[(ref, city_id)] = (fetched_at, data)
+            self._entries.move_to_end((ref, city_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_inventory_cache():
+    """Return the process-wide InventoryCache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = InventoryCache()
+        return _cache
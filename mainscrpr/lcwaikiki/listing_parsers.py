@@ -0,0 +1,316 @@
+import abc
+import html as html_lib
+import logging
+import re
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Classes of the price/availability elements inside a listing product card
+PRICE_CLASS = 'product-price__price'
+OLD_PRICE_CLASS = 'product-price__old-price'
+DISCOUNT_CLASS = 'product-price__discount'
+OUT_OF_STOCK_CLASS = 'product-card__out-of-stock'
+CARD_FIELD_CLASSES = (PRICE_CLASS, OLD_PRICE_CLASS, DISCOUNT_CLASS, OUT_OF_STOCK_CLASS)
+
+
+def parse_price(text):
+    """
+    Parse a Turkish formatted price ("1.299,99 TL", "349 TL") into a Decimal
+    with two decimal places, or None if the text holds no price.
+    """
+    if not text:
+        return None
+    value = re.sub(r'[^0-9,.]', '', text)
+    if ',' in value:
+        value = value.replace('.', '').replace(',', '.')
+    elif re.fullmatch(r'\d{1,3}(\.\d{3})+', value):
+        value = value.replace('.', '')
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+class ListingParser(abc.ABC):
+    """
+    Extracts the bits of an lcw.com listing page the crawlers need.
+
+    `product_cards` returns one dict per `div.product-card` that has a link,
+    with its 1-based position among all cards, the raw href, and the price,
+    discount ratio (as a fraction) and availability shown on the card.
+    Prices are strings so cards stay JSON serializable; fields missing from
+    the card are None.
+    `listing_counts` returns `(product_count, per_page)`, either may be None.
+    Backends differ only in speed; they must return identical results.
+    Parsers hold no state, so one instance can be shared between threads.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def product_cards(self, html):
+        """Return the product cards of a listing page"""
+
+    @abc.abstractmethod
+    def listing_counts(self, html):
+        """Return `(product_count, per_page)` of a listing page"""
+
+    @staticmethod
+    def _card(position, href, texts):
+        """
+        Build a card record. `texts` maps each of CARD_FIELD_CLASSES to the
+        element's text, or None when the card has no such element.
+        """
+        price = parse_price(texts.get(PRICE_CLASS))
+        old_price = parse_price(texts.get(OLD_PRICE_CLASS))
+
+        discount_ratio = None
+        discount_text = texts.get(DISCOUNT_CLASS)
+        discount_match = re.search(r'\d+', discount_text or '')
+        if discount_match:
+            discount_ratio = (Decimal(discount_match.group()) / 100).quantize(Decimal('0.01'))
+        elif price and old_price and old_price > price:
+            discount_ratio = ((old_price - price) / old_price).quantize(Decimal('0.01'))
+
+        return {
+            'position': position,
+            'href': href,
+            'price': str(price) if price is not None else None,
+            'discount_ratio': str(discount_ratio) if discount_ratio is not None else None,
+            'in_stock': texts.get(OUT_OF_STOCK_CLASS) is None,
+        }
+
+    @staticmethod
+    def _to_int(text):
+        if not text:
+            return None
+        match = re.search(r'\d+', text.replace('.', ''))
+        return int(match.group()) if match else None
+
+
+class BeautifulSoupParser(ListingParser):
+    """Reference implementation, builds a full tree with html.parser"""
+
+    name = 'bs4'
+
+    def product_cards(self, html):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        cards = []
+        for position, product_card in enumerate(soup.select('div.product-card'), 1):
+            link = product_card.find('a', href=True)
+            if link:
+                texts = {}
+                for class_name in CARD_FIELD_CLASSES:
+                    element = product_card.find(class_=class_name)
+                    texts[class_name] = element.get_text(strip=True) if element else None
+                cards.append(self._card(position, link['href'], texts))
+        return cards
+
+    def listing_counts(self, html):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        product_count = per_page = None
+
+        count_element = soup.find('span', {'class': 'product-list-heading__product-count'})
+        if count_element and count_element.find('p'):
+            product_count = self._to_int(count_element.find('p').get_text(strip=True))
+
+        pagination_info = soup.find('div', {'class': 'paginator__info-text'})
+        if pagination_info:
+            viewed = pagination_info.find('span', {'class': 'paginator__info-text-viewed-products'})
+            if viewed:
+                per_page = self._to_int(viewed.get_text(strip=True))
+
+        return product_count, per_page
+
+
+class LxmlParser(ListingParser):
+    """libxml2 based tree, several times faster than html.parser"""
+
+    name = 'lxml'
+    CARD_XPATH = "//div[contains(concat(' ', normalize-space(@class), ' '), ' product-card ')]"
+
+    @staticmethod
+    def _class_xpath(tag, class_name):
+        return f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+    def product_cards(self, html):
+        from lxml import html as lxml_html
+
+        tree = lxml_html.fromstring(html)
+        cards = []
+        for position, product_card in enumerate(tree.xpath(self.CARD_XPATH), 1):
+            links = product_card.xpath('.//a[@href]')
+            if links:
+                texts = {}
+                for class_name in CARD_FIELD_CLASSES:
+                    elements = product_card.xpath('.' + self._class_xpath('*', class_name))
+                    texts[class_name] = elements[0].text_content().strip() if elements else None
+                cards.append(self._card(position, links[0].get('href'), texts))
+        return cards
+
+    def listing_counts(self, html):
+        from lxml import html as lxml_html
+
+        tree = lxml_html.fromstring(html)
+        product_count = per_page = None
+
+        counts = tree.xpath(self._class_xpath('span', 'product-list-heading__product-count') + '//p')
+        if counts:
+            product_count = self._to_int(counts[0].text_content().strip())
+
+        viewed = tree.xpath(
+            self._class_xpath('div', 'paginator__info-text')
+            + "//span[contains(concat(' ', normalize-space(@class), ' '), ' paginator__info-text-viewed-products ')]"
+        )
+        if viewed:
+            per_page = self._to_int(viewed[0].text_content().strip())
+
+        return product_count, per_page
+
+
+class SelectolaxParser(ListingParser):
+    """Lexbor based parser, the fastest tree builder available"""
+
+    name = 'selectolax'
+
+    def product_cards(self, html):
+        from selectolax.lexbor import LexborHTMLParser
+
+        tree = LexborHTMLParser(html)
+        cards = []
+        for position, product_card in enumerate(tree.css('div.product-card'), 1):
+            link = product_card.css_first('a[href]')
+            if link is not None:
+                texts = {}
+                for class_name in CARD_FIELD_CLASSES:
+                    element = product_card.css_first(f'.{class_name}')
+                    texts[class_name] = element.text(strip=True) if element is not None else None
+                cards.append(self._card(position, link.attributes.get('href'), texts))
+        return cards
+
+    def listing_counts(self, html):
+        from selectolax.lexbor import LexborHTMLParser
+
+        tree = LexborHTMLParser(html)
+        product_count = per_page = None
+
+        count_element = tree.css_first('span.product-list-heading__product-count p')
+        if count_element is not None:
+            product_count = self._to_int(count_element.text(strip=True))
+
+        viewed = tree.css_first('div.paginator__info-text span.paginator__info-text-viewed-products')
+        if viewed is not None:
+            per_page = self._to_int(viewed.text(strip=True))
+
+        return product_count, per_page
+
+
+class RegexParser(ListingParser):
+    """
+    Targeted scanner that never builds a tree.
+
+    Card boundaries are the opening tags of `product-card` divs; the first
+    `<a href>` between one card and the next belongs to that card. This
+    matches the tree parsers as long as cards are not nested, which holds
+    for the listing markup.
+    """
+
+    name = 'regex'
+    DIV_RE = re.compile(r'<div\b[^>]*?\bclass\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+    HREF_RE = re.compile(r'<a\b[^>]*?\bhref\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+    COUNT_RE = re.compile(
+        r'class\s*=\s*["\'][^"\']*\bproduct-list-heading__product-count\b[^"\']*["\'][^>]*>.*?<p\b[^>]*>(.*?)</p>',
+        re.IGNORECASE | re.DOTALL
+    )
+    PER_PAGE_RE = re.compile(
+        r'class\s*=\s*["\'][^"\']*\bpaginator__info-text-viewed-products\b[^"\']*["\'][^>]*>(.*?)</span>',
+        re.IGNORECASE | re.DOTALL
+    )
+    TAG_RE = re.compile(r'<[^>]+>')
+    FIELD_RES = {
+        class_name: re.compile(
+            r'<([a-z][a-z0-9]*)\b[^>]*?\bclass\s*=\s*["\'](?:[^"\']*\s)?'
+            + re.escape(class_name)
+            + r'(?:\s[^"\']*)?["\'][^>]*>(.*?)</\1\s*>',
+            re.IGNORECASE | re.DOTALL
+        )
+        for class_name in CARD_FIELD_CLASSES
+    }
+
+    def _card_starts(self, html):
+        return [
+            match.start() for match in self.DIV_RE.finditer(html)
+            if 'product-card' in match.group(1).split()
+        ]
+
+    def product_cards(self, html):
+        starts = self._card_starts(html)
+        cards = []
+        for position, start in enumerate(starts, 1):
+            end = starts[position] if position < len(starts) else len(html)
+            link = self.HREF_RE.search(html, start, end)
+            if link:
+                texts = {}
+                for class_name, field_re in self.FIELD_RES.items():
+                    element = field_re.search(html, start, end)
+                    texts[class_name] = self._text(element.group(2)) if element else None
+                cards.append(self._card(position, html_lib.unescape(link.group(1)), texts))
+        return cards
+
+    def _text(self, fragment):
+        return html_lib.unescape(self.TAG_RE.sub('', fragment)).strip()
+
+    def listing_counts(self, html):
+        count = self.COUNT_RE.search(html)
+        viewed = self.PER_PAGE_RE.search(html)
+        return (
+            self._to_int(self._text(count.group(1))) if count else None,
+            self._to_int(self._text(viewed.group(1))) if viewed else None,
+        )
+
+
+PARSERS = {
+    parser.name: parser
+    for parser in (BeautifulSoupParser, LxmlParser, SelectolaxParser, RegexParser)
+}
+
+# Preference order for 'auto': fastest tree builder that is installed
+AUTO_ORDER = ('selectolax', 'lxml', 'bs4')
+
+_MODULES = {'bs4': 'bs4', 'lxml': 'lxml', 'selectolax': 'selectolax', 'regex': 're'}
+
+
+@lru_cache(maxsize=None)
+def is_available(name):
+    """Return True if the optional dependency of a backend is installed (probed once per name)"""
+    try:
+        __import__(_MODULES[name])
+        return True
+    except ImportError:
+        return False
+
+
+def available_parsers():
+    return [name for name in PARSERS if is_available(name)]
+
+
+@lru_cache(maxsize=None)
+def get_parser(name='auto'):
+    """
+    Return the shared parser instance for a name. 'auto' picks the fastest
+    installed tree parser; an unknown or unavailable name falls back to
+    BeautifulSoup. The backend is resolved once per name, since crawlers
+    call this for every page.
+    """
+    if name == 'auto':
+        name = next((candidate for candidate in AUTO_ORDER if is_available(candidate)), 'bs4')
+    if name not in PARSERS or not is_available(name):
+        logger.warning(f"Listing parser {name!r} is not available, using bs4")
+        name = 'bs4'
+    return PARSERS[name]()
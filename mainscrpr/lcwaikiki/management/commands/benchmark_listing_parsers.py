@@ -0,0 +1,72 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from lcwaikiki.listing_parsers import PARSERS, get_parser, is_available
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the listing page parser backends on a saved or fetched listing page'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            help='Path to a saved listing page HTML file',
+        )
+        parser.add_argument(
+            '--url',
+            help='Listing page URL to fetch and parse',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Number of times every backend parses the page',
+        )
+
+    def _load_html(self, options):
+        if options['file']:
+            with open(options['file'], 'r', encoding='utf-8') as f:
+                return f.read()
+        if options['url']:
+            response = requests.get(options['url'], timeout=20, headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            })
+            response.raise_for_status()
+            return response.text
+        raise CommandError('Either --file or --url is required')
+
+    def _time(self, func, html, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            result = func(html)
+        return (time.perf_counter() - start) * 1000 / iterations, result
+
+    def handle(self, *args, **options):
+        html = self._load_html(options)
+        iterations = max(1, options['iterations'])
+        self.stdout.write(f'Page size: {len(html) / 1024:.1f} KB, {iterations} iterations per backend')
+
+        reference = None
+        for name in PARSERS:
+            if not is_available(name):
+                self.stdout.write(self.style.WARNING(f'{name:<12} not installed, skipped'))
+                continue
+
+            parser = get_parser(name)
+            cards_ms, cards = self._time(parser.product_cards, html, iterations)
+            counts_ms, counts = self._time(parser.listing_counts, html, iterations)
+
+            if reference is None:
+                reference = (cards, counts)
+            matches = (cards, counts) == reference
+
+            line = (
+                f'{name:<12} cards: {cards_ms:8.2f} ms/page ({len(cards)} found) | '
+                f'counts: {counts_ms:8.2f} ms/page {counts}'
+            )
+            if matches:
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(self.style.ERROR(f'{line} | results differ from bs4'))
@@ -0,0 +1,134 @@
+import html
+import json
+import re
+import time
+
+import requests
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand, CommandError
+
+from lcwaikiki.product_extractor import extract_product
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+def multi_pass_json(response):
+    """The previous extract_json_data: every lookup re-reads response.text"""
+    for script in re.findall(r'<script[^>]*>(.*?)</script>', response.text, re.DOTALL):
+        match = re.search(r'cartOperationViewModel\s*=\s*({.*?});', script, re.DOTALL)
+        if match:
+            json_str = re.sub(r'/\*.*?\*/', '', match.group(1).strip(), flags=re.DOTALL)
+            json_str = re.sub(r',\s*]', ']', re.sub(r',\s*}', '}', json_str))
+            try:
+                return json.loads(json_str)
+            except json.JSONDecodeError:
+                continue
+    meta_tag = re.search(r'<meta name="product-info" content="([^"]+)"', response.text)
+    if meta_tag:
+        try:
+            return json.loads(html.unescape(meta_tag.group(1)))
+        except json.JSONDecodeError:
+            pass
+    for variable in ('productDetailData', 'modal_data'):
+        match = re.search(rf'var\s+{variable}\s*=\s*({{.*?}});', response.text, re.DOTALL)
+        if match:
+            try:
+                return json.loads(re.sub(r',\s*]', ']', re.sub(r',\s*}', '}', match.group(1).strip())))
+            except json.JSONDecodeError:
+                pass
+    return None
+
+
+def multi_pass_extract(response):
+    """
+    Baseline: the extraction passes process_product_url used to make, i.e.
+    the JSON lookup twice, a soup tree, a regex pass over every meta tag and
+    a lower-cased copy of the page text, each reading response.text again.
+    """
+    multi_pass_json(response)  # process_product_url's own lookup
+    soup = BeautifulSoup(response.text, 'html.parser')
+    json_data = multi_pass_json(response)
+    product = {
+        'title': soup.select_one('h1.product-title').text.strip() if soup.select_one('h1.product-title') else None,
+        'product_code': None,
+    }
+    for tag in re.findall(r'<meta\s+([^>]+)>', response.text, re.IGNORECASE):
+        name_match = re.search(r'name=["\']?([^"\'>\s]+)', tag, re.IGNORECASE)
+        content_match = re.search(r'content=["\']?([^"\'>]+)', tag, re.IGNORECASE)
+        if name_match and content_match and name_match.group(1) == 'ProductCodeColorCode':
+            product['product_code'] = content_match.group(1).strip()
+            break
+    for selector in ('.product-code', '.selected-color', '.price-regular', '.discount-rate'):
+        element = soup.select_one(selector)
+        product[selector] = element.text.strip() if element else None
+    product['in_stock'] = 'out of stock' not in soup.text.lower()
+    description = soup.select_one('#collapseOne')
+    product['description'] = description.decode_contents().strip() if description else None
+    product['images'] = [img['src'] for img in soup.select('.product-image img') if 'src' in img.attrs]
+    product['sizes'] = [size.text.strip() for size in soup.select('.size-list .size')]
+    if json_data:
+        product['title'] = json_data.get('ModelName', product['title'])
+    return product
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the single-pass product page extractor against the previous multi-pass extraction'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            help='Path to a saved product page HTML file',
+        )
+        parser.add_argument(
+            '--url',
+            help='Product page URL to fetch and parse',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Number of times every extractor parses the page',
+        )
+
+    def _load_response(self, options):
+        """A requests.Response holding the raw page, so both extractors pay for decoding"""
+        if options['url']:
+            response = requests.get(options['url'], timeout=20, headers={'User-Agent': USER_AGENT})
+            response.raise_for_status()
+            return response
+        if options['file']:
+            response = requests.Response()
+            with open(options['file'], 'rb') as f:
+                response._content = f.read()
+            response.status_code = 200
+            response.encoding = 'utf-8'
+            response.url = f"https://www.lcw.com/{options['file'].rsplit('/', 1)[-1]}"
+            return response
+        raise CommandError('Either --file or --url is required')
+
+    def _time(self, func, response, iterations):
+        # CPU time, so the figures are not skewed by other load on the machine
+        start = time.process_time()
+        for _ in range(iterations):
+            result = func(response)
+        return (time.process_time() - start) * 1000 / iterations, result
+
+    def handle(self, *args, **options):
+        response = self._load_response(options)
+        iterations = max(1, options['iterations'])
+        self.stdout.write(f'Page size: {len(response.content) / 1024:.1f} KB, {iterations} iterations per extractor')
+
+        multi_ms, _ = self._time(multi_pass_extract, response, iterations)
+        single_ms, record = self._time(lambda r: extract_product(r.text, r.url), response, iterations)
+
+        self.stdout.write(f'multi-pass   {multi_ms:8.2f} ms CPU/page')
+        self.stdout.write(self.style.SUCCESS(
+            f'single-pass  {single_ms:8.2f} ms CPU/page ({multi_ms / single_ms if single_ms else 0:.1f}x faster)'
+        ))
+        if record is None:
+            self.stdout.write(self.style.ERROR('The single-pass extractor could not parse the page'))
+        else:
+            self.stdout.write(
+                f'Extracted: {record.title!r}, code {record.product_code}, price {record.price}, '
+                f'{len(record.sizes)} sizes, {len(record.images)} images'
+            )
@@ -0,0 +1,195 @@
+import gzip
+import logging
+import re
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone as dt_timezone
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from lcwaikiki.models import ProductAvailableUrl, ProductNewUrl, ScraperState
+from lcwaikiki.product_models import Product
+
+logger = logging.getLogger('lcwaikiki.discover_from_sitemap')
+
+SITEMAP_URL = 'https://www.lcw.com/sitemap.xml'
+PRODUCT_URL_PATTERN = r'-o-\d+'  # Product pages end in "-o-<option id>"
+STATE_KEY = 'sitemap_discovery'
+BATCH_SIZE = 1000
+REQUEST_TIMEOUT = 30
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept-Encoding': 'gzip, deflate',
+}
+
+
+def parse_lastmod(value):
+    """Parse a sitemap <lastmod> (W3C datetime or plain date) into an aware datetime"""
+    if not value:
+        return None
+    value = value.strip()
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            return None
+        parsed = datetime(date.year, date.month, date.day)
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def iter_sitemap(session, url):
+    """
+    Stream a sitemap or sitemap index and yield `(kind, loc, lastmod)` tuples,
+    where kind is 'sitemap' for index entries and 'url' for page entries.
+
+    The body is parsed incrementally with iterparse and every entry is
+    removed from its parent once read, so memory stays flat regardless of
+    file size.
+    `.xml.gz` files are decompressed on the fly; gzip transfer encoding is
+    handled by urllib3.
+    """
+    response = session.get(url, stream=True, timeout=REQUEST_TIMEOUT, headers=HEADERS)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    try:
+        stream = response.raw
+        content_type = response.headers.get('Content-Type', '')
+        if url.endswith('.gz') or 'gzip' in content_type:
+            stream = gzip.GzipFile(fileobj=stream)
+
+        loc = lastmod = None
+        parents = []
+        for event, element in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag == 'loc':
+                loc = (element.text or '').strip()
+            elif tag == 'lastmod':
+                lastmod = parse_lastmod(element.text)
+            elif tag in ('sitemap', 'url'):
+                if loc:
+                    yield tag, loc, lastmod
+                loc = lastmod = None
+                # Clearing alone would leave an empty element per entry on the root
+                if parents:
+                    parents[-1].remove(element)
+    finally:
+        response.close()
+
+
+class Command(BaseCommand):
+    help = 'Discovers new and changed products from the lcw.com product sitemaps'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sitemap-url',
+            default=SITEMAP_URL,
+            help='Sitemap or sitemap index URL (point it at a local server for testing)',
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Ignore the last run time and consider every URL in the sitemaps',
+        )
+        parser.add_argument(
+            '--since',
+            help='Only consider entries modified after this ISO date/datetime instead of the last run',
+        )
+        parser.add_argument(
+            '--url-pattern',
+            default=PRODUCT_URL_PATTERN,
+            help='Regex a page URL must match to be treated as a product',
+        )
+
+    def handle(self, *args, **options):
+        run_started_at = timezone.now()
+        state = ScraperState.get_value(STATE_KEY, {})
+
+        if options['full']:
+            since = None
+        elif options['since']:
+            since = parse_lastmod(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since value: {options['since']}")
+        else:
+            since = parse_lastmod(state.get('last_run'))
+
+        self.product_url_re = re.compile(options['url_pattern'])
+        self.since = since
+        self.stats = {'sitemaps': 0, 'seen': 0, 'new': 0, 'refresh': 0}
+        self._batch = []
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Starting sitemap discovery from {options['sitemap_url']}"
+            + (f", changes since {since.isoformat()}" if since else ', full scan')
+        ))
+
+        session = requests.Session()
+        try:
+            self.process_sitemap(session, options['sitemap_url'])
+            self.flush()
+        except Exception as e:
+            # Keep the previous last_run so the next run covers this window again
+            self.stdout.write(self.style.ERROR(f'Sitemap discovery failed: {str(e)}'))
+            return
+
+        state.update({'last_run': run_started_at.isoformat(), 'stats': self.stats})
+        ScraperState.set_value(STATE_KEY, state)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sitemap discovery completed: {self.stats['sitemaps']} sitemaps, {self.stats['seen']} changed "
+            f"product URLs, {self.stats['new']} new, {self.stats['refresh']} flagged for refresh"
+        ))
+
+    def is_fresh(self, lastmod):
+        # Entries without lastmod cannot be ruled out
+        return self.since is None or lastmod is None or lastmod > self.since
+
+    def process_sitemap(self, session, url):
+        self.stats['sitemaps'] += 1
+        logger.info(f"Reading sitemap {url}")
+
+        child_sitemaps = []
+        for kind, loc, lastmod in iter_sitemap(session, url):
+            if not self.is_fresh(lastmod):
+                continue
+            if kind == 'sitemap':
+                child_sitemaps.append(loc)
+            elif self.product_url_re.search(loc):
+                self.stats['seen'] += 1
+                self._batch.append(loc)
+                if len(self._batch) >= BATCH_SIZE:
+                    self.flush()
+
+        # Child sitemaps are read after the parent stream is closed
+        for child in child_sitemaps:
+            self.process_sitemap(session, child)
+
+    def flush(self):
+        """Queue unknown URLs as new and flag known products for refresh"""
+        if not self._batch:
+            return
+        urls = list(dict.fromkeys(self._batch))
+        self._batch = []
+
+        products = set(Product.objects.filter(url__in=urls).values_list('url', flat=True))
+        known = products.union(
+            ProductNewUrl.objects.filter(url__in=urls).values_list('url', flat=True),
+            ProductAvailableUrl.objects.filter(url__in=urls).values_list('url', flat=True),
+        )
+
+        current_time = timezone.now()
+        new_urls = [ProductNewUrl(url=url, last_checking=current_time) for url in urls if url not in known]
+        if new_urls:
+            ProductNewUrl.objects.bulk_create(new_urls)
+        refreshed = Product.objects.filter(url__in=products, needs_refresh=False).update(needs_refresh=True)
+
+        self.stats['new'] += len(new_urls)
+        self.stats['refresh'] += refreshed
@@ -2,23 +2,34 @@ import os
 import signal
 import sys
 import json
-import re
 import math
 import time
-from functools import wraps
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
 from typing import List, Dict, Set, Optional
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
 from tqdm.auto import tqdm
 from loguru import logger
 
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.conf import settings
-from lcwaikiki.models import Config, ProductAvailableUrl, ProductDeletedUrl, ProductNewUrl
+from django.db import connection, transaction
+from lcwaikiki.models import (
+    Config, ListingPageFingerprint, ProductAvailableUrl, ProductDeletedUrl, ProductNewUrl, ScraperState
+)
+from lcwaikiki.product_models import Product
+from lcwaikiki.product_scraper import DetailPipeline
+from lcwaikiki.crawl_engine import (
+    AdaptiveRateLimiter, AsyncCrawlEngine, HostLimiter, RetryLater, ThreadedCrawlEngine, get_rate_limiter,
+    host_of
+)
+from lcwaikiki.listing_parsers import get_parser
 
 # ---------------------------- Config ---------------------------- #
 class ScraperConfig:
@@ -29,6 +40,11 @@ class ScraperConfig:
     NEW_URLS_ENDPOINT = "/api/lcwaikiki/product/urls/new/"
     DELETED_URLS_ENDPOINT = "/api/lcwaikiki/product/urls/deleted/"
     MAX_WORKERS = 12
+    MAX_IN_FLIGHT = MAX_WORKERS * 3  # Pages queued or running at once
+    MAX_PER_HOST = MAX_WORKERS  # Concurrent requests against a single host
+    MAX_PARALLEL_SHARDS = 3  # Brand shards crawled at the same time
+    SHARD_WORKERS = MAX_WORKERS // MAX_PARALLEL_SHARDS  # Worker budget of a single brand shard
+    ASYNC_CONCURRENCY = 100  # Requests kept in flight by the asyncio engine
     REQUEST_TIMEOUT = 20
     RETRY_STRATEGY = Retry(
         total=5,
@@ -42,9 +58,34 @@ class ScraperConfig:
     }
     DATA_FILE = 'products.json'
     CHECKPOINT_FILE = '.scraper_state'
+    JOURNAL_FILE = '.scraper_state.jsonl'  # Append-only log of completed pages
     CHECKPOINT_INTERVAL = 3
+    COMPACTION_JOURNAL_RATIO = 2  # Journal size, as a multiple of the snapshot size, that triggers compaction
+    COMPACTION_MIN_JOURNAL_BYTES = 16 * 1024 * 1024  # Smaller journals are only compacted at the end of the crawl
+    CHECKPOINT_MAX_RESUMES = 5  # Resumes of one checkpoint before a shard starts over
+    CHECKPOINT_MAX_AGE = 2 * 24 * 3600  # Seconds after which an unfinished checkpoint is discarded
+    DB_FLUSH_PAGES = 10  # Completed pages buffered before they are written to the database
+    FINGERPRINT_MAX_AGE = 24 * 3600  # Seconds after which an unchanged listing page is rewritten anyway
+    LISTING_PARSER = 'auto'  # Backend for product cards, see lcwaikiki.listing_parsers
+    LISTING_COUNT_PARSER = 'regex'  # Backend for the product count / per page spans
+    NEW_ARRIVALS_QUERY = 'siralama=en-yeniler'  # Sorts the listing newest-first
+    NEW_ARRIVALS_STOP_AFTER = 3  # Consecutive pages without unknown URLs that end a --new-only scan
+    NEW_ARRIVALS_MAX_PAGES = 50  # Hard cap on pages visited by a --new-only scan
+    LISTING_COUNT_STATE_KEY = 'listing_count:{brand}'  # Last product count read for a brand shard
+    DEFAULT_BRANDS = [
+        'lcwaikiki-classic', 'lcw-modest', 'lcwaikiki-basic',
+        'lcw-casual', 'lcw-vision', 'xside-active', 'lcw-dream',
+        'lcwaikiki-maternity', 'lcw-grace', 'lcw-limited', 'xside',
+        'lcw-jeans', 'lcwaikiki-formal', 'lcw-outdoor', 'lcw-baby',
+        'lc-waikiki', 'lcw-accessories', 'lcw-comfort', 'lcw-eco',
+        'lcw-home', 'lcw-kids', 'lcw-limitless', 'lcw-swimwear', 'lcw-teen'
+    ]
 
 # ---------------------------- Extra Tools ---------------------------- #
+class CrawlStopped(Exception):
+    """A page was skipped because a shutdown was requested; it must not count as crawled"""
+
+
 class ScraperUtils:
     @staticmethod
     def setup_logging():
@@ -80,6 +121,29 @@ class ScraperUtils:
             raise Exception(f"All attempts failed for {func.__name__}")
         return wrapper
 
+    @staticmethod
+    def retry_later(func):
+        """
+        Retry decorator for tasks run on a ThreadedCrawlEngine. A failed
+        attempt raises RetryLater instead of sleeping, so the worker moves on
+        to other pages while the retry waits on the delay queue.
+        """
+        @wraps(func)
+        def wrapper(*args, _attempt=0, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except (RetryLater, CrawlStopped):
+                raise
+            except Exception as e:
+                if _attempt + 1 >= ScraperConfig.RETRY_STRATEGY.total:
+                    raise
+                logger.warning(f"Attempt {_attempt+1} failed: {str(e)}")
+                raise RetryLater(
+                    ScraperConfig.RETRY_STRATEGY.backoff_factor * 2 ** _attempt,
+                    partial(wrapper, *args, _attempt=_attempt + 1, **kwargs)
+                ) from None
+        return wrapper
+
 # ---------------------------- API Manager ---------------------------- #
 class APIManager:
     def __init__(self):
@@ -89,8 +153,11 @@ class APIManager:
     def get_brands(self) -> List[str]:
         # Get brands from Django database instead of API
         try:
-            config = Config.objects.first()
+            config = Config.objects.filter(is_active=True).first() or Config.objects.first()
             if config and config.brands:
+                # Legacy configs store a plain list, newer ones nest it under "brands"
+                if isinstance(config.brands, dict):
+                    return config.brands.get('brands', [])
                 return config.brands
         except Exception as e:
             logger.error(f"Error getting brands from database: {str(e)}")
@@ -101,125 +168,214 @@ class APIManager:
         response.raise_for_status()
         return response.json().get('brands', [])
 
-    @ScraperUtils.retry_on_failure
-    def get_available_urls(self) -> List[Dict]:
-        # Get available URLs from Django database
-        try:
-            available_urls = ProductAvailableUrl.objects.all()
-            return [{
-                'page_id': item.page_id,
-                'product_id_in_page': item.product_id_in_page,
-                'url': item.url,
-                'last_checking': item.last_checking.strftime('%Y-%m-%dT%H:%M:%SZ')
-            } for item in available_urls]
-        except Exception as e:
-            logger.error(f"Error getting available URLs from database: {str(e)}")
-            return []
-
     @ScraperUtils.retry_on_failure
     def post_available_urls(self, urls: List[Dict]):
-        # Save available URLs to Django database in batches
+        # Upsert available URLs on the unique url column, one INSERT ... ON CONFLICT per batch
         current_time = timezone.now()
-        batch_size = 100
-        total_processed = 0
-        
-        try:
-            # Process in batches to avoid database locking
-            for i in range(0, len(urls), batch_size):
-                batch = urls[i:i+batch_size]
-                
-                # Create new entries
-                for url_data in batch:
-                    ProductAvailableUrl.objects.update_or_create(
-                        page_id=url_data['page_id'],
-                        product_id_in_page=url_data['product_id_in_page'],
-                        defaults={
-                            'url': url_data['url'],
-                            'last_checking': current_time
-                        }
-                    )
-                
-                total_processed += len(batch)
-                logger.info(f"Processed batch {i//batch_size + 1}: {total_processed}/{len(urls)} available URLs")
-                
-                # Add a small delay between batches to prevent database locking
-                time.sleep(0.5)
-                
-            logger.success(f"Updated {total_processed} available URLs in database")
-        except Exception as e:
-            logger.error(f"Error saving available URLs to database: {str(e)}")
+        batch_size = 1000
 
-    @ScraperUtils.retry_on_failure
-    def post_new_urls(self, new_urls: List[Dict]):
-        # Save new URLs to Django database
+        # ON CONFLICT cannot touch the same row twice in one statement, keep the first occurrence
+        unique_urls = {}
+        for url_data in urls:
+            unique_urls.setdefault(url_data['url'], url_data)
+
+        objects = [ProductAvailableUrl(
+            page_id=url_data['page_id'],
+            product_id_in_page=url_data['product_id_in_page'],
+            url=url,
+            brand=url_data.get('brand', ''),
+            last_checking=current_time
+        ) for url, url_data in unique_urls.items()]
+
+        ProductAvailableUrl.objects.bulk_create(
+            objects,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['url'],
+            update_fields=['page_id', 'product_id_in_page', 'brand', 'last_checking', 'updated_at']
+        )
+        logger.success(f"Updated {len(objects)} available URLs in database")
+
+    def unchanged_listing_pages(self, brand: str, fingerprints: Dict[int, str]) -> Set[int]:
+        """
+        Return the pages whose stored fingerprint matches. Fingerprints written
+        longer than FINGERPRINT_MAX_AGE ago are ignored, so every page is
+        rewritten now and then even if it never changes.
+        """
+        written_after = timezone.now() - timedelta(seconds=ScraperConfig.FINGERPRINT_MAX_AGE)
+        stored = ListingPageFingerprint.objects.filter(
+            brand=brand,
+            page_id__in=[str(page) for page in fingerprints],
+            written_at__gte=written_after
+        ).values_list('page_id', 'fingerprint')
+        return {int(page_id) for page_id, fingerprint in stored if fingerprints.get(int(page_id)) == fingerprint}
+
+    def save_listing_fingerprints(self, brand: str, fingerprints: Dict[int, str], unchanged: Set[int]):
         current_time = timezone.now()
-        batch_size = 100
-        total_processed = 0
-        
-        try:
-            # Process in batches
-            for i in range(0, len(new_urls), batch_size):
-                batch = new_urls[i:i+batch_size]
-                
-                # Check and prepare batch
-                bulk_new_urls = []
-                for url_data in batch:
-                    # Check if it doesn't already exist
-                    if not ProductNewUrl.objects.filter(url=url_data['url']).exists():
-                        bulk_new_urls.append(ProductNewUrl(
-                            url=url_data['url'],
-                            last_checking=current_time
-                        ))
-                
-                # Create batch
-                if bulk_new_urls:
-                    ProductNewUrl.objects.bulk_create(bulk_new_urls)
-                    total_processed += len(bulk_new_urls)
-                    logger.info(f"Processed batch {i//batch_size + 1}: {total_processed} new URLs")
-                
-                # Add delay between batches
-                time.sleep(0.5)
-            
-            if total_processed > 0:
-                logger.success(f"Added {total_processed} new URLs to database")
-        except Exception as e:
-            logger.error(f"Error saving new URLs to database: {str(e)}")
+        if unchanged:
+            ListingPageFingerprint.objects.filter(
+                brand=brand, page_id__in=[str(page) for page in unchanged]
+            ).update(checked_at=current_time)
+
+        written = [ListingPageFingerprint(
+            brand=brand,
+            page_id=str(page),
+            fingerprint=fingerprint,
+            checked_at=current_time,
+            written_at=current_time
+        ) for page, fingerprint in fingerprints.items() if page not in unchanged]
+        if written:
+            ListingPageFingerprint.objects.bulk_create(
+                written,
+                update_conflicts=True,
+                unique_fields=['brand', 'page_id'],
+                update_fields=['fingerprint', 'checked_at', 'written_at']
+            )
+
+    def misplaced_listing_urls(self, listed: Dict[str, Set[str]]) -> Set[str]:
+        """Return the URLs of `listed` (URL -> page IDs listing it) without a row on one of those pages"""
+        owners = dict(ProductAvailableUrl.objects.filter(url__in=list(listed)).values_list('url', 'page_id'))
+        return {url for url, pages in listed.items() if owners.get(url) not in pages}
+
+    def filter_unscraped_urls(self, urls: List[str]) -> List[str]:
+        """Return the URLs that have no Product yet"""
+        scraped = set(Product.objects.filter(url__in=urls).values_list('url', flat=True))
+        return [url for url in dict.fromkeys(urls) if url not in scraped]
+
+    def filter_unknown_urls(self, urls: List[str]) -> List[str]:
+        """Return the URLs that are neither listed, queued as new, nor scraped yet"""
+        known = set()
+        for model in (ProductAvailableUrl, ProductNewUrl, Product):
+            known.update(model.objects.filter(url__in=urls).values_list('url', flat=True))
+        return [url for url in dict.fromkeys(urls) if url not in known]
 
     @ScraperUtils.retry_on_failure
-    def post_deleted_urls(self, deleted_urls: List[Dict]):
-        # Save deleted URLs to Django database
+    def insert_new_urls(self, urls: List[str]) -> int:
+        return self._insert_missing_urls(ProductNewUrl, urls)
+
+    def apply_listing_prices(self, products: List[Dict]) -> int:
+        """
+        Bulk-update price, discount and stock of already scraped products from
+        listing cards. Only rows whose values actually change are written, and
+        card prices go through the same price_config as Product.save().
+        """
+        cards = {p['url']: p for p in products if p.get('price')}
+        if not cards:
+            return 0
+
+        price_config = Product.get_price_config()
+        current_time = timezone.now()
+        batch_size = 1000
+        changed = []
+
+        urls = list(cards)
+        for i in range(0, len(urls), batch_size):
+            for product in Product.objects.filter(url__in=urls[i:i+batch_size]).only(
+                'id', 'url', 'price', 'discount_ratio', 'in_stock'
+            ):
+                card = cards[product.url]
+                price = Decimal(card['price'])
+                if price_config:
+                    price = Decimal(str(Product.apply_price_config(price, price_config)))
+                price = price.quantize(Decimal('0.01'))
+                # A card without a discount badge is not (or no longer) on sale
+                discount_ratio = Decimal(card['discount_ratio'] or 0).quantize(Decimal('0.01'))
+                if not discount_ratio and not product.discount_ratio:
+                    discount_ratio = product.discount_ratio  # None and 0 both mean no discount
+
+                if (product.price, product.discount_ratio, product.in_stock) != (price, discount_ratio, card['in_stock']):
+                    product.price = price
+                    product.discount_ratio = discount_ratio
+                    product.in_stock = card['in_stock']
+                    product.timestamp = current_time
+                    changed.append(product)
+
+        if changed:
+            # bulk_update bypasses Product.save(), so the multiplier is not applied twice
+            Product.objects.bulk_update(
+                changed, ['price', 'discount_ratio', 'in_stock', 'timestamp'], batch_size=500
+            )
+        return len(changed)
+
+    @staticmethod
+    def _insert_missing_urls(model, urls: List[str]) -> int:
+        # One lookup per chunk instead of one .exists() query per URL
         current_time = timezone.now()
-        batch_size = 100
+        batch_size = 1000
         total_processed = 0
-        
-        try:
-            # Process in batches
-            for i in range(0, len(deleted_urls), batch_size):
-                batch = deleted_urls[i:i+batch_size]
-                
-                # Check and prepare batch
-                bulk_deleted_urls = []
-                for url_data in batch:
-                    # Check if it doesn't already exist
-                    if not ProductDeletedUrl.objects.filter(url=url_data['url']).exists():
-                        bulk_deleted_urls.append(ProductDeletedUrl(
-                            url=url_data['url'],
-                            last_checking=current_time
-                        ))
-                
-                # Create batch
-                if bulk_deleted_urls:
-                    ProductDeletedUrl.objects.bulk_create(bulk_deleted_urls)
-                    total_processed += len(bulk_deleted_urls)
-                    logger.info(f"Processed batch {i//batch_size + 1}: {total_processed} deleted URLs")
-                
-                # Add delay between batches
-                time.sleep(0.5)
-            
-            if total_processed > 0:
-                logger.success(f"Added {total_processed} deleted URLs to database")
-        except Exception as e:
-            logger.error(f"Error saving deleted URLs to database: {str(e)}")
+
+        urls = list(dict.fromkeys(urls))
+        for i in range(0, len(urls), batch_size):
+            batch = urls[i:i+batch_size]
+            existing = set(model.objects.filter(url__in=batch).values_list('url', flat=True))
+            missing = [model(url=url, last_checking=current_time) for url in batch if url not in existing]
+            if missing:
+                model.objects.bulk_create(missing)
+                total_processed += len(missing)
+        return total_processed
+
+    @staticmethod
+    def _insert_from_available_urls(model, condition: str, params: List) -> int:
+        """
+        Copy available URLs matching `condition` into `model`'s table with a single
+        INSERT ... SELECT, skipping URLs already present (anti-join)
+        """
+        current_time = timezone.now()
+        quote = connection.ops.quote_name
+        target = quote(model._meta.db_table)
+        source = quote(ProductAvailableUrl._meta.db_table)
+        sql = f"""
+            INSERT INTO {target} (url, last_checking, created_at, updated_at)
+            SELECT a.url, %s, %s, %s
+            FROM {source} a
+            WHERE {condition}
+            AND NOT EXISTS (SELECT 1 FROM {target} t WHERE t.url = a.url)
+        """
+        params = [
+            connection.ops.adapt_datetimefield_value(value) if isinstance(value, datetime) else value
+            for value in [current_time, current_time, current_time] + list(params)
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    @ScraperUtils.retry_on_failure
+    def post_new_urls_since(self, run_started_at: datetime, brand: Optional[str] = None) -> int:
+        # Available URLs first inserted during this run are new, unless they were already scraped
+        products = connection.ops.quote_name(Product._meta.db_table)
+        condition = f"a.created_at >= %s AND NOT EXISTS (SELECT 1 FROM {products} p WHERE p.url = a.url)"
+        if brand is None:
+            return self._insert_from_available_urls(ProductNewUrl, condition, [run_started_at])
+        return self._insert_from_available_urls(
+            ProductNewUrl, f"{condition} AND a.brand = %s", [run_started_at, brand]
+        )
+
+    @ScraperUtils.retry_on_failure
+    def post_deleted_urls_before(self, run_started_at: datetime, brand: Optional[str] = None) -> int:
+        # Available URLs not checked during this run were not seen on any listing page
+        if brand is None:
+            return self._insert_from_available_urls(ProductDeletedUrl, "a.last_checking < %s", [run_started_at])
+        # Rows on pages confirmed unchanged during this run were seen even though they were not rewritten
+        fingerprints = connection.ops.quote_name(ListingPageFingerprint._meta.db_table)
+        return self._insert_from_available_urls(
+            ProductDeletedUrl,
+            f"""a.last_checking < %s AND a.brand = %s AND NOT EXISTS (
+                SELECT 1 FROM {fingerprints} f
+                WHERE f.brand = a.brand AND f.page_id = a.page_id
+                AND f.checked_at >= %s AND f.written_at < %s
+            )""",
+            [run_started_at, brand, run_started_at, run_started_at]
+        )
+
+    @ScraperUtils.retry_on_failure
+    def post_unsharded_deleted_urls_before(self, run_started_at: datetime, brands: List[str]) -> int:
+        # Rows of brands outside the crawled set (or written before sharding) that were not seen
+        placeholders = ', '.join(['%s'] * len(brands))
+        return self._insert_from_available_urls(
+            ProductDeletedUrl,
+            f"a.last_checking < %s AND a.brand NOT IN ({placeholders})",
+            [run_started_at] + list(brands)
+        )
 
 # ---------------------------- Session Management ---------------------------- #
 class RequestSession:
@@ -228,282 +384,862 @@ class RequestSession:
         self.session.mount(
             'https://',
             HTTPAdapter(
-                max_retries=ScraperConfig.RETRY_STRATEGY,
+                # Every caller retries on its own (retry_later or retry_on_failure); urllib3 retrying
+                # connection errors as well would block the worker for several attempts per retry
+                max_retries=Retry(total=0, read=False),
                 pool_maxsize=ScraperConfig.MAX_WORKERS*2
             )
         )
         self.session.headers.update(ScraperConfig.HEADERS)
+        # Listing pages have their own ceiling (Config listing_max_concurrent_requests), sized for MAX_WORKERS
+        self.rate_limiter = get_rate_limiter('listing')
 
     @ScraperUtils.retry_on_failure
     def get(self, url: str) -> requests.Response:
-        response = self.session.get(
-            url, 
-            timeout=ScraperConfig.REQUEST_TIMEOUT
-        )
+        return self.fetch(url)
+
+    def fetch(self, url: str) -> requests.Response:
+        """Single attempt without retries, for callers that schedule their own"""
+        host = host_of(url)
+        self.rate_limiter.acquire(host)
+        status = throttled = None
+        try:
+            response = self.session.get(
+                url, 
+                timeout=ScraperConfig.REQUEST_TIMEOUT
+            )
+            status = response.status_code
+        except requests.exceptions.Timeout:
+            throttled = True
+            raise
+        finally:
+            # Every exit gives the slot back, or the host would run out of them
+            self.rate_limiter.release(host, status, throttled=throttled)
         response.raise_for_status()
         return response
 
 # ---------------------------- Data Management ---------------------------- #
 class DataManager:
-    def __init__(self):
-        self.data_file = ScraperConfig.DATA_FILE
-        self.checkpoint_file = ScraperConfig.CHECKPOINT_FILE
+    """
+    Crawl state persisted as a snapshot plus an append-only journal.
+
+    Every completed page is appended to the journal as one JSON line, so a
+    checkpoint only costs the bytes of the pages finished since the previous
+    one. The snapshot (`products.json` and `.scraper_state`) is rewritten only
+    on compaction: at the end of the crawl, and at a checkpoint once the
+    journal is COMPACTION_JOURNAL_RATIO times the size of the snapshot (and
+    at least COMPACTION_MIN_JOURNAL_BYTES). As the snapshot grows, compactions
+    get rarer, so the crawl writes each byte a bounded number of times.
+    Resuming loads the snapshot and replays the journal on top of it.
+    Products a page lists again after an earlier page are journaled with it
+    as `repeated`, so every page's full listing can be rebuilt until it is
+    written to the database. A
+    checkpoint resumed more than CHECKPOINT_MAX_RESUMES times or older than
+    CHECKPOINT_MAX_AGE is discarded, so a shard that keeps failing to finish
+    starts a fresh run instead of stretching one run marker over days.
+    """
+
+    def __init__(self, shard: Optional[str] = None):
+        self.data_file = self._shard_path(ScraperConfig.DATA_FILE, shard)
+        self.checkpoint_file = self._shard_path(ScraperConfig.CHECKPOINT_FILE, shard)
+        self.journal_file = self._shard_path(ScraperConfig.JOURNAL_FILE, shard)
         self._processed_urls: Set[str] = set()
         self._completed_pages: Set[int] = set()
         self._products: List[Dict] = []
+        self._synced_pages: Set[int] = set()
+        self._repeated: Dict[int, List[Dict]] = {}  # Products of unsynced pages already seen on earlier pages
+        self.run_started_at = None
+        self.last_listing_page: Optional[int] = None  # Last page the listing cards imply, if known
+        self.resumes = 0
+        self._journal = None
         self._load_state()
 
+        if self.run_started_at is not None and self._expired():
+            self.clear_checkpoint()
+            self._reset_state()
+
+        if self.run_started_at is None:
+            # Run marker: rows not touched since this moment were not seen by the crawl
+            self.run_started_at = timezone.now()
+            self._append_journal_entry({'run_started_at': self.run_started_at.isoformat()})
+        else:
+            self.resumes += 1
+            self._append_journal_entry({'resumes': self.resumes})
+
+    @staticmethod
+    def _shard_path(path: str, shard: Optional[str]) -> str:
+        # products.json -> products.<shard>.json, .scraper_state -> .scraper_state.<shard>
+        if not shard:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{shard}{ext}"
+
+    def _expired(self) -> bool:
+        age = (timezone.now() - self.run_started_at).total_seconds()
+        if self.resumes >= ScraperConfig.CHECKPOINT_MAX_RESUMES or age > ScraperConfig.CHECKPOINT_MAX_AGE:
+            logger.warning(
+                f"Discarding checkpoint {self.checkpoint_file}: resumed {self.resumes} times, "
+                f"started {age / 3600:.1f} hours ago"
+            )
+            return True
+        return False
+
+    def _reset_state(self):
+        self._processed_urls = set()
+        self._completed_pages = set()
+        self._products = []
+        self._synced_pages = set()
+        self._repeated = {}
+        self.run_started_at = None
+        self.last_listing_page = None
+        self.resumes = 0
+
     def _load_state(self):
         try:
             if os.path.exists(self.checkpoint_file):
                 with open(self.checkpoint_file, 'r') as f:
                     state = json.load(f)
                     self._completed_pages = set(state['completed_pages'])
-                    self._processed_urls = set(state['processed_urls'])
+                    self._synced_pages = set(state.get('synced_pages', []))
+                    self._repeated = {int(page): products for page, products in state.get('repeated', {}).items()}
+                    self.last_listing_page = state.get('last_listing_page')
+                    self.resumes = state.get('resumes', 0)
+                    if state.get('run_started_at'):
+                        self.run_started_at = datetime.fromisoformat(state['run_started_at'])
+                if os.path.exists(self.data_file):
+                    with open(self.data_file, 'r', encoding='utf-8') as f:
+                        self._products = json.load(f)
+                    self._processed_urls = {p['url'] for p in self._products}
         except Exception as e:
             logger.error(f"State load error: {str(e)}")
 
-    def save_checkpoint(self):
-        state = {
-            'completed_pages': list(self._completed_pages),
-            'processed_urls': list(self._processed_urls),
-        }
         try:
-            with open(self.checkpoint_file, 'w') as f:
-                json.dump(state, f)
-            self._save_products()
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            # A crash can leave a partially written last line behind
+                            logger.warning("Skipping truncated checkpoint journal entry")
+                            continue
+                        if 'run_started_at' in entry:
+                            self.run_started_at = datetime.fromisoformat(entry['run_started_at'])
+                        elif 'synced_pages' in entry:
+                            self._synced_pages.update(entry['synced_pages'])
+                            self._forget_repeated(entry['synced_pages'])
+                        elif 'last_listing_page' in entry:
+                            self.last_listing_page = entry['last_listing_page']
+                        elif 'resumes' in entry:
+                            self.resumes = entry['resumes']
+                        else:
+                            self._apply(entry['page'], entry['products'], entry.get('repeated', ()))
+                logger.info(f"Resumed {len(self._completed_pages)} completed pages from checkpoint")
         except Exception as e:
-            logger.error(f"Checkpoint save error: {str(e)}")
-
-    def _save_products(self):
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self._products, f, ensure_ascii=False, indent=2)
+            logger.error(f"Journal replay error: {str(e)}")
 
-    def add_products(self, page: int, products: List[Dict]):
+    def _apply(self, page: int, products: List[Dict], repeated=()) -> List[Dict]:
         new_products = []
+        repeated = list(repeated)
         for product in products:
             if product['url'] not in self._processed_urls:
                 self._processed_urls.add(product['url'])
                 new_products.append(product)
-        
+            else:
+                repeated.append(product)
+
         self._products.extend(new_products)
         self._completed_pages.add(page)
+        if repeated:
+            self._repeated[page] = repeated
+        return new_products
+
+    def _forget_repeated(self, pages: List[int]):
+        for page in pages:
+            self._repeated.pop(page, None)
+
+    def _append_journal_entry(self, entry: Dict):
+        if self._journal is None:
+            needs_newline = False
+            if os.path.exists(self.journal_file) and os.path.getsize(self.journal_file) > 0:
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    needs_newline = f.read(1) != b'\n'
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            # Terminate a truncated last line so new entries start on their own line
+            if needs_newline:
+                self._journal.write('\n')
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def save_checkpoint(self):
+        try:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            if self._journal_outgrew_snapshot():
+                self.compact()
+        except Exception as e:
+            logger.error(f"Checkpoint save error: {str(e)}")
+
+    def _journal_outgrew_snapshot(self) -> bool:
+        if not os.path.exists(self.journal_file):
+            return False
+        # Without a checkpoint file, a products.json left behind is not part of this run
+        snapshot_size = 0
+        if os.path.exists(self.checkpoint_file):
+            snapshot_size = sum(
+                os.path.getsize(path) for path in (self.data_file, self.checkpoint_file) if os.path.exists(path)
+            )
+        threshold = max(ScraperConfig.COMPACTION_MIN_JOURNAL_BYTES, ScraperConfig.COMPACTION_JOURNAL_RATIO * snapshot_size)
+        return os.path.getsize(self.journal_file) >= threshold
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and start an empty journal"""
+        try:
+            self._write_atomic(self.data_file, self._products, indent=2)
+            self._write_atomic(self.checkpoint_file, {
+                'completed_pages': sorted(self._completed_pages),
+                'synced_pages': sorted(self._synced_pages),
+                'repeated': {str(page): products for page, products in self._repeated.items()},
+                'run_started_at': self.run_started_at.isoformat() if self.run_started_at else None,
+                'last_listing_page': self.last_listing_page,
+                'resumes': self.resumes,
+            })
+
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+        except Exception as e:
+            logger.error(f"Checkpoint compaction error: {str(e)}")
+
+    def clear_checkpoint(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        for path in (self.checkpoint_file, self.journal_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def _write_atomic(path: str, data, indent: Optional[int] = None):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def add_products(self, page: int, products: List[Dict]) -> List[Dict]:
+        new_products = self._apply(page, products)
+        entry = {'page': page, 'products': new_products}
+        if page in self._repeated:
+            entry['repeated'] = self._repeated[page]
+        self._append_journal_entry(entry)
         logger.debug(f"Page {page} processed: {len(new_products)} new products")
+        return new_products
+
+    def mark_synced(self, pages: List[int]):
+        self._synced_pages.update(pages)
+        self._forget_repeated(pages)
+        self._append_journal_entry({'synced_pages': list(pages)})
+
+    def set_last_listing_page(self, page: Optional[int]):
+        if page != self.last_listing_page:
+            self.last_listing_page = page
+            self._append_journal_entry({'last_listing_page': page})
+
+    def unsynced_products(self) -> List[Dict]:
+        """Products of completed pages that were not written to the database yet (e.g. after a crash)"""
+        return [p for p in self._products if p['page'] not in self._synced_pages]
+
+    def unsynced_pages(self) -> List[int]:
+        return sorted(self._completed_pages - self._synced_pages)
+
+    def repeated_products(self, page: int) -> List[Dict]:
+        """Products of an unsynced page that add_products left out because an earlier page listed them"""
+        return self._repeated.get(page, [])
 
 # ---------------------------- Main Scraper Class ---------------------------- #
 class ProductScraper:
-    def __init__(self):
+    """
+    Crawls the listing of a single brand shard.
+
+    Each shard has its own page count, checkpoint files and worker budget, so
+    shards can run side by side in one process (see ShardedCrawler) or be
+    re-run individually with `--brand`.
+    """
+
+    def __init__(self, brand: str, engine: str = 'threads', concurrency: Optional[int] = None,
+                 limiter: Optional[HostLimiter] = None, position: int = 0,
+                 pipeline: Optional[DetailPipeline] = None,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None):
+        self.brand = brand
+        self.pipeline = pipeline
+        self.brands = [brand]
+        self.engine = engine
+        self.concurrency = concurrency
+        self.limiter = limiter
+        # Rate limiter of the async engine; threaded fetches use the session's one
+        self.rate_limiter = rate_limiter or get_rate_limiter('listing')
+        self.position = position
         self.session = RequestSession()
-        self.data_manager = DataManager()
+        self.api_manager = APIManager()
+        self.data_manager = DataManager(shard=brand)
+        self._db_buffer: List[Dict] = []
+        self._db_pages: List[int] = []
         self.total_pages = 0
+        self.per_page = 0
+        self.listing_empty = False
         self._stop_requested = False
-        self.brands = []
-        self._setup_signal_handlers()
-        self._get_brands()
 
-    def _setup_signal_handlers(self):
-        signal.signal(signal.SIGINT, self._graceful_shutdown)
-        signal.signal(signal.SIGTERM, self._graceful_shutdown)
+    @property
+    def last_page(self) -> int:
+        """
+        Last page of the listing: the page count, or the last page the cards
+        imply when the product count overstates them (a stale or drifting count)
+        """
+        last_listing_page = self.data_manager.last_listing_page
+        if last_listing_page is not None:
+            return min(self.total_pages, last_listing_page)
+        return self.total_pages
 
-    def _graceful_shutdown(self, signum, frame):
-        logger.info("Initiating graceful shutdown...")
-        self._stop_requested = True
-
-    def _get_brands(self):
-        api_manager = APIManager()
-        try:
-            self.brands = api_manager.get_brands()
-            logger.success(f"Database'den {len(self.brands)} marka alındı")
-        except Exception as e:
-            logger.error(f"Marka listesi alınamadı: {str(e)}")
-            self.brands = [
-                'lcwaikiki-classic', 'lcw-modest', 'lcwaikiki-basic',
-                'lcw-casual', 'lcw-vision', 'xside-active', 'lcw-dream',
-                'lcwaikiki-maternity', 'lcw-grace', 'lcw-limited', 'xside',
-                'lcw-jeans', 'lcwaikiki-formal', 'lcw-outdoor', 'lcw-baby',
-                'lc-waikiki', 'lcw-accessories', 'lcw-comfort', 'lcw-eco',
-                'lcw-home', 'lcw-kids', 'lcw-limitless', 'lcw-swimwear', 'lcw-teen'
-            ]
-            logger.warning("Fallback marka listesi kullanılıyor")
+    @property
+    def all_pages_crawled(self) -> bool:
+        """Every page of the listing returned products, in this run or the interrupted one it resumes"""
+        return (
+            self.last_page > 0
+            and not self._stop_requested
+            and set(range(1, self.last_page + 1)) <= self.data_manager._completed_pages
+        )
 
-    def _extract_product_count(self, soup: BeautifulSoup) -> Optional[int]:
-        try:
-            count_element = soup.find('span', {'class': 'product-list-heading__product-count'})
-            if count_element:
-                count_text = count_element.find('p').get_text(strip=True)
-                return int(re.search(r'\d+', count_text.replace('.', '')).group())
-        except Exception as e:
-            logger.warning(f"Product count extraction error: {str(e)}")
-        return None
+    def _track_listing_end(self, page: int, card_count: int):
+        """
+        Only the last page of a listing has fewer cards than a full page, so the
+        highest page with cards marks the end of the listing if it is partial.
+        A later page with cards moves the end (or clears it, when it is full).
+        """
+        last_listing_page = self.data_manager.last_listing_page
+        if last_listing_page is not None and page < last_listing_page:
+            return
+        self.data_manager.set_last_listing_page(page if card_count < self.per_page else None)
 
-    def _extract_per_page(self, soup: BeautifulSoup) -> Optional[int]:
-        try:
-            pagination_info = soup.find('div', {'class': 'paginator__info-text'})
-            if pagination_info:
-                per_page_text = pagination_info.find(
-                    'span', {'class': 'paginator__info-text-viewed-products'}
-                ).get_text(strip=True)
-                return int(per_page_text)
-        except Exception as e:
-            logger.warning(f"Items per page extraction error: {str(e)}")
-        return None
+    @property
+    def is_complete(self) -> bool:
+        return self.listing_empty or (self.all_pages_crawled and not self._db_pages)
 
-    def get_total_pages(self) -> int:
+    def get_total_pages(self) -> Optional[int]:
+        """
+        Page count of the brand shard: 0 for a brand without products, None
+        when neither the listing nor the shard's last known count gives one.
+        """
         if not self.brands:
             logger.error("Marka listesi boş, sayfa hesaplanamıyor")
-            return 0
+            return None
             
         url = f"{ScraperConfig.BASE_URL}/giyim-u-300009?marka={','.join(self.brands)}"
+        state_key = ScraperConfig.LISTING_COUNT_STATE_KEY.format(brand=self.brand)
         
         try:
             response = self.session.get(url)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            product_count, per_page = get_parser(ScraperConfig.LISTING_COUNT_PARSER).listing_counts(response.text)
+            if product_count is None:
+                raise ValueError("product count not found on the listing page")
+            ScraperState.set_value(state_key, {'product_count': product_count, 'per_page': per_page})
+        except Exception as e:
+            # Fall back to this shard's own last count; the catalog total would crawl hundreds of empty pages.
+            # If the count is stale high, run() ends the listing at the last page the cards imply.
+            last_count = ScraperState.get_value(state_key)
+            if not last_count:
+                logger.error(f"[{self.brand}] Page calculation error: {str(e)}")
+                return None
+            logger.warning(f"[{self.brand}] Page calculation error: {str(e)}, using the last known product count")
+            product_count, per_page = last_count['product_count'], last_count.get('per_page')
             
-            product_count = self._extract_product_count(soup) or 38400
-            per_page = self._extract_per_page(soup) or 96
+        per_page = per_page or 96
+        self.per_page = per_page
+        total_pages = math.ceil(product_count / per_page)
+        logger.info(f"Product count: {product_count} | Per page: {per_page} | Total pages: {total_pages}")
+        return total_pages
 
-            total_pages = math.ceil(product_count / per_page)
-            logger.info(f"Product count: {product_count} | Per page: {per_page} | Total pages: {total_pages}")
-            return total_pages
-            
-        except Exception as e:
-            logger.error(f"Page calculation error: {str(e)}")
-            return math.ceil(38400 / 96)
+    def page_url(self, page: int) -> str:
+        return f"{ScraperConfig.BASE_URL}/giyim-u-300009?marka={','.join(self.brands)}&page={page}"
 
+    @staticmethod
+    def parse_page(page: int, html: str) -> List[Dict]:
+        return [{
+            'page': page,
+            'position': card['position'],
+            'url': ScraperConfig.BASE_URL + card['href'],
+            'price': card['price'],
+            'discount_ratio': card['discount_ratio'],
+            'in_stock': card['in_stock']
+        } for card in get_parser(ScraperConfig.LISTING_PARSER).product_cards(html)]
+
+    @ScraperUtils.retry_later
     def scrape_page(self, page: int) -> List[Dict]:
-        if page in self.data_manager._completed_pages or self._stop_requested:
+        if self._stop_requested:
+            raise CrawlStopped(f"Page {page} skipped, shutdown requested")
+        if page in self.data_manager._completed_pages:
             return []
 
-        url = f"{ScraperConfig.BASE_URL}/giyim-u-300009?marka={','.join(self.brands)}&page={page}"
+        url = self.page_url(page)
         try:
-            response = self.session.get(url)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            products = []
-            
-            for position, product_card in enumerate(soup.select('div.product-card'), 1):
-                link = product_card.find('a', href=True)
-                if link:
-                    product_url = ScraperConfig.BASE_URL + link['href']
-                    products.append({
-                        'page': page,
-                        'position': position,
-                        'url': product_url
-                    })
-            
-            return products
+            response = self.session.fetch(url)
+            return self.parse_page(page, response.text)
         except Exception as e:
+            # Re-raise so the page is not marked completed and gets crawled again on resume
             logger.error(f"Page {page} error: {str(e)}")
-            return []
+            raise
 
-    def _sync_with_database(self):
-        logger.info("Starting database synchronization...")
-        api_manager = APIManager()
-        current_time = timezone.now()
-        
+    def _crawl_pages(self, pages: List[int]):
+        """Yield (page, products, error) for every page, in page order, using the selected engine"""
+        should_stop = lambda: self._stop_requested
+
+        if self.engine == 'async':
+            engine = AsyncCrawlEngine(
+                concurrency=self.concurrency or ScraperConfig.ASYNC_CONCURRENCY,
+                per_host_limit=self.concurrency or ScraperConfig.ASYNC_CONCURRENCY,
+                timeout=ScraperConfig.REQUEST_TIMEOUT,
+                max_retries=ScraperConfig.RETRY_STRATEGY.total,
+                retry_delay=ScraperConfig.RETRY_STRATEGY.backoff_factor,
+                max_proxy_attempts=1,  # Direct connection only; same attempt budget as retry_later
+                headers_factory=lambda: dict(ScraperConfig.HEADERS),
+                limiter=self.limiter,
+                rate_limiter=self.rate_limiter
+            )
+            for page, response, error in engine.map(pages, url_for=self.page_url, should_stop=should_stop):
+                if response is None:
+                    # Leave the page uncompleted so a resumed run picks it up again
+                    yield page, None, error or Exception(f"Page {page} could not be fetched")
+                    continue
+                try:
+                    yield page, self.parse_page(page, response.text), None
+                except Exception as e:
+                    logger.error(f"Page {page} error: {str(e)}")
+                    yield page, None, e
+            return
+
+        workers = self.concurrency or ScraperConfig.SHARD_WORKERS
+        engine = ThreadedCrawlEngine(
+            max_workers=workers,
+            max_in_flight=workers * 3,
+            limiter=self.limiter or HostLimiter(ScraperConfig.MAX_PER_HOST)
+        )
+        yield from engine.map(
+            self.scrape_page,
+            pages,
+            host_for=lambda page: host_of(self.page_url(page)),
+            should_stop=should_stop
+        )
+
+    def _flush_to_database(self):
+        """Upsert the products of buffered pages into ProductAvailableUrl"""
+        if not self._db_pages:
+            return
+
+        try:
+            page_products = self._page_products()
+            fingerprints = {page: self.page_fingerprint(products) for page, products in page_products.items()}
+            unchanged = self.api_manager.unchanged_listing_pages(self.brand, fingerprints)
+            rows = [p for p in self._db_buffer if p['page'] not in unchanged]
+            # An unchanged page only keeps the rows that carry its page ID; products it shares
+            # with another page may have their row there, so those are written again
+            listed = {}
+            for page in sorted(unchanged):
+                for product in page_products[page]:
+                    listed.setdefault(product['url'], set()).add(str(page))
+            if listed:
+                misplaced = self.api_manager.misplaced_listing_urls(listed)
+                rows.extend(
+                    p for page in sorted(unchanged) for p in page_products[page] if p['url'] in misplaced
+                )
+            written = [{
+                "page_id": str(p['page']),
+                "product_id_in_page": str(p['position']),
+                "url": p['url'],
+                "brand": self.brand,
+            } for p in rows]
+            self.api_manager.post_available_urls(written)
+            self.api_manager.save_listing_fingerprints(self.brand, fingerprints, unchanged)
+            self._feed_pipeline([p['url'] for p in written])
+            if unchanged:
+                logger.debug(f"[{self.brand}] Skipped {len(unchanged)} unchanged pages")
+            self._apply_listing_prices()
+            self.data_manager.mark_synced(self._db_pages)
+            self._db_buffer = []
+            self._db_pages = []
+        except Exception as e:
+            # Keep the buffer; the pages stay unsynced in the checkpoint and are retried
+            logger.error(f"Failed to update available URLs: {str(e)}")
+
+    def _feed_pipeline(self, urls: List[str]):
+        """Hand URLs without a scraped product to the detail pipeline"""
+        if not self.pipeline or not urls:
+            return
         try:
-            existing_urls = api_manager.get_available_urls()
+            for url in self.api_manager.filter_unscraped_urls(urls):
+                self.pipeline.submit(url)
         except Exception as e:
-            logger.error(f"Database connection error: {str(e)}")
-            existing_urls = []
+            logger.error(f"[{self.brand}] Failed to queue new URLs for detail scraping: {str(e)}")
+
+    def _page_products(self) -> Dict[int, List[Dict]]:
+        """Every product of each buffered page in listing order, including those an earlier page listed"""
+        products_by_page = {page: list(self.data_manager.repeated_products(page)) for page in self._db_pages}
+        for product in self._db_buffer:
+            products_by_page.setdefault(product['page'], []).append(product)
+        return {
+            page: sorted(products, key=lambda p: p['position'])
+            for page, products in products_by_page.items()
+        }
+
+    @staticmethod
+    def page_fingerprint(products: List[Dict]) -> str:
+        """Hash of a page's ordered product URLs"""
+        return hashlib.sha1('\n'.join(p['url'] for p in products).encode('utf-8')).hexdigest()
+
+    def _apply_listing_prices(self):
+        # Price refresh is best effort; a failure must not keep the pages unsynced
+        try:
+            updated = self.api_manager.apply_listing_prices(self._db_buffer)
+            if updated:
+                logger.info(f"[{self.brand}] Refreshed price/stock of {updated} products from listing cards")
+        except Exception as e:
+            logger.error(f"[{self.brand}] Failed to refresh prices from listing cards: {str(e)}")
+
+    def _finalize_database_sync(self):
+        """
+        Derive new and deleted URLs from the run marker once the crawl is complete.
         
-        # Format scraped products
-        formatted_products = [{
-            "page_id": str(p['page']),
-            "product_id_in_page": str(p['position']),
-            "url": p['url'],
-            "last_checking": current_time
-        } for p in self.data_manager._products]
-
-        # Update available URLs
+        Rows created after the run started are new; rows of this brand whose
+        last_checking is older than the run start were not seen on any page.
+        """
+        run_started_at = self.data_manager.run_started_at
+
         try:
-            api_manager.post_available_urls(formatted_products)
-            logger.success(f"Updated {len(formatted_products)} URLs in database")
+            new_count = self.api_manager.post_new_urls_since(run_started_at, brand=self.brand)
+            logger.success(f"[{self.brand}] Posted {new_count} new URLs to database")
         except Exception as e:
-            logger.error(f"Failed to update available URLs: {str(e)}")
+            logger.error(f"[{self.brand}] Failed to post new URLs: {str(e)}")
+
+        if not self.all_pages_crawled:
+            logger.warning(f"[{self.brand}] Crawl incomplete, skipping deleted URL detection")
             return
 
-        # Find new and deleted URLs
-        existing_url_set = {u['url'] for u in existing_urls}
-        current_url_set = {u['url'] for u in formatted_products}
+        try:
+            deleted_count = self.api_manager.post_deleted_urls_before(run_started_at, brand=self.brand)
+            logger.success(f"[{self.brand}] Posted {deleted_count} deleted URLs to database")
+        except Exception as e:
+            logger.error(f"Failed to post deleted URLs: {str(e)}")
 
-        new_urls = [u for u in formatted_products if u['url'] not in existing_url_set]
-        deleted_urls = [{"url": u['url'], "last_checking": current_time} 
-                      for u in existing_urls if u['url'] not in current_url_set]
+    def run(self):
+        logger.info(f"[{self.brand}] Starting product scraper...")
+        
+        total_pages = self.get_total_pages()
+        if total_pages is None:
+            logger.error(f"[{self.brand}] Scraping işlemi başlatılamadı")
+            return
+        if total_pages == 0:
+            logger.info(f"[{self.brand}] Markada ürün yok, taranacak sayfa yok")
+            self.listing_empty = True
+            self.data_manager.clear_checkpoint()
+            return
+        self.total_pages = total_pages
+            
+        logger.info(f"[{self.brand}] Total pages to scrape: {self.total_pages}")
+        
+        pending_pages = [
+            page for page in range(1, self.total_pages + 1)
+            if page not in self.data_manager._completed_pages
+        ]
+        # Pages completed by an interrupted run but never written to the database
+        self._db_buffer = self.data_manager.unsynced_products()
+        self._db_pages = self.data_manager.unsynced_pages()
 
-        # Post new URLs
-        if new_urls:
+        with tqdm(total=self.total_pages, initial=self.total_pages - len(pending_pages),
+                  desc=f"Scraping {self.brand}", position=self.position) as progress:
+            last_checkpoint = time.time()
             try:
-                api_manager.post_new_urls(new_urls)
-                logger.success(f"Posted {len(new_urls)} new URLs to database")
-            except Exception as e:
-                logger.error(f"Failed to post new URLs: {str(e)}")
+                # Results arrive in page order, so products keep their listing order
+                for page, products, error in self._crawl_pages(pending_pages):
+                    if self._stop_requested:
+                        # Pages finishing after a stop are dropped and crawled again on resume
+                        continue
+                    if error is None and not products:
+                        if page > self.last_page:
+                            # Past the end the cards imply: the product count overstated the listing
+                            logger.info(f"[{self.brand}] Page {page} is past the end of the listing")
+                            self.data_manager.add_products(page, [])
+                            self.data_manager.mark_synced([page])
+                        else:
+                            # A listing page without cards (blocked, or the count was stale) is not crawled
+                            logger.warning(f"[{self.brand}] Page {page} returned no products")
+                    elif error is None:
+                        self._track_listing_end(page, len(products))
+                        self._db_buffer.extend(self.data_manager.add_products(page, products))
+                        self._db_pages.append(page)
+                    progress.update(1)
+
+                    # Write to the database while the remaining pages are still being fetched
+                    if len(self._db_pages) >= ScraperConfig.DB_FLUSH_PAGES:
+                        self._flush_to_database()
+
+                    if time.time() - last_checkpoint > ScraperConfig.CHECKPOINT_INTERVAL:
+                        self.data_manager.save_checkpoint()
+                        last_checkpoint = time.time()
 
-        # Post deleted URLs
-        if deleted_urls:
-            try:
-                api_manager.post_deleted_urls(deleted_urls)
-                logger.success(f"Posted {len(deleted_urls)} deleted URLs to database")
             except Exception as e:
-                logger.error(f"Failed to post deleted URLs: {str(e)}")
+                logger.critical(f"Critical error: {str(e)}")
+            finally:
+                self._flush_to_database()
+                self.data_manager.compact()
+
+        if not self._db_pages:
+            self._finalize_database_sync()
+        else:
+            logger.error(f"[{self.brand}] Some pages could not be written to the database, skipping new/deleted URL detection")
+        
+        logger.info(f"[{self.brand}] Scraping completed! Total products: {len(self.data_manager._products)}")
+        if self.is_complete:
+            self.data_manager.clear_checkpoint()
+
+
+class ShardedCrawler:
+    """
+    Runs one ProductScraper per brand, up to `parallel_shards` at a time.
+
+    All shards share one per-host limiter and the process-wide adaptive rate
+    limiter of listing pages, so running them side by side never exceeds MAX_PER_HOST
+    (threads) or the async concurrency (ASYNC_CONCURRENCY unless
+    `concurrency` is given), nor the rate limiter's ceiling, in concurrent
+    requests against lcw.com. When every
+    configured brand is crawled successfully, rows left over from brands that
+    are no longer configured (or from before sharding) are swept into
+    ProductDeletedUrl as well.
+    """
+
+    def __init__(self, brands: Optional[List[str]] = None, parallel_shards: Optional[int] = None,
+                 engine: str = 'threads', concurrency: Optional[int] = None,
+                 pipeline: Optional[DetailPipeline] = None):
+        self.api_manager = APIManager()
+        self.pipeline = pipeline
+        self.configured_brands = self._get_brands()
+        self.brands = brands or self.configured_brands
+        self.full_run = not brands
+        self.parallel_shards = parallel_shards or ScraperConfig.MAX_PARALLEL_SHARDS
+        if engine == 'async':
+            self.limiter = HostLimiter(concurrency or ScraperConfig.ASYNC_CONCURRENCY)
+        else:
+            self.limiter = HostLimiter(ScraperConfig.MAX_PER_HOST)
+        self.shards = [
+            ProductScraper(
+                brand, engine=engine, concurrency=concurrency, limiter=self.limiter,
+                position=index, pipeline=pipeline
+            )
+            for index, brand in enumerate(self.brands)
+        ]
+        self._setup_signal_handlers()
+
+    def _setup_signal_handlers(self):
+        signal.signal(signal.SIGINT, self._graceful_shutdown)
+        signal.signal(signal.SIGTERM, self._graceful_shutdown)
+
+    def _graceful_shutdown(self, signum, frame):
+        logger.info("Initiating graceful shutdown...")
+        for shard in self.shards:
+            shard._stop_requested = True
+
+    def _get_brands(self) -> List[str]:
+        try:
+            brands = self.api_manager.get_brands()
+            logger.success(f"Database'den {len(brands)} marka alındı")
+            return brands
+        except Exception as e:
+            logger.error(f"Marka listesi alınamadı: {str(e)}")
+            logger.warning("Fallback marka listesi kullanılıyor")
+            return list(ScraperConfig.DEFAULT_BRANDS)
+
+    @staticmethod
+    def _run_shard(shard: ProductScraper):
+        try:
+            shard.run()
+        except Exception as e:
+            logger.critical(f"[{shard.brand}] Shard failed: {str(e)}")
+        finally:
+            # Each worker thread holds its own database connection
+            connection.close()
 
     def run(self):
         ScraperUtils.setup_logging()
-        logger.info("Starting product scraper...")
-        
-        self.total_pages = self.get_total_pages()
-        if self.total_pages == 0:
-            logger.error("Scraping işlemi başlatılamadı")
-            return
-            
-        logger.info(f"Total pages to scrape: {self.total_pages}")
-        
-        with tqdm(total=self.total_pages, desc="Scraping pages") as progress:
-            with ThreadPoolExecutor(max_workers=ScraperConfig.MAX_WORKERS) as executor:
-                futures = {}
-                last_checkpoint = time.time()
-                
+        logger.info(f"Starting sharded crawl of {len(self.shards)} brands, {self.parallel_shards} at a time")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel_shards) as executor:
+                list(executor.map(self._run_shard, self.shards))
+
+            completed = [shard for shard in self.shards if shard.is_complete]
+            logger.info(f"Sharded crawl finished: {len(completed)}/{len(self.shards)} brands completed")
+
+            if self.full_run and self.shards and len(completed) == len(self.shards):
+                run_started_at = min(shard.data_manager.run_started_at for shard in self.shards)
                 try:
-                    current_page = 1
-                    while current_page <= self.total_pages and not self._stop_requested:
-                        if current_page not in self.data_manager._completed_pages:
-                            future = executor.submit(self.scrape_page, current_page)
-                            futures[future] = current_page
-                        
-                        for future in as_completed(futures):
-                            page = futures.pop(future)
-                            products = future.result()
-                            self.data_manager.add_products(page, products)
-                            progress.update(1)
-                        
-                        if time.time() - last_checkpoint > ScraperConfig.CHECKPOINT_INTERVAL:
-                            self.data_manager.save_checkpoint()
-                            last_checkpoint = time.time()
-                        
-                        current_page += 1
-                    
-                    # Process remaining futures
-                    for future in as_completed(futures):
-                        page = futures[future]
-                        products = future.result()
-                        self.data_manager.add_products(page, products)
-                        progress.update(1)
-                    
+                    count = self.api_manager.post_unsharded_deleted_urls_before(run_started_at, self.brands)
+                    logger.success(f"Posted {count} deleted URLs from unconfigured brands to database")
                 except Exception as e:
-                    logger.critical(f"Critical error: {str(e)}")
-                finally:
-                    self.data_manager.save_checkpoint()
-        
-        # Sync with database after scraping completes
-        self._sync_with_database()
-        
-        logger.info(f"Scraping completed! Total products: {len(self.data_manager._products)}")
-        if os.path.exists(ScraperConfig.CHECKPOINT_FILE):
-            os.remove(ScraperConfig.CHECKPOINT_FILE)
+                    logger.error(f"Failed to post deleted URLs of unconfigured brands: {str(e)}")
+        finally:
+            # Runs after every shard posted its new URLs, so scraped ones are removed from the queue
+            if self.pipeline:
+                self.pipeline.close()
+
+
+class NewArrivalsScanner:
+    """
+    Cheap discovery pass over the newest-first listing.
+
+    Pages are fetched in order and every URL we have never seen is written
+    straight into ProductNewUrl. Since new products sit at the top of the
+    listing, the scan stops once `stop_after` consecutive pages contain only
+    known URLs. No checkpoint is kept; the scan is short enough to restart.
+    """
+
+    def __init__(self, brands: Optional[List[str]] = None, stop_after: Optional[int] = None,
+                 max_pages: Optional[int] = None, concurrency: Optional[int] = None,
+                 pipeline: Optional[DetailPipeline] = None):
+        self.pipeline = pipeline
+        self.session = RequestSession()
+        self.api_manager = APIManager()
+        self.brands = brands or self._get_brands()
+        self.stop_after = stop_after or ScraperConfig.NEW_ARRIVALS_STOP_AFTER
+        self.max_pages = max_pages or ScraperConfig.NEW_ARRIVALS_MAX_PAGES
+        self.concurrency = concurrency or ScraperConfig.SHARD_WORKERS
+        self._stop_requested = False
+        self._setup_signal_handlers()
+
+    def _setup_signal_handlers(self):
+        signal.signal(signal.SIGINT, self._graceful_shutdown)
+        signal.signal(signal.SIGTERM, self._graceful_shutdown)
+
+    def _graceful_shutdown(self, signum, frame):
+        logger.info("Initiating graceful shutdown...")
+        self._stop_requested = True
+
+    def _get_brands(self) -> List[str]:
+        try:
+            return self.api_manager.get_brands()
+        except Exception as e:
+            logger.error(f"Marka listesi alınamadı: {str(e)}")
+            return list(ScraperConfig.DEFAULT_BRANDS)
+
+    def page_url(self, page: int) -> str:
+        return (
+            f"{ScraperConfig.BASE_URL}/giyim-u-300009?marka={','.join(self.brands)}"
+            f"&{ScraperConfig.NEW_ARRIVALS_QUERY}&page={page}"
+        )
+
+    @ScraperUtils.retry_later
+    def scrape_page(self, page: int) -> List[Dict]:
+        response = self.session.fetch(self.page_url(page))
+        return ProductScraper.parse_page(page, response.text)
+
+    def run(self) -> int:
+        ScraperUtils.setup_logging()
+        logger.info(f"Scanning new arrivals, stopping after {self.stop_after} pages without unknown URLs")
+
+        quiet_pages = 0
+        total_new = 0
+        # Only `stop_after` pages are in flight, so at most that many are fetched past the stop point
+        engine = ThreadedCrawlEngine(
+            max_workers=min(self.concurrency, self.stop_after),
+            max_in_flight=self.stop_after
+        )
+        done = lambda: self._stop_requested or quiet_pages >= self.stop_after
+
+        for page, products, error in engine.map(
+            self.scrape_page, range(1, self.max_pages + 1), should_stop=done
+        ):
+            if done():
+                continue
+            if error is not None:
+                # An unreadable page says nothing about whether we caught up
+                continue
+            if not products:
+                logger.info(f"Page {page} is empty, end of listing reached")
+                quiet_pages = self.stop_after
+                continue
+
+            unknown = self.api_manager.filter_unknown_urls([p['url'] for p in products])
+            if unknown:
+                quiet_pages = 0
+                total_new += self.api_manager.insert_new_urls(unknown)
+                if self.pipeline:
+                    for url in unknown:
+                        self.pipeline.submit(url)
+            else:
+                quiet_pages += 1
+            logger.debug(f"Page {page}: {len(unknown)} unknown URLs")
+
+        logger.success(f"New arrivals scan finished: {total_new} new URLs posted to database")
+        if self.pipeline:
+            self.pipeline.close()
+        return total_new
 
 
 class Command(BaseCommand):
     help = 'Refreshes the product list by scraping LCWaikiki website'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--engine',
+            choices=['threads', 'async'],
+            default='threads',
+            help='Crawl engine used to fetch listing pages (async requires aiohttp)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Number of listing pages each brand shard fetches concurrently (defaults: '
+                 f'{ScraperConfig.SHARD_WORKERS} threads, or {ScraperConfig.ASYNC_CONCURRENCY} requests '
+                 'with --engine async, shared by all shards and capped at Config listing_max_concurrent_requests)',
+        )
+        parser.add_argument(
+            '--brand',
+            action='append',
+            dest='brands',
+            help='Only crawl this brand shard (can be given several times)',
+        )
+        parser.add_argument(
+            '--parallel-shards',
+            type=int,
+            default=None,
+            help='Number of brand shards crawled at the same time',
+        )
+        parser.add_argument(
+            '--new-only',
+            action='store_true',
+            help='Only scan the newest-first listing for unknown URLs and post them as new',
+        )
+        parser.add_argument(
+            '--scrape-new',
+            action='store_true',
+            help='Scrape product pages of newly discovered URLs during the crawl',
+        )
+        parser.add_argument(
+            '--detail-concurrency',
+            type=int,
+            default=None,
+            help='With --scrape-new, number of product pages scraped at the same time '
+                 '(defaults to Config max_concurrent_requests)',
+        )
+        parser.add_argument(
+            '--stop-after',
+            type=int,
+            default=None,
+            help='With --new-only, stop after this many consecutive pages without unknown URLs',
+        )
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting product list refresh...'))
         
@@ -511,23 +1247,39 @@ class Command(BaseCommand):
         try:
             config, created = Config.objects.get_or_create(
                 name='default',
-                defaults={'brands': [
-                    'lcwaikiki-classic', 'lcw-modest', 'lcwaikiki-basic',
-                    'lcw-casual', 'lcw-vision', 'xside-active', 'lcw-dream',
-                    'lcwaikiki-maternity', 'lcw-grace', 'lcw-limited', 'xside',
-                    'lcw-jeans', 'lcwaikiki-formal', 'lcw-outdoor', 'lcw-baby',
-                    'lc-waikiki', 'lcw-accessories', 'lcw-comfort', 'lcw-eco',
-                    'lcw-home', 'lcw-kids', 'lcw-limitless', 'lcw-swimwear', 'lcw-teen'
-                ]}
+                defaults={'brands': list(ScraperConfig.DEFAULT_BRANDS)}
             )
             if created:
                 self.stdout.write(self.style.SUCCESS('Created default config with brands'))
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error creating default config: {str(e)}'))
         
+        pipeline = None
+        if options['scrape_new']:
+            pipeline = DetailPipeline(concurrency=options['detail_concurrency'])
+
+        if options['new_only']:
+            try:
+                NewArrivalsScanner(
+                    brands=options['brands'],
+                    stop_after=options['stop_after'],
+                    concurrency=options['concurrency'],
+                    pipeline=pipeline
+                ).run()
+                self.stdout.write(self.style.SUCCESS('New arrivals scan completed successfully'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Error scanning new arrivals: {str(e)}'))
+            return
+
         # Run the scraper
         try:
-            scraper = ProductScraper()
+            scraper = ShardedCrawler(
+                brands=options['brands'],
+                parallel_shards=options['parallel_shards'],
+                engine=options['engine'],
+                concurrency=options['concurrency'],
+                pipeline=pipeline
+            )
             scraper.run()
             self.stdout.write(self.style.SUCCESS('Product list refresh completed successfully'))
         except Exception as e:
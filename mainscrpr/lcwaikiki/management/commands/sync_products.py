@@ -1,6 +1,5 @@
 import logging
 import json
-import time
 import datetime
 import sys
 from django.core.management.base import BaseCommand
@@ -57,6 +56,12 @@ class Command(BaseCommand):
             action='store_true',
             help='Perform all sync operations',
         )
+        parser.add_argument(
+            '--engine',
+            choices=['threads', 'async'],
+            default='threads',
+            help='Engine used to fetch product pages (async requires aiohttp)',
+        )
 
     def handle(self, *args, **options):
         batch_size = options.get('batch_size', 10)
@@ -72,19 +77,23 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('Starting product synchronization...'))
         self.stdout.write(self.style.SUCCESS(f'Batch size: {batch_size}, Max items per operation: {max_items}'))
         
-        scraper = ProductScraper()
+        scraper = ProductScraper(engine=options.get('engine', 'threads'))
         
-        # Process new URLs
-        if check_new:
-            self.process_new_urls(scraper, batch_size, max_items)
-            
-        # Update existing products
-        if update_existing:
-            self.update_existing_products(scraper, batch_size, max_items)
-            
-        # Check for deleted products
-        if check_deleted:
-            self.check_deleted_products(scraper, max_items)
+        try:
+            # Process new URLs
+            if check_new:
+                self.process_new_urls(scraper, batch_size, max_items)
+                
+            # Update existing products
+            if update_existing:
+                self.update_existing_products(scraper, batch_size, max_items)
+                
+            # Check for deleted products
+            if check_deleted:
+                self.check_deleted_products(scraper, max_items)
+        finally:
+            # Inventory worker threads are shared by all operations of the run
+            scraper.close()
             
         self.stdout.write(self.style.SUCCESS('Product synchronization completed successfully'))
 
@@ -107,13 +116,18 @@ class Command(BaseCommand):
             processed_count = 0
             success_count = 0
             
+            # Pages are fetched concurrently ahead of processing, in completion order
+            responses = scraper.iter_responses(new_urls, ordered=False)
+            
             for i in range(0, count, batch_size):
                 batch = new_urls[i:i+batch_size]
                 
-                for url in batch:
+                for _ in batch:
                     try:
+                        url, response = next(responses)
+                        
                         # Process the product URL and save to database
-                        success = scraper.process_product_url(url)
+                        success = response is not None and scraper.process_product_url(url, response=response)
                         
                         if success:
                             success_count += 1
@@ -127,12 +141,12 @@ class Command(BaseCommand):
                                 page_id = product_part.split('-')[-1] if '-' in product_part else 'unknown'
                                 product_id_in_page = product_part.split('-')[0] if '-' in product_part else product_part
                                 
-                                # Add to available URLs
+                                # Add to available URLs (rows are keyed by URL, the listing crawl owns page/position)
                                 ProductAvailableUrl.objects.get_or_create(
-                                    page_id=page_id,
-                                    product_id_in_page=product_id_in_page,
+                                    url=url,
                                     defaults={
-                                        'url': url,
+                                        'page_id': page_id,
+                                        'product_id_in_page': product_id_in_page,
                                         'last_checking': timezone.now()
                                     }
                                 )
@@ -156,9 +170,6 @@ class Command(BaseCommand):
                     f'Progress: {processed_count}/{count} URLs processed, {success_count} successful'
                 ))
                 
-                # Add a small delay between batches
-                if i + batch_size < count:
-                    time.sleep(1)
                     
             self.stdout.write(self.style.SUCCESS(
                 f'Completed new URL processing: {processed_count}/{count} URLs processed, {success_count} successful'
@@ -182,8 +193,10 @@ class Command(BaseCommand):
                 
             self.stdout.write(self.style.SUCCESS(f'Found {count} existing products to check for updates'))
             
-            # Get products ordered by oldest timestamp first, limited by max_items
-            products_to_update = list(Product.objects.all().order_by('timestamp').values_list('url', flat=True)[:max_items])
+            # Get products flagged as changed upstream first, then oldest timestamp first, limited by max_items
+            products_to_update = list(
+                Product.objects.all().order_by('-needs_refresh', 'timestamp').values_list('url', flat=True)[:max_items]
+            )
             update_count = len(products_to_update)
             
             if update_count == 0:
@@ -197,11 +210,17 @@ class Command(BaseCommand):
             updated_count = 0
             unchanged_count = 0
             
+            # Pages are fetched concurrently ahead of processing, in completion order.
+            # Requests are conditional, so unchanged pages come back as cheap 304s
+            responses = scraper.iter_responses(products_to_update, ordered=False, conditional=True)
+            
             for i in range(0, update_count, batch_size):
                 batch = products_to_update[i:i+batch_size]
                 
-                for url in batch:
+                for _ in batch:
                     try:
+                        url, response = next(responses)
+                        
                         # Get the existing product
                         try:
                             existing_product = Product.objects.get(url=url)
@@ -209,12 +228,21 @@ class Command(BaseCommand):
                             self.stdout.write(self.style.WARNING(f'Product not found for URL: {url}'))
                             continue
                             
-                        # Fetch the current product data
-                        response = scraper.fetch(url)
-                        
-                        if not response:
+                        if response is None:
                             self.stdout.write(self.style.ERROR(f'Failed to fetch product data for URL: {url}'))
                             continue
+                        
+                        if response.not_modified:
+                            # 304 or an identical body: skip parsing and product writes, but store stock
+                            # changes without the page changing, so expired inventory is still refreshed
+                            unchanged_count += 1
+                            processed_count += 1
+                            scraper.mark_unchanged(url, validators=scraper.unchanged_validators(response))
+                            self.refresh_inventory(
+                                scraper, existing_product, scraper.stored_product_data(existing_product), url,
+                                refresh_only=True
+                            )
+                            continue
                             
                         # Extract product data
                         product_data = scraper.extract_product_data(response)
@@ -222,6 +250,18 @@ class Command(BaseCommand):
                         if not product_data:
                             self.stdout.write(self.style.ERROR(f'Failed to extract product data for URL: {url}'))
                             continue
+                        
+                        content_hash = scraper.content_hash(product_data)
+                        if content_hash == existing_product.content_hash:
+                            # Same data as last time: only the new validators are stored, for the next 304,
+                            # and the store stock of sizes whose cached inventory has expired
+                            unchanged_count += 1
+                            processed_count += 1
+                            Product.objects.filter(pk=existing_product.pk).update(
+                                needs_refresh=False, **scraper.response_validators(response)
+                            )
+                            self.refresh_inventory(scraper, existing_product, product_data, url, refresh_only=True)
+                            continue
                             
                         # Check what's changed and only update changed fields
                         changes = {}
@@ -309,6 +349,13 @@ class Command(BaseCommand):
                                 self.stdout.write(self.style.SUCCESS(
                                     f'Removed size {existing_size.size_name} from product {existing_product.title}'
                                 ))
+                        
+                        self.refresh_inventory(scraper, existing_product, product_data, url)
+                        
+                        # Remember the validators and data hash for the next run
+                        Product.objects.filter(pk=existing_product.pk).update(
+                            needs_refresh=False, content_hash=content_hash, **scraper.response_validators(response)
+                        )
                                 
                     except Exception as e:
                         self.stdout.write(self.style.ERROR(f'Error updating product {url}: {str(e)}'))
@@ -320,10 +367,6 @@ class Command(BaseCommand):
                     f'Progress: {processed_count}/{update_count} products processed, '
                     f'{updated_count} updated, {unchanged_count} unchanged'
                 ))
-                
-                # Add a small delay between batches
-                if i + batch_size < update_count:
-                    time.sleep(1)
                     
             self.stdout.write(self.style.SUCCESS(
                 f'Completed product updates: {processed_count}/{update_count} products processed, '
@@ -333,6 +376,16 @@ class Command(BaseCommand):
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error updating existing products: {str(e)}'))
 
+    def refresh_inventory(self, scraper, product, product_data, url, refresh_only=False):
+        """Store the store inventory of a product's sizes, reusing cached responses within their TTL"""
+        if not (scraper.config and scraper.config.use_stores):
+            return
+        try:
+            size_inventories = scraper.fetch_product_inventory(product_data, url, refresh_only=refresh_only)
+            scraper.store_product_inventory(product, size_inventories)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error refreshing inventory for {url}: {str(e)}'))
+            
     def check_deleted_products(self, scraper, max_items=100):
         """Check for deleted products and update their status"""
         self.stdout.write(self.style.NOTICE('Checking for deleted products...'))
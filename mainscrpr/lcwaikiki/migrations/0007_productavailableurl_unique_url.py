@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:21
+
+from django.db import migrations, models
+
+
+def remove_duplicate_urls(apps, schema_editor):
+    """Keep only the most recently checked row per URL before adding the unique constraint"""
+    ProductAvailableUrl = apps.get_model('lcwaikiki', 'ProductAvailableUrl')
+    duplicates = (
+        ProductAvailableUrl.objects.values('url')
+        .annotate(row_count=models.Count('id'))
+        .filter(row_count__gt=1)
+        .values_list('url', flat=True)
+    )
+    for url in list(duplicates):
+        keep_id = (
+            ProductAvailableUrl.objects.filter(url=url)
+            .order_by('-last_checking', '-id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        ProductAvailableUrl.objects.filter(url=url).exclude(id=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0006_update_store_foreign_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_urls, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='productavailableurl',
+            name='lcwaikiki_p_url_505757_idx',
+        ),
+        migrations.AlterField(
+            model_name='productavailableurl',
+            name='url',
+            field=models.URLField(help_text='URL to the product', max_length=1000, unique=True),
+        ),
+    ]
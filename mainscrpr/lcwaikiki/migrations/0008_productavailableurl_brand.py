@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0007_productavailableurl_unique_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productavailableurl',
+            name='brand',
+            field=models.CharField(blank=True, default='', help_text='Brand shard the URL was listed under', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='productavailableurl',
+            index=models.Index(fields=['brand', 'last_checking'], name='lcwaikiki_p_brand_8e82a8_idx'),
+        ),
+    ]
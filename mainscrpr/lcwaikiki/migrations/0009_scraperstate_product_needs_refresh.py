@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0008_productavailableurl_brand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScraperState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='State identifier', max_length=100, unique=True)),
+                ('value', models.JSONField(default=dict, help_text='State data in JSON format')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Scraper State',
+                'verbose_name_plural': 'Scraper States',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='needs_refresh',
+            field=models.BooleanField(db_index=True, default=False, help_text='Changed upstream since the last scrape'),
+        ),
+    ]
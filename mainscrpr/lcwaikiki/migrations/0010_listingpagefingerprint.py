@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0009_scraperstate_product_needs_refresh'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingPageFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('brand', models.CharField(help_text='Brand shard of the listing page', max_length=100)),
+                ('page_id', models.CharField(help_text='Page identifier', max_length=255)),
+                ('fingerprint', models.CharField(help_text="SHA-1 of the page's ordered product URLs", max_length=64)),
+                ('checked_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Last time the page was crawled')),
+                ('written_at', models.DateTimeField(default=django.utils.timezone.now, help_text="Last time the page's URLs were written")),
+            ],
+            options={
+                'verbose_name': 'Listing Page Fingerprint',
+                'verbose_name_plural': 'Listing Page Fingerprints',
+                'unique_together': {('brand', 'page_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0010_listingpagefingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='body_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the last fetched product page body', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='etag',
+            field=models.CharField(blank=True, help_text='ETag of the last fetched product page', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_modified',
+            field=models.CharField(blank=True, help_text='Last-Modified header of the last fetched product page', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0011_product_http_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of the normalized scraped product data', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lcwaikiki', '0012_product_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size_reference', models.CharField(help_text='urunOptionSizeRef of the size', max_length=50)),
+                ('city_id', models.CharField(help_text='City the inventory was requested for', max_length=20)),
+                ('data', models.JSONField(default=dict, help_text='Inventory API response')),
+                ('fetched_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Time the response was fetched')),
+            ],
+            options={
+                'verbose_name': 'Inventory Snapshot',
+                'verbose_name_plural': 'Inventory Snapshots',
+                'unique_together': {('size_reference', 'city_id')},
+            },
+        ),
+    ]
@@ -29,6 +29,7 @@ class Config(models.Model):
             "min_stock_level": 1,
             "check_store_stock": true,
             "max_concurrent_requests": 5,
+            "listing_max_concurrent_requests": 12,
             "batch_size": 100
         },
         "scraper_config": {
@@ -87,6 +88,14 @@ class Config(models.Model):
         except (AttributeError, KeyError):
             return 5  # Default fallback
     
+    @property
+    def listing_max_concurrent_requests(self):
+        """Get the maximum number of concurrent listing page requests"""
+        try:
+            return self.brands.get('stock_config', {}).get('listing_max_concurrent_requests', 12)
+        except (AttributeError, KeyError):
+            return 12  # Default fallback
+    
     @property
     def batch_size(self):
         """Get the batch size for processing URLs"""
@@ -169,7 +178,8 @@ class ProductAvailableUrl(models.Model):
     """
     page_id = models.CharField(max_length=255, help_text="Page identifier")
     product_id_in_page = models.CharField(max_length=255, help_text="Product identifier within the page")
-    url = models.URLField(max_length=1000, help_text="URL to the product")
+    url = models.URLField(max_length=1000, unique=True, help_text="URL to the product")
+    brand = models.CharField(max_length=100, blank=True, default='', help_text="Brand shard the URL was listed under")
     last_checking = models.DateTimeField(default=timezone.now, help_text="Date of last check")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -184,7 +194,7 @@ class ProductAvailableUrl(models.Model):
             models.Index(fields=['page_id']),
             models.Index(fields=['product_id_in_page']),
             models.Index(fields=['last_checking']),
-            models.Index(fields=['url']),
+            models.Index(fields=['brand', 'last_checking']),
         ]
 
 
@@ -228,3 +238,73 @@ class ProductNewUrl(models.Model):
             models.Index(fields=['last_checking']),
             models.Index(fields=['url']),
         ]
+
+
+class ScraperState(models.Model):
+    """
+    Small key/value store for scraper bookkeeping that must survive between
+    runs, e.g. the time of the last sitemap discovery.
+    """
+    key = models.CharField(max_length=100, unique=True, help_text="State identifier")
+    value = models.JSONField(default=dict, help_text="State data in JSON format")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+    @classmethod
+    def get_value(cls, key, default=None):
+        state = cls.objects.filter(key=key).first()
+        return state.value if state else default
+
+    @classmethod
+    def set_value(cls, key, value):
+        cls.objects.update_or_create(key=key, defaults={'value': value})
+
+    class Meta:
+        verbose_name = "Scraper State"
+        verbose_name_plural = "Scraper States"
+
+
+class ListingPageFingerprint(models.Model):
+    """
+    Hash of the ordered product URLs of one listing page of a brand shard.
+
+    The listing crawl compares it against the page it just fetched and skips
+    rewriting the page's ProductAvailableUrl rows when nothing changed.
+    """
+    brand = models.CharField(max_length=100, help_text="Brand shard of the listing page")
+    page_id = models.CharField(max_length=255, help_text="Page identifier")
+    fingerprint = models.CharField(max_length=64, help_text="SHA-1 of the page's ordered product URLs")
+    checked_at = models.DateTimeField(default=timezone.now, help_text="Last time the page was crawled")
+    written_at = models.DateTimeField(default=timezone.now, help_text="Last time the page's URLs were written")
+
+    def __str__(self):
+        return f"{self.brand} - {self.page_id}"
+
+    class Meta:
+        verbose_name = "Listing Page Fingerprint"
+        verbose_name_plural = "Listing Page Fingerprints"
+        unique_together = ('brand', 'page_id')
+
+
+class InventorySnapshot(models.Model):
+    """
+    Last store inventory response for one size reference and city.
+
+    Backs the inventory cache across runs, so a sync started shortly after
+    another one reuses its responses instead of querying the inventory
+    endpoint again.
+    """
+    size_reference = models.CharField(max_length=50, help_text="urunOptionSizeRef of the size")
+    city_id = models.CharField(max_length=20, help_text="City the inventory was requested for")
+    data = models.JSONField(default=dict, help_text="Inventory API response")
+    fetched_at = models.DateTimeField(default=timezone.now, help_text="Time the response was fetched")
+
+    def __str__(self):
+        return f"{self.size_reference} - {self.city_id}"
+
+    class Meta:
+        verbose_name = "Inventory Snapshot"
+        verbose_name_plural = "Inventory Snapshots"
+        unique_together = ('size_reference', 'city_id')
@@ -0,0 +1,362 @@
+import html as html_lib
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from bs4 import BeautifulSoup
+
+from .listing_parsers import is_available
+
+logger = logging.getLogger(__name__)
+
+# libxml2 builds the tree several times faster than html.parser; it is an optional dependency
+TREE_BUILDER = 'lxml' if is_available('lxml') else 'html.parser'
+
+# Image sizes of a JSON picture entry, in order of preference
+IMAGE_SIZES = ('ExtraMedium800', 'ExtraMedium600', 'MediumImage', 'SmallImage')
+OUT_OF_STOCK_RE = re.compile(r'out of stock', re.IGNORECASE)
+PRODUCT_CODE_RE = re.compile(r'([A-Z0-9]+)')
+URL_CODE_RE = re.compile(r'-o-(\d+)')
+
+
+@dataclass
+class SizeRecord:
+    size_name: str
+    size_id: Optional[str] = None
+    size_general_stock: int = 0
+    product_option_size_reference: Optional[str] = None
+    barcode_list: list = field(default_factory=list)
+    in_stock: bool = False
+
+
+@dataclass
+class ProductRecord:
+    """Everything scraped from one product page"""
+
+    url: str
+    title: Optional[str] = None
+    category: Optional[str] = None
+    description: Optional[str] = None
+    product_code: Optional[str] = None
+    color: Optional[str] = None
+    price: Optional[float] = None
+    discount_ratio: Optional[float] = None
+    in_stock: bool = False
+    images: List[str] = field(default_factory=list)
+    status: str = 'active'
+    sizes: List[SizeRecord] = field(default_factory=list)
+
+    def to_product_data(self):
+        """The `{'product': ..., 'sizes': [...]}` dict ProductScraper.save_product_data expects"""
+        product = asdict(self)
+        sizes = product.pop('sizes')
+        return {'product': product, 'sizes': sizes}
+
+
+def parse_price(value):
+    """Parse a price from JSON (number or Turkish formatted string) into a float"""
+    if isinstance(value, str):
+        value = re.sub(r'[^0-9,.]', '', value)
+        # If comma is used as decimal separator (Turkish format)
+        if ',' in value:
+            value = value.replace('.', '').replace(',', '.')
+    return float(value or 0)
+
+
+# Start of the JS assignments holding product JSON, in order of preference
+CART_VIEW_MODEL_RE = re.compile(r'cartOperationViewModel\s*=\s*')
+FALLBACK_VARIABLE_RES = (
+    re.compile(r'var\s+productDetailData\s*=\s*'),
+    re.compile(r'var\s+modal_data\s*=\s*'),
+)
+PRODUCT_INFO_META_RE = re.compile(r'<meta name="product-info" content="([^"]+)"')
+
+# Characters the brace scanner has to stop at outside and inside string literals
+_SCAN_RE = re.compile(r'[{}"\'/]')
+_STRING_END_RES = {'"': re.compile(r'[\\"]'), "'": re.compile(r"[\\']")}
+# JS-only syntax that json.loads rejects; string literals are matched first so they are left alone
+_JS_TOKEN_RE = re.compile(
+    r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|//[^\n]*|/\*.*?\*/|,(?=\s*[}\]])|\bundefined\b|\bNaN\b',
+    re.DOTALL
+)
+
+
+def scan_object(text, start):
+    """
+    Return the end index (exclusive) of the JS object literal whose `{` is at
+    `start`, or -1 if it is not closed. Braces inside string literals and
+    comments are ignored, so a `};` in a string does not end the object.
+    """
+    depth = 0
+    position = start
+    while True:
+        match = _SCAN_RE.search(text, position)
+        if match is None:
+            return -1
+        char = match.group()
+        position = match.end()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return position
+        elif char == '/':
+            if text.startswith('/', position):
+                newline = text.find('\n', position)
+                position = len(text) if newline == -1 else newline
+            elif text.startswith('*', position):
+                comment_end = text.find('*/', position + 1)
+                if comment_end == -1:
+                    return -1
+                position = comment_end + 2
+        else:
+            # Skip the string literal, honouring backslash escapes
+            string_end = _STRING_END_RES[char]
+            while True:
+                match = string_end.search(text, position)
+                if match is None:
+                    return -1
+                position = match.end()
+                if match.group() == char:
+                    break
+                position += 1  # Skip the escaped character
+
+
+def _normalize_js(json_str):
+    """Drop comments and trailing commas and map undefined/NaN, leaving string literals untouched"""
+    def replace(match):
+        token = match.group()
+        if token[0] in '"\'':
+            return token
+        if token == 'undefined':
+            return 'null'
+        if token == 'NaN':
+            return '0'
+        return ''
+    return _JS_TOKEN_RE.sub(replace, json_str)
+
+
+def _load_object(text, start):
+    """Parse the object literal at `start`; JS cleanup is only attempted when plain JSON fails"""
+    end = scan_object(text, start)
+    if end == -1:
+        raise ValueError('unterminated object literal')
+    json_str = text[start:end]
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON decode error: {str(e)}, attempting additional cleanup")
+        return json.loads(_normalize_js(json_str))
+
+
+def _assigned_object(text, pattern):
+    """Parse the first object literal assigned by a match of `pattern` that parses"""
+    for match in pattern.finditer(text):
+        if text.startswith('{', match.end()):
+            try:
+                return _load_object(text, match.end())
+            except ValueError as e:  # JSONDecodeError is a ValueError
+                logger.error(f"JSON parsing error after {pattern.pattern!r}: {str(e)}")
+    return None
+
+
+def extract_json(text):
+    """
+    Return the product JSON embedded in a decoded product page, or None.
+
+    Locates the cartOperationViewModel assignment and cuts the object out by
+    brace matching, so extraction is one linear pass. The product-info meta
+    tag and the productDetailData and modal_data variables are only searched
+    when that fails.
+    """
+    data = _assigned_object(text, CART_VIEW_MODEL_RE)
+    if data is not None:
+        return data
+
+    try:
+        meta_tag = PRODUCT_INFO_META_RE.search(text)
+        if meta_tag:
+            return json.loads(html_lib.unescape(meta_tag.group(1)))
+    except Exception as e:
+        logger.error(f"Error extracting meta tag product info: {str(e)}")
+
+    for pattern in FALLBACK_VARIABLE_RES:
+        data = _assigned_object(text, pattern)
+        if data is not None:
+            return data
+
+    logger.warning("No valid JSON data found in response")
+    return None
+
+
+def _text(element):
+    return element.get_text().strip() if element is not None else None
+
+
+def _html_price(text):
+    price_match = re.search(r'(\d+(?:[.,]\d+)?)', text.replace('.', ''))
+    if price_match:
+        return float(price_match.group(1).replace(',', '.'))
+    return parse_price(text)
+
+
+class _PageElements:
+    """
+    The elements of a product page tree the extractor reads, collected in a
+    single walk instead of one CSS selector scan per field.
+    """
+
+    # Classes of which only the first element counts
+    FIRST_CLASSES = ('product-code', 'selected-color', 'price-regular', 'discount-rate')
+
+    def __init__(self, soup):
+        self.first = {}
+        self.title = None
+        self.meta_code = None
+        self.description = None
+        self.sizes = []
+        self.images = []
+        seen = set()
+
+        for tag in soup.find_all(True):
+            classes = tag.get('class') or ()
+            if classes:
+                for class_name in self.FIRST_CLASSES:
+                    if class_name in classes and class_name not in self.first:
+                        self.first[class_name] = tag
+                if self.title is None and tag.name == 'h1' and 'product-title' in classes:
+                    self.title = tag
+                # Descendant lookups; `seen` drops elements reached through nested containers
+                if 'size-list' in classes:
+                    self._collect(tag.find_all(class_='size'), self.sizes, seen)
+                if 'product-image' in classes:
+                    self._collect(tag.find_all('img'), self.images, seen)
+            if self.description is None and tag.get('id') == 'collapseOne':
+                self.description = tag
+            if self.meta_code is None and tag.name == 'meta' and tag.get('name') == 'ProductCodeColorCode':
+                self.meta_code = tag
+
+    @staticmethod
+    def _collect(tags, target, seen):
+        for tag in tags:
+            if id(tag) not in seen:
+                seen.add(id(tag))
+                target.append(tag)
+
+
+def extract_product(text, url, features=None):
+    """
+    Extract a ProductRecord from a decoded product page in one pass.
+
+    The page is parsed into a single tree (with TREE_BUILDER unless
+    `features` says otherwise), walked once, and the embedded JSON is read
+    once. JSON values (title, category, code, color, prices,
+    sizes, images) take precedence over the HTML ones.
+    Returns None if the page cannot be parsed.
+    """
+    try:
+        soup = BeautifulSoup(text, features or TREE_BUILDER)
+        page = _PageElements(soup)
+        json_data = extract_json(text)
+        record = ProductRecord(url=url, title=_text(page.title))
+
+        # Product code: meta tag, then the code element, then the URL
+        if page.meta_code is not None and (page.meta_code.get('content') or '').strip():
+            record.product_code = page.meta_code['content'].strip()
+        else:
+            code_match = PRODUCT_CODE_RE.search(_text(page.first.get('product-code')) or '')
+            url_match = URL_CODE_RE.search(url)
+            if code_match:
+                record.product_code = code_match.group(1)
+            elif url_match:
+                record.product_code = url_match.group(1)
+
+        record.color = _text(page.first.get('selected-color'))
+
+        price_text = _text(page.first.get('price-regular'))
+        if price_text is not None:
+            try:
+                record.price = _html_price(price_text)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Could not parse price from '{price_text}': {str(e)}")
+                record.price = 0
+
+        discount_match = re.search(r'(\d+)', _text(page.first.get('discount-rate')) or '')
+        if discount_match:
+            record.discount_ratio = float(discount_match.group(1)) / 100.0
+
+        record.in_stock = OUT_OF_STOCK_RE.search(soup.get_text()) is None
+
+        if page.description is not None:
+            record.description = page.description.decode_contents().strip()
+
+        for size in page.sizes:
+            in_stock = 'disabled' not in size.get('class', [])
+            record.sizes.append(SizeRecord(
+                size_name=size.get_text().strip(),
+                size_id=size.get('data-id', ''),
+                size_general_stock=1 if in_stock else 0,  # Replaced by the JSON stock when available
+                in_stock=in_stock
+            ))
+
+        if json_data:
+            _apply_json(record, json_data)
+
+        if not record.images:
+            # Like the old selector loop, an img with an empty src still counts
+            for img in page.images:
+                src = img.get('src')
+                if src is not None:
+                    record.images.append('https:' + src if src.startswith('//') else src)
+
+        return record
+
+    except Exception as e:
+        logger.error(f"Error extracting product data: {str(e)}")
+        return None
+
+
+def _apply_json(record, json_data):
+    record.title = json_data.get('ModelName', record.title)
+    record.category = json_data.get('CategoryName', record.category)
+    record.product_code = json_data.get('ProductId', record.product_code)
+    record.color = json_data.get('Color', record.color)
+
+    prices = json_data.get('ProductPrices') or {}
+    if 'Price' in prices:
+        try:
+            record.price = parse_price(prices['Price'])
+        except (ValueError, TypeError) as e:
+            # Keep the price from the HTML
+            logger.warning(f"Could not parse price from JSON data: {str(e)}")
+    if 'DiscountRatio' in prices:
+        try:
+            discount = prices['DiscountRatio']
+            if isinstance(discount, str):
+                discount = re.sub(r'[^0-9,.]', '', discount).replace(',', '.')
+            record.discount_ratio = float(discount or 0) / 100
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Could not parse discount ratio: {str(e)}")
+
+    for picture in json_data.get('Pictures') or []:
+        for image_size in IMAGE_SIZES:
+            image_url = picture.get(image_size)
+            if isinstance(image_url, str) and image_url:
+                record.images.append('https:' + image_url if image_url.startswith('//') else image_url)
+                break
+
+    if json_data.get('ProductSizes'):
+        record.sizes = [
+            SizeRecord(
+                size_name=size.get('Size', {}).get('Value', ''),
+                size_id=size.get('Size', {}).get('SizeId', ''),
+                size_general_stock=size.get('Stock', 0),
+                product_option_size_reference=size.get('UrunOptionSizeRef', ''),
+                barcode_list=size.get('BarcodeList', []),
+                in_stock=size.get('Stock', 0) > 0
+            )
+            for size in json_data['ProductSizes']
+        ]
@@ -14,27 +14,42 @@ class Product(models.Model):
     images = models.JSONField(default=list)
     timestamp = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=50, default="pending")
+    needs_refresh = models.BooleanField(default=False, db_index=True, help_text="Changed upstream since the last scrape")
+    etag = models.CharField(max_length=255, blank=True, null=True, help_text="ETag of the last fetched product page")
+    last_modified = models.CharField(max_length=64, blank=True, null=True, help_text="Last-Modified header of the last fetched product page")
+    body_hash = models.CharField(max_length=64, blank=True, null=True, help_text="SHA-256 of the last fetched product page body")
+    content_hash = models.CharField(max_length=64, blank=True, null=True, help_text="SHA-256 of the normalized scraped product data")
 
-    def save(self, *args, **kwargs):
-        # Get the active price configuration and apply it
+    @staticmethod
+    def get_price_config():
+        """Return the price_config of the default Config, or None if it has none"""
         from lcwaikiki.models import Config
         active_config = Config.objects.filter(name='default').first()
         
-        if self.price and active_config:
+        # This assumes price configuration is embedded in the brands JSON
+        # or we can add it separately later
+        if active_config and 'price_config' in active_config.brands:
+            return active_config.brands['price_config']
+        return None
+
+    @staticmethod
+    def apply_price_config(price, price_config):
+        """Apply the threshold based price multipliers of a price_config to a raw price"""
+        threshold = price_config.get('threshold', 0)
+        below_multiplier = price_config.get('below_multiplier', 1.0)
+        above_multiplier = price_config.get('above_multiplier', 1.0)
+        
+        if float(price) < threshold:
+            return float(price) * below_multiplier
+        return float(price) * above_multiplier
+
+    def save(self, *args, **kwargs):
+        # Get the active price configuration and apply it
+        if self.price:
             try:
-                # Apply price configuration if available
-                # This assumes price configuration is embedded in the brands JSON
-                # or we can add it separately later
-                if 'price_config' in active_config.brands:
-                    price_config = active_config.brands['price_config']
-                    threshold = price_config.get('threshold', 0)
-                    below_multiplier = price_config.get('below_multiplier', 1.0)
-                    above_multiplier = price_config.get('above_multiplier', 1.0)
-                    
-                    if float(self.price) < threshold:
-                        self.price = float(self.price) * below_multiplier
-                    else:
-                        self.price = float(self.price) * above_multiplier
+                price_config = self.get_price_config()
+                if price_config:
+                    self.price = self.apply_price_config(self.price, price_config)
             except Exception as e:
                 # Just log the error and continue with the original price
                 print(f"Error applying price configuration: {e}")
@@ -1,26 +1,52 @@
 import logging
+import hashlib
 import json
-import re
+import multiprocessing
+import os
+import queue
 import time
 import random
 import requests
 import threading
-import html
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta
+from functools import partial
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
 
 from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import Q
 
 from .product_models import Product, ProductSize, City, Store, SizeStoreStock
 from .models import ProductAvailableUrl, ProductDeletedUrl, ProductNewUrl, Config
+from .crawl_engine import (
+    AsyncCrawlEngine, HostLimiter, RetryLater, RetryPolicy, SessionPool, ThreadedCrawlEngine, get_rate_limiter,
+    host_of, submit_retrying
+)
+from .inventory_cache import DEFAULT_TTLS, get_inventory_cache, inventory_tier
+from .product_extractor import extract_json, extract_product
+from .proxy_manager import get_proxy_manager
 
 # Configure logging for better readability
 logger = logging.getLogger(__name__)
 
+class RequestState:
+    """Progress of one logical request across its attempts, so a retry can resume on any worker"""
+
+    def __init__(self, method, url, max_proxy_attempts=None, headers=None, kwargs=None):
+        self.method = method
+        self.url = url
+        self.host = host_of(url)
+        self.max_proxy_attempts = max_proxy_attempts
+        self.headers = headers
+        self.kwargs = kwargs or {}
+        self.request_headers = None
+        self.proxy = None
+        self.proxies_tried = set()
+        self.proxy_attempts = 0
+        self.attempt = 0  # Attempts made with the current proxy, 0 before one is picked
+
 class ProductScraper:
     """LCWaikiki product scraper with improved proxy and user agent handling"""
     
@@ -36,8 +62,10 @@ class ProductScraper:
     DEFAULT_CITY_ID = "870"  # Sakarya - Default city for inventory checks
     INVENTORY_API_URL = "https://www.lcw.com/tr-TR/TR/ajax/Model/GetStoreInventoryMultiple"
     
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, engine='threads'):
+        self.engine = engine
+        # One session per worker thread and proxy; headers are passed per request
+        self.sessions = SessionPool()
         # Get active configuration
         try:
             self.config = Config.objects.filter(is_active=True).first()
@@ -51,18 +79,29 @@ class ProductScraper:
                 self.retry_delay = scraper_config.get('retry_delay', 5)
                 self.default_timeout = scraper_config.get('timeout', 30)
                 self.max_proxy_attempts = scraper_config.get('max_proxy_attempts', 3)
+                self.async_concurrency = scraper_config.get('async_concurrency', 100)
+                self.parse_processes = scraper_config.get('parse_processes', os.cpu_count() or 1)
+                self.inventory_concurrency = scraper_config.get('inventory_concurrency', 8)
             else:
                 # Default values
                 self.max_retries = 5
                 self.retry_delay = 5
                 self.default_timeout = 30
                 self.max_proxy_attempts = 3
+                self.async_concurrency = 100
+                self.parse_processes = os.cpu_count() or 1
+                self.inventory_concurrency = 8
                 
             # Get city configuration
             if self.config:
                 self.default_city_id = self.config.default_city_id
             else:
                 self.default_city_id = self.DEFAULT_CITY_ID
+            
+            # Freshness of cached inventory responses per product tier
+            self.inventory_ttls = dict(DEFAULT_TTLS)
+            if self.config and isinstance(self.config.brands, dict):
+                self.inventory_ttls.update(self.config.brands.get('stock_config', {}).get('inventory_ttl', {}))
         except Exception as e:
             logger.error(f"Error loading configuration: {str(e)}")
             # Default values if configuration loading fails
@@ -70,10 +109,56 @@ class ProductScraper:
             self.retry_delay = 5
             self.default_timeout = 30
             self.max_proxy_attempts = 3
+            self.async_concurrency = 100
+            self.parse_processes = os.cpu_count() or 1
+            self.inventory_concurrency = 8
             self.default_city_id = self.DEFAULT_CITY_ID
+            self.inventory_ttls = dict(DEFAULT_TTLS)
             self.config = None
             
         self.proxy_list = getattr(settings, 'PROXY_LIST', [])
+        # Shared by every scraper in the process so proxy health is learned once
+        self.proxy_manager = get_proxy_manager(self.proxy_list)
+        self.rate_limiter = get_rate_limiter()
+        # Inventory requests of all products this scraper works on share one concurrency budget
+        self.inventory_limiter = HostLimiter(self.inventory_concurrency)
+        self.inventory_cache = get_inventory_cache()
+        self._inventory_engine = None
+        self._inventory_engine_lock = threading.Lock()
+        
+    @property
+    def retry_policy(self):
+        """Retry and proxy rotation rules, shared with the async engine"""
+        return RetryPolicy(self.max_retries, self.retry_delay, self.max_proxy_attempts)
+    
+    @property
+    def inventory_engine(self):
+        """
+        Engine for inventory requests, created on first use and shared by all
+        products, so its worker threads keep their sessions (and TLS
+        connections) from one product to the next. Released by close().
+        """
+        with self._inventory_engine_lock:
+            if self._inventory_engine is None:
+                self._inventory_engine = ThreadedCrawlEngine(
+                    max_workers=self.inventory_concurrency,
+                    limiter=self.inventory_limiter,
+                    executor=ThreadPoolExecutor(
+                        max_workers=self.inventory_concurrency, thread_name_prefix='inventory'
+                    )
+                )
+            return self._inventory_engine
+    
+    def close(self):
+        """
+        Shut down the inventory worker threads and close the pooled
+        connections; a later request starts new ones.
+        """
+        with self._inventory_engine_lock:
+            engine, self._inventory_engine = self._inventory_engine, None
+        if engine is not None:
+            engine.executor.shutdown(wait=True)
+        self.sessions.close()
         
     def _get_random_proxy(self):
         """Get a random proxy from settings"""
@@ -91,138 +176,284 @@ class ProductScraper:
             'User-Agent': user_agent,
         }
         
-    def fetch(self, url, max_proxy_attempts=3):
-        """Fetch URL content with retry and proxy rotation logic"""
-        if max_proxy_attempts is None:
-            max_proxy_attempts = len(self.proxy_list) if self.proxy_list else 1
-            
-        proxy_attempts = 0
-        proxies_tried = set()
+    def fetch(self, url, max_proxy_attempts=None, validators=None):
+        """
+        Fetch URL content with retry and proxy rotation logic.
         
-        while proxy_attempts < max_proxy_attempts:
-            # Get a proxy that hasn't been tried yet if possible
-            available_proxies = [p for p in self.proxy_list if p not in proxies_tried] if self.proxy_list else [None]
-            if not available_proxies:
-                logger.warning("All proxies have been tried without success")
-                break
-                
-            proxy = random.choice(available_proxies)
-            proxies = {"http": proxy, "https": proxy} if proxy else None
-            
-            if proxy:
-                proxies_tried.add(proxy)
-            
-            # Update headers with new random user agent for each attempt
-            self.session.headers.update(self._get_headers())
-            
-            logger.info(f"Proxy attempt {proxy_attempts + 1}/{max_proxy_attempts}: {proxy}")
-            
-            # Try up to max_retries times with this proxy
-            for attempt in range(1, self.max_retries + 1):
-                try:
-                    response = self.session.get(
-                        url, 
-                        proxies=proxies, 
-                        timeout=30,
-                        allow_redirects=True,
-                        verify=True
-                    )
-                    
-                    if response.status_code == 200:
-                        logger.info(f"Successfully fetched {url}")
-                        return response
-                    
-                    elif response.status_code == 403:
-                        logger.warning(f"Access denied (403) with proxy {proxy}, attempt {attempt}")
-                        if attempt == self.max_retries:
-                            break  # Try next proxy
-                        time.sleep(self.retry_delay * attempt)  # Exponential backoff
-                        
-                    else:
-                        logger.warning(f"HTTP {response.status_code} with proxy {proxy}, attempt {attempt}")
-                        response.raise_for_status()
-                        
-                except requests.exceptions.RequestException as e:
-                    logger.warning(f"Request error with proxy {proxy}, attempt {attempt}: {str(e)}")
-                    if attempt == self.max_retries:
-                        break  # Try next proxy
-                    time.sleep(self.retry_delay * attempt)  # Exponential backoff
-            
-            proxy_attempts += 1
+        With the stored `validators` of the page (see load_validators) the
+        request is conditional, and the response's `not_modified` tells
+        whether the page is unchanged.
+        """
+        response = self._request('GET', url, max_proxy_attempts, headers=self.conditional_headers(validators))
+        if response is not None:
+            logger.info(f"Successfully fetched {url}")
+            self.check_not_modified(response, validators)
+        return response
+    
+    def fetch_nowait(self, url, max_proxy_attempts=None, validators=None, state=None):
+        """
+        Single fetch attempt for pool workers. Instead of sleeping before the
+        next attempt it raises RetryLater, whose `resume` continues with the
+        same proxy/attempt state; see crawl_engine.submit_retrying.
+        """
+        state = state or RequestState('GET', url, max_proxy_attempts, self.conditional_headers(validators))
+        try:
+            response = self._attempt(state)
+        except RetryLater as retry:
+            resume = partial(self.fetch_nowait, url, max_proxy_attempts, validators, state)
+            raise RetryLater(retry.delay, resume, str(retry)) from None
         
-        logger.error("All proxy attempts failed")
-        return None
+        if response is not None:
+            self.check_not_modified(response, validators)
+        return response
     
-    def post(self, url, data, headers=None, max_proxy_attempts=3):
-        """POST request with retry and proxy rotation logic"""
-        if max_proxy_attempts is None:
-            max_proxy_attempts = len(self.proxy_list) if self.proxy_list else 1
-            
-        proxy_attempts = 0
-        proxies_tried = set()
+    @staticmethod
+    def load_validators(urls):
+        """Return the stored ETag/Last-Modified/body hash of every known product URL, keyed by URL"""
+        urls = list(urls)
+        validators = {}
+        for i in range(0, len(urls), 1000):
+            for url, etag, last_modified, body_hash in Product.objects.filter(url__in=urls[i:i+1000]).values_list(
+                'url', 'etag', 'last_modified', 'body_hash'
+            ):
+                validators[url] = {'etag': etag, 'last_modified': last_modified, 'body_hash': body_hash}
+        return validators
+    
+    @staticmethod
+    def conditional_headers(validators):
+        """If-None-Match/If-Modified-Since headers that let the server answer 304"""
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+    
+    @staticmethod
+    def response_validators(response):
+        """Validators of a 200 response, stored on the Product for the next conditional fetch"""
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_hash': hashlib.sha256(response.content).hexdigest(),
+        }
+    
+    @classmethod
+    def unchanged_validators(cls, response):
+        """
+        Validators to store for a response with `not_modified` set. A 304 has
+        no body, so only the validators it carries replace the stored ones.
+        """
+        if response.status_code == 304:
+            validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+            return {key: value for key, value in validators.items() if value}
+        return cls.response_validators(response)
+    
+    @staticmethod
+    def content_hash(product_data):
+        """
+        SHA-256 of the normalized product data (product fields and sizes),
+        ignoring the URL and HTTP validators, so pages that differ only in
+        markup or tracking tokens hash the same.
+        """
+        ignored = ('url', 'etag', 'last_modified', 'body_hash', 'content_hash')
+        payload = {
+            'product': {key: value for key, value in product_data['product'].items() if key not in ignored},
+            'sizes': sorted(product_data['sizes'], key=lambda size: str(size.get('size_name'))),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    
+    @staticmethod
+    def check_not_modified(response, validators):
+        """
+        Set `response.not_modified`: the server answered 304, or sent a body
+        identical to the stored one (for pages served without validators).
+        """
+        if response.status_code == 304:
+            response.not_modified = True
+        else:
+            response.not_modified = bool(
+                validators and validators.get('body_hash')
+                and hashlib.sha256(response.content).hexdigest() == validators['body_hash']
+            )
+        return response.not_modified
+    
+    def post(self, url, data, headers=None, max_proxy_attempts=None):
+        """
+        POST request with retry and proxy rotation logic. Sleeps between
+        attempts, so pool workers use post_nowait instead.
+        """
+        response = self._request('POST', url, max_proxy_attempts, json=data, headers=headers)
+        if response is not None:
+            logger.info(f"Successfully posted to {url}")
+        return response
+    
+    def post_nowait(self, url, data, headers=None, max_proxy_attempts=None, state=None):
+        """
+        Single POST attempt for pool workers, like fetch_nowait: a failed
+        attempt raises RetryLater, whose `resume` continues with the same
+        proxy/attempt state.
+        """
+        state = state or RequestState('POST', url, max_proxy_attempts, headers, {'json': data})
+        try:
+            response = self._attempt(state)
+        except RetryLater as retry:
+            resume = partial(self.post_nowait, url, data, headers, max_proxy_attempts, state)
+            raise RetryLater(retry.delay, resume, str(retry)) from None
         
-        while proxy_attempts < max_proxy_attempts:
-            # Get a proxy that hasn't been tried yet if possible
-            available_proxies = [p for p in self.proxy_list if p not in proxies_tried] if self.proxy_list else [None]
-            if not available_proxies:
-                logger.warning("All proxies have been tried without success")
-                break
+        if response is not None:
+            logger.info(f"Successfully posted to {url}")
+        return response
+
+    def _request(self, method, url, max_proxy_attempts=None, headers=None, **kwargs):
+        """Blocking request: runs attempts until one succeeds, sleeping between them"""
+        call = partial(self._attempt, RequestState(method, url, max_proxy_attempts, headers, kwargs))
+        while True:
+            try:
+                return call()
+            except RetryLater as retry:
+                time.sleep(retry.delay)
+                call = retry.resume
+
+    def _attempt(self, state):
+        """
+        Send one request through the healthiest proxy.
+        
+        Proxies come from the shared ProxyManager and every outcome is
+        reported back to it. A 403, timeout or unreachable proxy opens its circuit and
+        moves on to the next proxy at once instead of retrying a blocked one;
+        other errors are retried on the same proxy until its circuit opens,
+        after a backoff that is returned to the caller as RetryLater.
+        Returns the response, or None once every proxy attempt has failed.
+        """
+        retry_policy = self.retry_policy
+        max_proxy_attempts = retry_policy.proxy_rounds(self.proxy_list, state.max_proxy_attempts)
+        
+        while True:
+            if state.attempt == 0:
+                # Start on a new proxy
+                if state.proxy_attempts >= max_proxy_attempts:
+                    logger.error("All proxy attempts failed")
+                    return None
                 
-            proxy = random.choice(available_proxies)
-            proxies = {"http": proxy, "https": proxy} if proxy else None
-            
-            if proxy:
-                proxies_tried.add(proxy)
-            
-            # Update headers with new random user agent for each attempt
-            if headers is None:
-                headers = {}
-            headers.update(self._get_headers())
+                state.proxy = None
+                if self.proxy_list:
+                    state.proxy = self.proxy_manager.acquire(exclude=state.proxies_tried)
+                    if state.proxy is None:
+                        logger.warning("All proxies have been tried without success")
+                        logger.error("All proxy attempts failed")
+                        return None
+                    state.proxies_tried.add(state.proxy)
+                
+                # New random user agent for each proxy; the caller's headers (Referer, Content-Type) win
+                state.request_headers = {**self._get_headers(), **(state.headers or {})}
+                logger.info(f"Proxy attempt {state.proxy_attempts + 1}/{max_proxy_attempts}: {state.proxy}")
+            
+            state.attempt += 1
+            attempt, proxy = state.attempt, state.proxy
+            # Looked up on every attempt since a resumed retry may run on another worker thread
+            session = self.sessions.get(proxy)
+            
+            # The shared AIMD limiter paces every request to the host
+            self.rate_limiter.acquire(state.host)
+            started = time.monotonic()
+            response = status = throttled = None
+            try:
+                response = session.request(
+                    state.method,
+                    state.url, 
+                    headers=state.request_headers,
+                    timeout=30,
+                    allow_redirects=True,
+                    verify=True,
+                    **state.kwargs
+                )
+                status = response.status_code
+            except (requests.exceptions.Timeout, requests.exceptions.ProxyError) as e:
+                throttled = isinstance(e, requests.exceptions.Timeout)
+                logger.warning(f"Timeout or proxy failure with proxy {proxy}, attempt {attempt}: {str(e)}")
+                self.proxy_manager.report_failure(proxy, trip=True)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Request error with proxy {proxy}, attempt {attempt}: {str(e)}")
+                self.proxy_manager.report_failure(proxy)
+            finally:
+                # Also on unexpected errors, which would otherwise take the slot for good
+                self.rate_limiter.release(state.host, status, throttled=throttled)
+            
+            if response is not None:
+                # 304 only comes back for conditional requests
+                if response.status_code in (200, 304):
+                    self.proxy_manager.report_success(proxy, time.monotonic() - started)
+                    return response
+                
+                if response.status_code == 403:
+                    logger.warning(f"Access denied (403) with proxy {proxy}, attempt {attempt}")
+                    self.proxy_manager.report_failure(proxy, trip=True)
+                else:
+                    logger.warning(f"HTTP {response.status_code} with proxy {proxy}, attempt {attempt}")
+                    self.proxy_manager.report_failure(proxy)
             
-            logger.info(f"Proxy attempt {proxy_attempts + 1}/{max_proxy_attempts}: {proxy}")
+            if retry_policy.round_over(attempt, proxy, self.proxy_manager):
+                # Try next proxy right away
+                state.proxy_attempts += 1
+                state.attempt = 0
+                continue
             
-            # Try up to max_retries times with this proxy
-            for attempt in range(1, self.max_retries + 1):
-                try:
-                    response = self.session.post(
-                        url, 
-                        json=data,
-                        headers=headers,
-                        proxies=proxies, 
-                        timeout=30,
-                        allow_redirects=True,
-                        verify=True
-                    )
-                    
-                    if response.status_code == 200:
-                        logger.info(f"Successfully posted to {url}")
-                        return response
-                    
-                    elif response.status_code == 403:
-                        logger.warning(f"Access denied (403) with proxy {proxy}, attempt {attempt}")
-                        if attempt == self.max_retries:
-                            break  # Try next proxy
-                        time.sleep(self.retry_delay * attempt)  # Exponential backoff
-                        
-                    else:
-                        logger.warning(f"HTTP {response.status_code} with proxy {proxy}, attempt {attempt}")
-                        response.raise_for_status()
-                        
-                except requests.exceptions.RequestException as e:
-                    logger.warning(f"Request error with proxy {proxy}, attempt {attempt}: {str(e)}")
-                    if attempt == self.max_retries:
-                        break  # Try next proxy
-                    time.sleep(self.retry_delay * attempt)  # Exponential backoff
-            
-            proxy_attempts += 1
+            # Linear backoff, waited out by the caller
+            raise RetryLater(retry_policy.backoff(attempt), partial(self._attempt, state))
+
+    def iter_responses(self, urls, ordered=True, conditional=False):
+        """
+        Fetch URLs concurrently with the selected engine.
+        
+        Yields (url, response) pairs in the same order as `urls`, or as they
+        complete with `ordered=False`; response is None when the URL could
+        not be fetched. With `conditional`, pages of known products are
+        requested conditionally and unchanged ones have `not_modified` set.
+        """
+        validators = {}
+        if conditional:
+            urls = list(urls)
+            validators = self.load_validators(urls)
         
-        logger.error("All proxy attempts failed")
-        return None
+        if self.engine == 'async':
+            engine = AsyncCrawlEngine(
+                concurrency=self.async_concurrency,
+                timeout=self.default_timeout,
+                retry_policy=self.retry_policy,
+                proxies=self.proxy_list,
+                headers_factory=self._get_headers,
+                proxy_manager=self.proxy_manager,
+                # Same controller as the thread pools; caps async_concurrency at max_concurrent_requests
+                rate_limiter=self.rate_limiter
+            )
+            for url, response, _ in engine.map(
+                urls,
+                url_for=lambda url: url,
+                headers_for=lambda url: self.conditional_headers(validators.get(url))
+            ):
+                if response is not None:
+                    self.check_not_modified(response, validators.get(url))
+                yield url, response
+            return
+
+        max_workers = self.config.max_concurrent_requests if self.config else 5
+        engine = ThreadedCrawlEngine(max_workers=max_workers)
+        fetch = lambda url: self.fetch_nowait(url, validators=validators.get(url))
+        for url, response, _ in engine.map(fetch, urls, host_for=host_of, ordered=ordered):
+            if response is not None:
+                logger.info(f"Successfully fetched {url}")
+            yield url, response
 
     def fetch_inventory(self, product_option_size_ref, referer_url, city_id=None):
         """
         Fetch inventory information for a specific product size reference.
         This method uses the store inventory API to get stock information for all stores.
+        Sleeps between attempts, so pool workers use fetch_inventory_nowait instead.
         
         Args:
             product_option_size_ref: The product option size reference ID
@@ -232,24 +463,39 @@ class ProductScraper:
         Returns:
             dict: The JSON response from the inventory API, or None if the request failed
         """
+        call = partial(self.fetch_inventory_nowait, product_option_size_ref, referer_url, city_id)
+        while True:
+            try:
+                return call()
+            except RetryLater as retry:
+                time.sleep(retry.delay)
+                call = retry.resume
+    
+    def fetch_inventory_nowait(self, product_option_size_ref, referer_url, city_id=None, post=None):
+        """
+        Pool task: fetch_inventory with a single POST attempt. A failed
+        attempt raises RetryLater so the worker moves on while the retry waits.
+        """
         if not city_id:
             city_id = self.default_city_id
             
         try:
-            headers = {
-                'User-Agent': random.choice(self.USER_AGENTS),
-                'Content-Type': 'application/json',
-                'Referer': referer_url
-            }
-            
-            data = {
-                "cityId": str(city_id),
-                "countyIds": [],
-                "urunOptionSizeRef": str(product_option_size_ref)
-            }
-            
-            logger.info(f"Fetching inventory for product_option_size_ref={product_option_size_ref}, city_id={city_id}")
-            response = self.post(self.INVENTORY_API_URL, data, headers)
+            if post is None:
+                headers = {
+                    'User-Agent': random.choice(self.USER_AGENTS),
+                    'Content-Type': 'application/json',
+                    'Referer': referer_url
+                }
+                
+                data = {
+                    "cityId": str(city_id),
+                    "countyIds": [],
+                    "urunOptionSizeRef": str(product_option_size_ref)
+                }
+                
+                logger.info(f"Fetching inventory for product_option_size_ref={product_option_size_ref}, city_id={city_id}")
+                post = partial(self.post_nowait, self.INVENTORY_API_URL, data, headers)
+            response = post()
             
             if response and response.status_code == 200:
                 try:
@@ -263,10 +509,122 @@ class ProductScraper:
                 logger.warning(f"Failed to fetch inventory: HTTP {response.status_code if response else 'No response'}")
                 
             return None
+        except RetryLater as retry:
+            resume = partial(self.fetch_inventory_nowait, product_option_size_ref, referer_url, city_id, retry.resume)
+            raise RetryLater(retry.delay, resume, str(retry)) from None
         except Exception as e:
             logger.error(f"Error fetching inventory: {str(e)}")
             return None
     
+    def active_cities(self):
+        """City IDs whose store inventory is collected"""
+        cities = self.config.active_cities if self.config else None
+        return [str(city_id) for city_id in dict.fromkeys(cities or [self.default_city_id])]
+    
+    def fetch_inventories(self, size_refs, referer_url, city_ids=None, max_ages=None):
+        """
+        Fetch the inventory of several size references in several cities
+        concurrently, within the scraper's shared inventory budget. Each
+        distinct reference is requested once per city, and references with a
+        cached response younger than their entry in `max_ages` (seconds) are
+        not requested at all. Nothing is written to the database here: new
+        responses are cached in memory until store_product_inventory flushes
+        them.
+        
+        Returns:
+            dict: Inventory data (or None) keyed by city ID, then by size reference as a string
+        """
+        return self._fetch_inventories(size_refs, referer_url, city_ids, max_ages)[0]
+    
+    def _fetch_inventories(self, size_refs, referer_url, city_ids=None, max_ages=None):
+        """fetch_inventories, also returning the (size reference, city ID) pairs requested from the API"""
+        city_ids = [str(city_id) for city_id in dict.fromkeys(city_ids or [self.default_city_id])]
+        refs = list(dict.fromkeys(str(ref) for ref in size_refs if ref))
+        
+        inventories = {}
+        missing = []
+        for city_id in city_ids:
+            inventories[city_id] = {}
+            if max_ages:
+                inventories[city_id] = self.inventory_cache.get_many(
+                    {ref: max_ages.get(ref, 0) for ref in refs}, city_id
+                )
+            missing.extend((ref, city_id) for ref in refs if ref not in inventories[city_id])
+        cached_count = len(refs) * len(city_ids) - len(missing)
+        if cached_count:
+            logger.info(f"Using cached inventory for {cached_count} of {len(refs) * len(city_ids)} size/city pairs")
+        
+        fetched = {}
+        if missing:
+            # Even a single request goes through the engine: its workers hand failed attempts to
+            # the retry queue, while the caller (often a pipeline worker) would sleep between them
+            fetch = lambda key: self.fetch_inventory_nowait(key[0], referer_url, key[1])
+            inventory_host = host_of(self.INVENTORY_API_URL)
+            for key, inventory_data, _ in self.inventory_engine.map(
+                fetch, missing, host_for=lambda key: inventory_host, ordered=False
+            ):
+                fetched[key] = inventory_data
+        
+        for (ref, city_id), inventory_data in fetched.items():
+            inventories[city_id][ref] = inventory_data
+        for city_id in city_ids:
+            successful = {
+                ref: inventory_data for (ref, fetched_city_id), inventory_data in fetched.items()
+                if fetched_city_id == city_id and inventory_data
+            }
+            if successful:
+                self.inventory_cache.set_many(successful, city_id)
+        return inventories, set(fetched)
+    
+    def fetch_product_inventory(self, product_data, referer_url, refresh_only=False):
+        """
+        Network side of the inventory refresh: fetch the store inventory of
+        every in-stock size in every active city at once. With `refresh_only`,
+        sizes whose responses all came from the cache are left out, as their
+        stored stock is already that recent.
+        
+        Returns:
+            dict: The inventory responses of each size (one per city) keyed by size name
+        """
+        refs = {}
+        max_ages = {}
+        discount_ratio = product_data['product'].get('discount_ratio')
+        for size in product_data['sizes']:
+            if size.get('in_stock') and size.get('product_option_size_reference'):
+                ref = str(size['product_option_size_reference'])
+                refs[size['size_name']] = ref
+                # A reference shared by sizes of different tiers gets the shortest freshness
+                ttl = self.inventory_ttls.get(inventory_tier(size, discount_ratio), 0)
+                max_ages[ref] = min(ttl, max_ages.get(ref, ttl))
+        if not refs:
+            return {}
+        
+        inventories, fetched = self._fetch_inventories(
+            list(refs.values()), referer_url, city_ids=self.active_cities(), max_ages=max_ages
+        )
+        return {
+            size_name: [city_inventories.get(ref) for city_inventories in inventories.values()]
+            for size_name, ref in refs.items()
+            # A size is stored with the responses of all cities, as its stock is their total
+            if not refresh_only or any((ref, city_id) in fetched for city_id in inventories)
+        }
+    
+    def store_product_inventory(self, product, size_inventories):
+        """Database side of the inventory refresh: store the responses of fetch_product_inventory"""
+        # Responses cached by the fetch side are persisted along with the stock
+        self.inventory_cache.flush()
+        if not size_inventories:
+            return
+        # One query for all sizes instead of one per size
+        product_sizes = ProductSize.objects.filter(product=product, size_name__in=list(size_inventories))
+        
+        # The responses of all cities are merged and written together
+        self.store_inventories([
+            (product_size, inventory_data)
+            for product_size in product_sizes
+            for inventory_data in size_inventories[product_size.size_name]
+        ])
+    
     def process_inventory_data(self, product_size, inventory_data):
         """
         Process inventory data from the API and update the database.
@@ -276,71 +634,103 @@ class ProductScraper:
             product_size: The ProductSize model instance to update
             inventory_data: The inventory data from the API
             
+        Returns:
+            bool: True if the inventory was successfully processed, False otherwise
+        """
+        return self.store_inventories([(product_size, inventory_data)])
+    
+    def store_inventories(self, entries):
+        """
+        Store inventory responses of any number of sizes and cities with one
+        bulk write per table.
+        
+        Args:
+            entries: (ProductSize, inventory data) pairs; a size may appear
+                once per city, and entries without data are skipped
+            
         Returns:
             bool: True if the inventory was successfully processed, False otherwise
         """
         try:
-            if not inventory_data or 'storeInventoryInfos' not in inventory_data:
-                logger.warning("No store inventory information found")
-                return False
-                
             # Get active cities from configuration
-            active_cities = self.config.active_cities if self.config else ['870']  # 870 = Sakarya
+            active_cities = [str(city_id) for city_id in (self.config.active_cities if self.config else ['870'])]  # 870 = Sakarya
             
-            # Dictionary to track cities and their total stock
-            city_stocks = {}
+            cities = {}
+            stores = {}
+            stocks = {}
+            size_totals = {}
+            found = False
             
-            # Process each store
-            for store_data in inventory_data.get('storeInventoryInfos', []):
-                city_id = str(store_data.get('StoreCityId'))
-                city_name = store_data.get('StoreCityName')
-                
-                # Skip cities that are not in the active list
-                if city_id not in active_cities:
+            for product_size, inventory_data in entries:
+                if not inventory_data or 'storeInventoryInfos' not in inventory_data:
                     continue
+                found = True
                 
-                # Create or get city
-                city, _ = City.objects.get_or_create(
-                    city_id=city_id,
-                    defaults={'name': city_name}
+                for store_data in inventory_data.get('storeInventoryInfos', []):
+                    city_id = str(store_data.get('StoreCityId'))
+                    
+                    # Skip cities that are not in the active list
+                    if city_id not in active_cities:
+                        continue
+                    
+                    cities.setdefault(city_id, store_data.get('StoreCityName') or '')
+                    store_code = store_data.get('StoreCode', '')
+                    stores[store_code] = Store(
+                        store_code=store_code,
+                        store_name=store_data.get('StoreName', ''),
+                        city_id=city_id,
+                        store_county=store_data.get('StoreCountyName', ''),
+                        store_phone=store_data.get('StorePhone', ''),
+                        address=store_data.get('Address', ''),
+                        latitude=store_data.get('Lattitude', ''),
+                        longitude=store_data.get('Longitude', '')
+                    )
+                    
+                    # A store listed in the responses of several cities is counted once
+                    key = (product_size.pk, store_code)
+                    if key in stocks:
+                        continue
+                    stock_quantity = store_data.get('Quantity', 0)
+                    stocks[key] = SizeStoreStock(product_size=product_size, store_id=store_code, stock=stock_quantity)
+                    
+                    # Track the size's total stock over all active cities
+                    total = size_totals.setdefault(product_size.pk, [product_size, 0])
+                    total[1] += stock_quantity
+            
+            if not found:
+                logger.warning("No store inventory information found")
+                return False
+            
+            with transaction.atomic():
+                City.objects.bulk_create(
+                    [City(city_id=city_id, name=name) for city_id, name in cities.items()],
+                    ignore_conflicts=True
                 )
-                
-                # Create or update store
-                store, _ = Store.objects.update_or_create(
-                    store_code=store_data.get('StoreCode', ''),
-                    defaults={
-                        'store_name': store_data.get('StoreName', ''),
-                        'city': city,
-                        'store_county': store_data.get('StoreCountyName', ''),
-                        'store_phone': store_data.get('StorePhone', ''),
-                        'address': store_data.get('Address', ''),
-                        'latitude': store_data.get('Lattitude', ''),
-                        'longitude': store_data.get('Longitude', '')
-                    }
+                Store.objects.bulk_create(
+                    list(stores.values()),
+                    update_conflicts=True,
+                    unique_fields=['store_code'],
+                    update_fields=['store_name', 'city', 'store_county', 'store_phone', 'address', 'latitude', 'longitude']
                 )
-                
-                # Store stock quantity
-                stock_quantity = store_data.get('Quantity', 0)
-                
-                # Create or update store stock
-                SizeStoreStock.objects.update_or_create(
-                    product_size=product_size,
-                    store=store,
-                    defaults={'stock': stock_quantity}
+                SizeStoreStock.objects.bulk_create(
+                    list(stocks.values()),
+                    update_conflicts=True,
+                    unique_fields=['product_size', 'store'],
+                    update_fields=['stock']
                 )
                 
-                # Track city stock
-                if city_id not in city_stocks:
-                    city_stocks[city_id] = 0
-                city_stocks[city_id] += stock_quantity
-            
-            # Update product size total stock based on city stocks
-            total_stock = sum(city_stocks.values())
-            if total_stock > 0:
-                product_size.size_general_stock = total_stock
-                product_size.save(update_fields=['size_general_stock'])
-                logger.info(f"Updated product size {product_size.size_name} with total stock {total_stock} from {len(inventory_data.get('storeInventoryInfos', []))} stores")
-                
+                # Update product size total stock based on city stocks
+                updated_sizes = []
+                for product_size, total_stock in size_totals.values():
+                    if total_stock > 0:
+                        product_size.size_general_stock = total_stock
+                        updated_sizes.append(product_size)
+                ProductSize.objects.bulk_update(updated_sizes, ['size_general_stock'])
+            
+            if updated_sizes:
+                logger.info(
+                    f"Updated {len(updated_sizes)} product sizes from {len(stores)} stores in {len(cities)} cities"
+                )
             return True
         except Exception as e:
             logger.error(f"Error processing inventory data: {str(e)}")
@@ -348,233 +738,15 @@ class ProductScraper:
             
     def extract_json_data(self, response):
         """Extract product JSON data from the response"""
-        try:
-            script_tags = re.findall(r'<script[^>]*>(.*?)</script>', response.text, re.DOTALL)
-            
-            # 1. İlk olarak cartOperationViewModel'i ara
-            for script in script_tags:
-                try:
-                    pattern = r'cartOperationViewModel\s*=\s*({.*?});'
-                    match = re.search(pattern, script, re.DOTALL)
-                    if match:
-                        json_str = match.group(1).strip()
-                        # JSON'u temizle
-                        json_str = re.sub(r'/\*.*?\*/', '', json_str, flags=re.DOTALL)
-                        json_str = re.sub(r',\s*}', '}', json_str)
-                        json_str = re.sub(r',\s*]', ']', json_str)
-                        
-                        try:
-                            return json.loads(json_str)
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"JSON decode error: {str(e)}, attempting additional cleanup")
-                            # Sorunlu JSON için ek temizlik
-                            json_str = re.sub(r'undefined', 'null', json_str)
-                            json_str = re.sub(r'NaN', '0', json_str)
-                            json_str = re.sub(r'//.*?\\n', '', json_str)
-                            return json.loads(json_str)
-                except Exception as e:
-                    logger.error(f"JSON parsing error in script tag: {str(e)}")
-                    continue
-            
-            # 2. Alternatif olarak meta etiketlerini dene
-            try:
-                meta_tag = re.search(r'<meta name="product-info" content="([^"]+)"', response.text)
-                if meta_tag:
-                    meta_content = meta_tag.group(1)
-                    meta_content = html.unescape(meta_content)  # HTML varlıklarını işle
-                    return json.loads(meta_content)
-            except Exception as e:
-                logger.error(f"Error extracting meta tag product info: {str(e)}")
-            
-            # 3. Ürün verilerini HTML'de doğrudan ara
-            try:
-                product_data_match = re.search(r'var\s+productDetailData\s*=\s*({.*?});', response.text, re.DOTALL)
-                if product_data_match:
-                    json_str = product_data_match.group(1).strip()
-                    json_str = re.sub(r',\s*}', '}', json_str)
-                    json_str = re.sub(r',\s*]', ']', json_str)
-                    return json.loads(json_str)
-            except Exception as e:
-                logger.error(f"Error extracting product detail data: {str(e)}")
-            
-            # 4. modal_data variable'ını ara (yeni eklendi)
-            try:
-                modal_data_match = re.search(r'var\s+modal_data\s*=\s*({.*?});', response.text, re.DOTALL)
-                if modal_data_match:
-                    json_str = modal_data_match.group(1).strip()
-                    json_str = re.sub(r',\s*}', '}', json_str)
-                    json_str = re.sub(r',\s*]', ']', json_str)
-                    return json.loads(json_str)
-            except Exception as e:
-                logger.error(f"Error extracting modal data: {str(e)}")
-            
-            logger.warning(f"No valid JSON data found in response")
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting JSON data: {str(e)}")
-            return None
+        return extract_json(response.text)
         
     def extract_product_data(self, response):
-        """Extract all product data from the response"""
-        try:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            json_data = self.extract_json_data(response)
-            product_url = response.url
-            
-            # Extract basic product information
-            product_data = {
-                'url': product_url,
-                'title': soup.select_one('h1.product-title').text.strip() if soup.select_one('h1.product-title') else None,
-                'category': None,  # To be extracted from breadcrumbs
-                'price': None,
-                'discount_ratio': None,
-                'in_stock': False,
-                'images': [],
-                'status': 'active'
-            }
-            
-            # Extract product code - first from HTML meta tag
-            meta_tags = re.findall(r'<meta\s+([^>]+)>', response.text, re.IGNORECASE)
-            product_code = None
-            
-            # Try to get product code from meta tags
-            for tag in meta_tags:
-                name_match = re.search(r'name=["\']?([^"\'>\s]+)', tag, re.IGNORECASE)
-                content_match = re.search(r'content=["\']?([^"\'>]+)', tag, re.IGNORECASE)
-                
-                if name_match and content_match:
-                    name = name_match.group(1)
-                    content = content_match.group(1)
-                    
-                    if name == 'ProductCodeColorCode' and content:
-                        product_code = content.strip()
-                        break
-            
-            # If product code not found in meta tags, try from HTML
-            if not product_code:
-                product_code_elem = soup.select_one('.product-code')
-                if product_code_elem:
-                    product_code_text = product_code_elem.text.strip()
-                    product_code_match = re.search(r'([A-Z0-9]+)', product_code_text)
-                    if product_code_match:
-                        product_code = product_code_match.group(1)
-            
-            # If still not found, try from URL pattern
-            if not product_code:
-                url_code_match = re.search(r'-o-(\d+)', product_url)
-                if url_code_match:
-                    product_code = url_code_match.group(1)
-            
-            if product_code:
-                product_data['product_code'] = product_code
-            
-            # Extract color - first from JSON data if available
-            if json_data and 'Color' in json_data:
-                product_data['color'] = json_data['Color']
-            else:
-                # Fallback to HTML
-                color_elem = soup.select_one('.selected-color')
-                if color_elem:
-                    product_data['color'] = color_elem.text.strip()
-            
-            # Extract price information
-            price_elem = soup.select_one('.price-regular')
-            if price_elem:
-                try:
-                    price_text = price_elem.text.strip()
-                    # First try to find the numeric pattern directly
-                    price_match = re.search(r'(\d+(?:[.,]\d+)?)', price_text.replace('.', ''))
-                    if price_match:
-                        # Extract the price without currency symbol
-                        price_text = price_match.group(1)
-                        # If comma is used as decimal separator (Turkish format)
-                        if ',' in price_text:
-                            price_text = price_text.replace(',', '.')
-                        product_data['price'] = float(price_text)
-                    else:
-                        # Fallback: try more aggressive cleaning
-                        price_text = re.sub(r'[^0-9,.]', '', price_text)
-                        # For Turkish format: Replace dots used as thousand separators and commas as decimal points
-                        if ',' in price_text:
-                            # If comma is used as decimal separator
-                            price_text = price_text.replace('.', '') # Remove thousand separators
-                            price_text = price_text.replace(',', '.') # Convert comma to dot for decimal
-                        
-                        product_data['price'] = float(price_text or 0)
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"Could not parse price from '{price_elem.text.strip()}': {str(e)}")
-                    # Use a default value as fallback if parsing fails
-                    product_data['price'] = 0
-                
-                # Log successful price extraction for debugging
-                if product_data['price'] > 0:
-                    logger.debug(f"Successfully extracted price: {product_data['price']} from '{price_elem.text.strip()}'")
-                else:
-                    logger.warning(f"Zero price extracted from '{price_elem.text.strip()}'") 
-            
-            # Extract discount ratio
-            discount_elem = soup.select_one('.discount-rate')
-            if discount_elem:
-                discount_text = discount_elem.text.strip()
-                discount_match = re.search(r'(\d+)', discount_text)
-                if discount_match:
-                    product_data['discount_ratio'] = float(discount_match.group(1)) / 100.0
-            
-            # Extract availability
-            product_data['in_stock'] = 'out of stock' not in soup.text.lower()
-            
-            # Extract images - first try JSON method (more reliable)
-            if json_data and 'Pictures' in json_data and json_data['Pictures']:
-                for pic in json_data['Pictures']:
-                    # Try different image sizes in order of preference
-                    for img_size in ['ExtraMedium800', 'ExtraMedium600', 'MediumImage', 'SmallImage']:
-                        if img_size in pic and pic[img_size]:
-                            img_url = pic[img_size]
-                            if isinstance(img_url, str):  # Ensure it's a string
-                                if img_url.startswith('//'):
-                                    img_url = 'https:' + img_url
-                                product_data['images'].append(img_url)
-                                break  # Found an image for this picture, move to next
-            
-            # Fallback: Try to extract images from HTML if JSON method didn't find any
-            if not product_data['images']:
-                image_elems = soup.select('.product-image img')
-                for img in image_elems:
-                    if 'src' in img.attrs:
-                        img_url = img['src']
-                        if isinstance(img_url, str) and img_url.startswith('//'):
-                            img_url = 'https:' + img_url
-                        product_data['images'].append(img_url)
-            
-            # Extract description
-            description_elem = soup.select_one('#collapseOne')
-            if description_elem:
-                product_data['description'] = description_elem.decode_contents().strip()
-            
-            # Extract size information
-            sizes = []
-            size_elems = soup.select('.size-list .size')
-            for size_elem in size_elems:
-                size_id = size_elem.get('data-id', '')
-                size_name = size_elem.text.strip()
-                in_stock = 'disabled' not in size_elem.get('class', [])
-                
-                sizes.append({
-                    'size_id': size_id,
-                    'size_name': size_name,
-                    'in_stock': in_stock,
-                    'size_general_stock': 1 if in_stock else 0  # Default value, will be updated if API data is available
-                })
-            
-            return {
-                'product': product_data,
-                'sizes': sizes
-            }
-            
-        except Exception as e:
-            logger.error(f"Error extracting product data: {str(e)}")
-            return None
+        """
+        Extract all product data from the response, as the dict
+        save_product_data expects. See product_extractor.extract_product.
+        """
+        record = extract_product(response.text, response.url)
+        return record.to_product_data() if record else None
 
     def save_product_data(self, product_data):
         """Save product data to database"""
@@ -593,7 +765,12 @@ class ProductScraper:
                         'discount_ratio': product_data['product'].get('discount_ratio'),
                         'in_stock': product_data['product'].get('in_stock', False),
                         'images': product_data['product'].get('images', []),
-                        'status': product_data['product'].get('status', 'active')
+                        'status': product_data['product'].get('status', 'active'),
+                        'needs_refresh': False,
+                        'etag': product_data['product'].get('etag'),
+                        'last_modified': product_data['product'].get('last_modified'),
+                        'body_hash': product_data['product'].get('body_hash'),
+                        'content_hash': product_data['product'].get('content_hash')
                     }
                 )
                 
@@ -616,131 +793,187 @@ class ProductScraper:
             logger.error(f"Error saving product data: {str(e)}")
             return None
 
-    def process_product_url(self, url):
-        """Process a single product URL"""
+    def process_product_url(self, url, response=None):
+        """Process a single product URL, optionally using an already fetched response"""
         try:
             logger.info(f"Processing product URL: {url}")
-            response = self.fetch(url)
+            if response is None:
+                response = self.fetch(url, validators=self.load_validators([url]).get(url))
             
-            if not response:
+            if response is None:
                 logger.error(f"Failed to fetch product URL: {url}")
                 return False
-                
-            # Try to extract JSON data first for better product information
-            json_data = self.extract_json_data(response)
             
-            # Extract product data from HTML
+            if getattr(response, 'not_modified', False):
+                # 304 or an identical body: nothing to parse, only the store stock may be due
+                return self.prepare_unchanged_page(url, self.unchanged_validators(response))()
+                
+            # One parse of the page; the embedded JSON takes precedence over the HTML
             product_data = self.extract_product_data(response)
             
             if not product_data:
                 logger.error(f"Failed to extract product data from URL: {url}")
                 return False
             
-            # Use JSON data if available to enrich product information
-            if json_data:
-                # Enhance product data with JSON information
-                if 'ModelName' in json_data:
-                    product_data['product']['title'] = json_data['ModelName']
-                
-                if 'CategoryName' in json_data:
-                    product_data['product']['category'] = json_data['CategoryName']
-                
-                if 'ProductId' in json_data:
-                    product_data['product']['product_code'] = json_data['ProductId']
-                
-                if 'Color' in json_data:
-                    product_data['product']['color'] = json_data['Color']
-                
-                # Update pricing information
-                product_prices = json_data.get('ProductPrices', {})
-                if product_prices:
-                    if 'Price' in product_prices:
-                        try:
-                            price_value = product_prices['Price']
-                            # Handle string values (with potential formatting)
-                            if isinstance(price_value, str):
-                                # Clean the price string
-                                price_value = re.sub(r'[^0-9,.]', '', price_value)
-                                # If comma is used as decimal separator (Turkish format)
-                                if ',' in price_value:
-                                    price_value = price_value.replace('.', '')  # Remove thousand separators
-                                    price_value = price_value.replace(',', '.')  # Convert comma to dot for decimal
-                            product_data['product']['price'] = float(price_value or 0)
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Could not parse price from JSON data: {str(e)}")
-                            # Keep the price from HTML parsing if it exists
-                            if 'price' not in product_data['product'] or product_data['product']['price'] == 0:
-                                product_data['product']['price'] = 0
-                    
-                    if 'DiscountRatio' in product_prices:
-                        try:
-                            discount_value = product_prices['DiscountRatio']
-                            if isinstance(discount_value, str):
-                                discount_value = re.sub(r'[^0-9,.]', '', discount_value)
-                                if ',' in discount_value:
-                                    discount_value = discount_value.replace(',', '.')
-                            product_data['product']['discount_ratio'] = float(discount_value or 0) / 100
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Could not parse discount ratio: {str(e)}")
-                            if 'discount_ratio' not in product_data['product']:
-                                product_data['product']['discount_ratio'] = 0
-                
-                # Add size and stock information
-                if 'ProductSizes' in json_data and json_data['ProductSizes']:
-                    # Reset sizes array with more accurate data
-                    product_data['sizes'] = []
-                    
-                    for size_info in json_data['ProductSizes']:
-                        size_obj = {
-                            'size_name': size_info.get('Size', {}).get('Value', ''),
-                            'size_id': size_info.get('Size', {}).get('SizeId', ''),
-                            'size_general_stock': size_info.get('Stock', 0),
-                            'product_option_size_reference': size_info.get('UrunOptionSizeRef', ''),
-                            'barcode_list': size_info.get('BarcodeList', []),
-                            'in_stock': size_info.get('Stock', 0) > 0
-                        }
-                        product_data['sizes'].append(size_obj)
-            
-            # Save the product data
-            product = self.save_product_data(product_data)
-            
-            if not product:
-                logger.error(f"Failed to save product data for URL: {url}")
-                return False
-            
-            # Check if we need to fetch inventory data for sizes
-            if self.config and self.config.use_stores:
-                try:
-                    # Fetch inventory data for each size with stock
-                    for size_data in product_data['sizes']:
-                        if size_data.get('in_stock') and size_data.get('product_option_size_reference'):
-                            # Get ProductSize object
-                            product_size = ProductSize.objects.filter(
-                                product=product,
-                                size_name=size_data['size_name']
-                            ).first()
-                            
-                            if product_size:
-                                # Fetch inventory data for this size
-                                inventory_data = self.fetch_inventory(
-                                    product_option_size_ref=size_data['product_option_size_reference'],
-                                    referer_url=url
-                                )
-                                
-                                if inventory_data:
-                                    # Process inventory data to update city and store stock
-                                    self.process_inventory_data(product_size, inventory_data)
-                except Exception as e:
-                    logger.error(f"Error fetching inventory data for {url}: {str(e)}")
-                    # Continue processing even if inventory fetch fails
-            
-            logger.info(f"Successfully processed product URL: {url}")
-            return True
+            return self.store_product_data(url, product_data, self.response_validators(response))
             
         except Exception as e:
             logger.error(f"Error processing product URL {url}: {str(e)}")
             return False
 
+    @staticmethod
+    def stored_product_data(product):
+        """
+        The stored product and sizes in the shape fetch_product_inventory
+        expects, for pages that came back unchanged and were not parsed.
+        """
+        sizes = [{
+            'size_name': size_name,
+            'size_general_stock': stock,
+            'in_stock': stock > 0,
+            'product_option_size_reference': ref,
+        } for size_name, stock, ref in product.sizes.values_list(
+            'size_name', 'size_general_stock', 'product_option_size_reference'
+        )]
+        return {'product': {'url': product.url, 'discount_ratio': product.discount_ratio}, 'sizes': sizes}
+
+    def prepare_unchanged_page(self, url, validators=None):
+        """
+        Counterpart of prepare_product_data for a page that came back
+        unchanged (304 or an identical body). Store stock changes without the
+        page changing, so the expired inventory of the stored sizes is still
+        fetched. `validators` (see unchanged_validators) are saved by the
+        returned write.
+        
+        Returns:
+            callable: Performs the database writes and returns True on success
+        """
+        size_inventories = {}
+        if self.config and self.config.use_stores:
+            try:
+                product = Product.objects.filter(url=url).first()
+                if product is not None:
+                    size_inventories = self.fetch_product_inventory(
+                        self.stored_product_data(product), url, refresh_only=True
+                    )
+            except Exception as e:
+                logger.error(f"Error fetching inventory data for {url}: {str(e)}")
+        return partial(self.mark_unchanged, url, size_inventories, validators)
+
+    def mark_unchanged(self, url, size_inventories=None, validators=None):
+        """
+        Record that a product page has not changed since the last scrape,
+        keeping its validators current so the next fetch can still be
+        answered with a 304, and store any refreshed inventory.
+        """
+        validators = validators or {}
+        # One update, and only for rows that are flagged or whose validators changed
+        outdated = Q(needs_refresh=True)
+        for field, value in validators.items():
+            outdated |= ~Q(**{field: value})
+        Product.objects.filter(outdated, url=url).update(needs_refresh=False, **validators)
+        if size_inventories:
+            try:
+                self.store_product_inventory(Product.objects.get(url=url), size_inventories)
+            except Exception as e:
+                logger.error(f"Error storing inventory data for {url}: {str(e)}")
+        logger.info(f"Product page unchanged: {url}")
+        return True
+
+    def prepare_product_data(self, url, product_data, validators):
+        """
+        Everything process_product_url does before writing: compare the
+        content hash and fetch the store inventory, only of the sizes past
+        their cache TTL if the product is unchanged.
+        
+        Returns:
+            callable: Performs the database writes and returns True on success
+        """
+        # Same data as last time: skip the product and size writes
+        content_hash = self.content_hash(product_data)
+        stored_hash = Product.objects.filter(url=product_data['product']['url']).values_list(
+            'content_hash', flat=True
+        ).first()
+        unchanged = stored_hash is not None and stored_hash == content_hash
+        
+        # Check if we need to fetch inventory data for sizes
+        size_inventories = {}
+        if self.config and self.config.use_stores:
+            try:
+                # Inventory of all sizes with stock, fetched concurrently. Store stock changes
+                # without the page changing, so unchanged products still refresh expired sizes
+                size_inventories = self.fetch_product_inventory(product_data, url, refresh_only=unchanged)
+            except Exception as e:
+                logger.error(f"Error fetching inventory data for {url}: {str(e)}")
+                # Continue processing even if inventory fetch fails
+        
+        if unchanged:
+            return partial(
+                self.write_unchanged_product, url, product_data['product']['url'], validators, size_inventories
+            )
+        
+        # Save the product data along with the validators for the next conditional fetch
+        product_data['product'].update(validators, content_hash=content_hash)
+        return partial(self.write_product_data, url, product_data, size_inventories)
+    
+    def write_unchanged_product(self, url, product_url, validators, size_inventories=None):
+        """
+        Keep the validators current so the next fetch can still be answered
+        with a 304, and store the refreshed inventory of any sizes.
+        """
+        Product.objects.filter(url=product_url).update(needs_refresh=False, **validators)
+        if size_inventories:
+            try:
+                self.store_product_inventory(Product.objects.get(url=product_url), size_inventories)
+            except Exception as e:
+                logger.error(f"Error storing inventory data for {url}: {str(e)}")
+        logger.info(f"Product data unchanged: {url}")
+        return True
+    
+    def write_product_data(self, url, product_data, size_inventories):
+        """Save a product prepared by prepare_product_data, then its store inventory"""
+        product = self.save_product_data(product_data)
+        
+        if not product:
+            logger.error(f"Failed to save product data for URL: {url}")
+            return False
+        
+        try:
+            self.store_product_inventory(product, size_inventories)
+        except Exception as e:
+            logger.error(f"Error storing inventory data for {url}: {str(e)}")
+        
+        logger.info(f"Successfully processed product URL: {url}")
+        return True
+    
+    def store_product_data(self, url, product_data, validators):
+        """
+        Database side of process_product_url: skip unchanged data, otherwise
+        save the product with its HTTP validators and refresh the inventory.
+        """
+        try:
+            return self.prepare_product_data(url, product_data, validators)()
+        except Exception as e:
+            logger.error(f"Error storing product data for {url}: {str(e)}")
+            return False
+
+    def scrape_product_url(self, url, fetch=None):
+        """
+        Pool task: fetch and process a product URL. A failed fetch attempt
+        raises RetryLater so the worker moves on while the retry waits.
+        """
+        fetch = fetch or partial(self.fetch_nowait, url, validators=self.load_validators([url]).get(url))
+        try:
+            response = fetch()
+        except RetryLater as retry:
+            raise RetryLater(retry.delay, partial(self.scrape_product_url, url, retry.resume), str(retry)) from None
+        
+        if response is None:
+            logger.error(f"Failed to fetch product URL: {url}")
+            return False
+        logger.info(f"Successfully fetched {url}")
+        return self.process_product_url(url, response=response)
+
     def process_available_urls(self, batch_size=10, max_urls=None):
         """Process available product URLs from ProductAvailableUrl model"""
         try:
@@ -753,29 +986,14 @@ class ProductScraper:
             total_urls = query.count()
             logger.info(f"Processing {total_urls} available product URLs")
             
-            success_count = 0
-            error_count = 0
+            urls = [url_obj.url for url_obj in query]
             
-            # Process in batches to avoid overwhelming resources
-            for i in range(0, total_urls, batch_size):
-                batch = query[i:i+batch_size]
-                
-                with ThreadPoolExecutor(max_workers=min(5, batch_size)) as executor:
-                    results = list(executor.map(
-                        lambda url_obj: self.process_product_url(url_obj.url),
-                        batch
-                    ))
-                
-                batch_success = results.count(True)
-                batch_errors = results.count(False)
-                
-                success_count += batch_success
-                error_count += batch_errors
-                
-                logger.info(f"Batch {i//batch_size + 1}: {batch_success} successful, {batch_errors} errors")
-                
-                # Add a small delay between batches
-                time.sleep(2)
+            # Fetch threads -> parser processes -> one database writer
+            pipeline = StagedScrapePipeline(self)
+            try:
+                success_count, error_count = pipeline.run(urls, progress_every=batch_size)
+            finally:
+                self.close()
             
             logger.info(f"Completed processing {total_urls} URLs: {success_count} successful, {error_count} errors")
             return success_count, error_count
@@ -818,4 +1036,245 @@ class ProductScraper:
             
         except Exception as e:
             logger.error(f"Error checking for deleted products: {str(e)}")
-            return 0
\ No newline at end of file
+            return 0
+
+
+def close_worker_connections(executor, workers):
+    """
+    Close the database connection of every worker thread of `executor`.
+    Workers keep their connection (CONN_MAX_AGE) from one item to the next,
+    so this runs once when the pool is done: one task per worker, each held
+    at a barrier until all have started, so no thread runs two of them.
+    """
+    barrier = threading.Barrier(workers)
+
+    def close():
+        try:
+            barrier.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            logger.warning("Not every worker thread closed its database connection")
+        connection.close()
+
+    wait([executor.submit(close) for _ in range(workers)])
+
+
+class DetailPipeline:
+    """
+    Scrapes newly discovered product pages while discovery is still running.
+
+    Discovery code calls `submit()` with URLs that have no Product yet; a
+    bounded thread pool scrapes them in the background. `submit()` never
+    blocks: once `max_pending` URLs are queued or running, further URLs are
+    left to the scheduled sync_products job. `close()` waits for the queued
+    work and removes the scraped URLs from ProductNewUrl.
+    """
+
+    def __init__(self, concurrency=None, max_pending=None, scraper=None):
+        self.scraper = scraper or ProductScraper()
+        if concurrency is None:
+            concurrency = self.scraper.config.max_concurrent_requests if self.scraper.config else 5
+        self.concurrency = max(1, int(concurrency))
+        self.max_pending = max(1, int(max_pending or self.concurrency * 4))
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='detail-pipeline')
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._submitted = set()
+        self._futures = set()
+        self.processed = set()
+        self.failed = 0
+        self.deferred = 0
+
+    def submit(self, url):
+        """Queue a URL for scraping; returns False if it was a duplicate or the queue is full"""
+        with self._lock:
+            if url in self._submitted:
+                return False
+            if not self._slots.acquire(blocking=False):
+                self.deferred += 1
+                return False
+            self._submitted.add(url)
+            # A failed fetch waits on the retry queue instead of holding a worker
+            self._futures.add(submit_retrying(
+                self._executor, self._process, partial(self.scraper.scrape_product_url, url), url
+            ))
+        return True
+
+    def _process(self, call, url):
+        try:
+            success = call()
+        except RetryLater as retry:
+            # The URL keeps its slot while the retry waits
+            raise RetryLater(retry.delay, partial(self._process, retry.resume, url), str(retry)) from None
+        except Exception as e:
+            logger.error(f"Detail pipeline failed for {url}: {str(e)}")
+            success = False
+        self._slots.release()
+
+        with self._lock:
+            if success:
+                self.processed.add(url)
+            else:
+                self.failed += 1
+
+    def close(self):
+        """Wait for queued URLs and drop the scraped ones from ProductNewUrl"""
+        # Retries are only submitted once due, so wait on the futures before shutting down
+        wait(self._futures)
+        # Worker threads open their own database connections
+        close_worker_connections(self._executor, self.concurrency)
+        self._executor.shutdown(wait=True)
+        self.scraper.close()
+
+        processed = list(self.processed)
+        for i in range(0, len(processed), 1000):
+            ProductNewUrl.objects.filter(url__in=processed[i:i+1000]).delete()
+
+        logger.info(
+            f"Detail pipeline finished: {len(processed)} scraped, {self.failed} failed, "
+            f"{self.deferred} left for the scheduled sync"
+        )
+        return len(processed)
+
+
+class StagedScrapePipeline:
+    """
+    Scrapes product pages in four stages connected by bounded queues:
+    fetch threads (or the async engine) -> a process pool that parses the
+    pages -> prepare threads that compare content hashes and fetch the store
+    inventory -> a single thread that writes to the database.
+
+    Parsing is CPU-bound, so running it in worker processes scales it with
+    the CPU cores instead of serializing it on the GIL next to the fetch
+    threads. Inventory requests run in the prepare stage, so the writer only
+    saves finished rows and never waits on the network; the prepare stage
+    only reads from the database. A full stage stops
+    the intake of fetched pages, which in turn holds the fetch engine at its
+    in-flight limit.
+    """
+
+    def __init__(self, scraper=None, parse_processes=None, queue_size=None, prepare_workers=None):
+        self.scraper = scraper or ProductScraper()
+        self.parse_processes = max(1, int(parse_processes or self.scraper.parse_processes))
+        self.queue_size = max(1, int(queue_size or self.parse_processes * 4))
+        self.prepare_workers = max(1, int(prepare_workers or self.scraper.inventory_concurrency))
+        self.success_count = 0
+        self.error_count = 0
+        self._prepare_pool = None
+        self._preparing = None
+
+    def run(self, urls, progress_every=None):
+        """Scrape `urls` and return (success_count, error_count)"""
+        writes = queue.Queue(maxsize=self.queue_size)
+        writer = threading.Thread(
+            target=self._write, args=(writes, progress_every), name='product-writer', daemon=True
+        )
+        writer.start()
+
+        parse_pool = None
+        if self.parse_processes > 1:
+            # spawn, as forking would copy the fetch threads' locks and the open database connection
+            parse_pool = ProcessPoolExecutor(
+                max_workers=self.parse_processes, mp_context=multiprocessing.get_context('spawn')
+            )
+        parsing = {}
+        self._prepare_pool = ThreadPoolExecutor(max_workers=self.prepare_workers, thread_name_prefix='product-prepare')
+        self._preparing = threading.BoundedSemaphore(self.queue_size)
+
+        try:
+            for url, response in self.scraper.iter_responses(urls, ordered=False, conditional=True):
+                if response is None:
+                    logger.error(f"Failed to fetch product URL: {url}")
+                    writes.put(lambda: False)
+                    continue
+                if response.not_modified:
+                    # Nothing to parse, but the inventory refresh still runs in the prepare stage
+                    validators = self.scraper.unchanged_validators(response)
+                    self._queue_prepare(writes, url, partial(self.scraper.prepare_unchanged_page, url, validators))
+                    continue
+
+                validators = self.scraper.response_validators(response)
+                if parse_pool is None:
+                    self._queue_record(writes, url, validators, extract_product(response.text, response.url))
+                    continue
+
+                parsing[parse_pool.submit(extract_product, response.text, response.url)] = (url, validators)
+                if len(parsing) >= self.queue_size:
+                    self._drain(parsing, writes, FIRST_COMPLETED)
+
+            self._drain(parsing, writes, ALL_COMPLETED)
+        finally:
+            if parse_pool is not None:
+                parse_pool.shutdown(cancel_futures=True)
+            # Prepare threads hand their last rows to the writer before it is stopped
+            close_worker_connections(self._prepare_pool, self.prepare_workers)
+            self._prepare_pool.shutdown(wait=True)
+            writes.put(None)
+            writer.join()
+
+        return self.success_count, self.error_count
+
+    def _drain(self, parsing, writes, return_when):
+        """Hand finished parses to the prepare stage"""
+        if not parsing:
+            return
+        done, _ = wait(list(parsing), return_when=return_when)
+        for future in done:
+            url, validators = parsing.pop(future)
+            try:
+                record = future.result()
+            except Exception as e:
+                logger.error(f"Parser process failed for {url}: {str(e)}")
+                record = None
+            self._queue_record(writes, url, validators, record)
+
+    def _queue_record(self, writes, url, validators, record):
+        if record is None:
+            logger.error(f"Failed to extract product data from URL: {url}")
+            writes.put(lambda: False)
+            return
+        self._queue_prepare(
+            writes, url, partial(self.scraper.prepare_product_data, url, record.to_product_data(), validators)
+        )
+
+    def _queue_prepare(self, writes, url, prepare):
+        # Blocks while queue_size products are being prepared
+        self._preparing.acquire()
+        self._prepare_pool.submit(self._prepare, writes, url, prepare)
+
+    def _prepare(self, writes, url, prepare):
+        """
+        Prepare stage: hash check and inventory requests, then the finished
+        rows go to the writer. Reads the database but never writes to it.
+        """
+        try:
+            write = prepare()
+        except Exception as e:
+            logger.error(f"Error preparing product data for {url}: {str(e)}")
+            write = lambda: False
+        writes.put(write)
+        self._preparing.release()
+
+    def _write(self, writes, progress_every):
+        """The only stage that writes to the database, inventory cache rows included"""
+        while True:
+            task = writes.get()
+            if task is None:
+                break
+            try:
+                success = task()
+            except Exception as e:
+                logger.error(f"Product writer failed: {str(e)}")
+                success = False
+
+            if success:
+                self.success_count += 1
+            else:
+                self.error_count += 1
+            done = self.success_count + self.error_count
+            if progress_every and done % progress_every == 0:
+                logger.info(f"Progress: {done} pages stored, {self.success_count} successful, {self.error_count} errors")
+
+        # Inventory cached for products whose save failed
+        self.scraper.inventory_cache.flush()
+        # The writer thread opened its own database connection
+        connection.close()
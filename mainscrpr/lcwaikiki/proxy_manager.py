@@ -0,0 +1,141 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyStats:
+    """Health bookkeeping of a single proxy"""
+
+    def __init__(self):
+        self.latency = None  # EWMA of successful response times in seconds
+        self.error_rate = 0.0  # EWMA of failures, 0.0 (healthy) .. 1.0 (always failing)
+        self.consecutive_failures = 0
+        self.trips = 0  # Times the circuit opened in a row, drives the cooldown backoff
+        self.open_until = 0.0  # Monotonic time until which the circuit is open
+        self.requests = 0
+
+
+class ProxyManager:
+    """
+    Process-wide proxy pool with health scoring and circuit breakers.
+
+    Every request reports its outcome back. Latency and error rate are
+    tracked as exponentially weighted moving averages, and `acquire()` hands
+    out the healthy proxy with the best score (latency penalised by error
+    rate), trying unmeasured proxies first. A 403 or a timeout opens the
+    proxy's circuit at once, other errors open it after
+    `failure_threshold` consecutive failures. An open proxy is skipped for a
+    cooldown that doubles on each trip up to `max_cooldown`, and a success
+    closes the circuit and resets the backoff.
+    """
+
+    def __init__(self, proxies, alpha=0.3, failure_threshold=3, cooldown=60, max_cooldown=900):
+        self.proxies = list(dict.fromkeys(proxies or []))
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._stats = {proxy: ProxyStats() for proxy in self.proxies}
+        self._lock = threading.Lock()
+
+    def _score(self, stats):
+        if stats.latency is None:
+            return 0.0  # Unmeasured proxies are tried first
+        return stats.latency * (1 + 4 * stats.error_rate)
+
+    def is_available(self, proxy):
+        """True if the proxy's circuit is closed (or the proxy is None, i.e. a direct connection)"""
+        if proxy is None:
+            return True
+        with self._lock:
+            stats = self._stats.get(proxy)
+            return stats is None or stats.open_until <= time.monotonic()
+
+    def acquire(self, exclude=()):
+        """
+        Return the best healthy proxy not in `exclude`. When every candidate's
+        circuit is open, the one whose cooldown ends first is returned as a
+        probe. Returns None when there are no candidates left.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [proxy for proxy in self.proxies if proxy not in exclude]
+            if not candidates:
+                return None
+
+            healthy = [proxy for proxy in candidates if self._stats[proxy].open_until <= now]
+            if not healthy:
+                return min(candidates, key=lambda proxy: self._stats[proxy].open_until)
+
+            # Random tie-break spreads load across proxies with equal scores
+            random.shuffle(healthy)
+            return min(healthy, key=lambda proxy: self._score(self._stats[proxy]))
+
+    def report_success(self, proxy, latency):
+        if proxy is None:
+            return
+        with self._lock:
+            stats = self._stats.get(proxy)
+            if stats is None:
+                return
+            stats.requests += 1
+            stats.latency = latency if stats.latency is None else (
+                self.alpha * latency + (1 - self.alpha) * stats.latency
+            )
+            stats.error_rate = (1 - self.alpha) * stats.error_rate
+            stats.consecutive_failures = 0
+            stats.trips = 0
+            stats.open_until = 0.0
+
+    def report_failure(self, proxy, trip=False):
+        """
+        Record a failed request. `trip` opens the circuit immediately; use it
+        for blocks (403) and timeouts.
+        """
+        if proxy is None:
+            return
+        with self._lock:
+            stats = self._stats.get(proxy)
+            if stats is None:
+                return
+            stats.requests += 1
+            stats.error_rate = self.alpha + (1 - self.alpha) * stats.error_rate
+            stats.consecutive_failures += 1
+
+            if trip or stats.consecutive_failures >= self.failure_threshold:
+                stats.trips += 1
+                cooldown = min(self.cooldown * 2 ** (stats.trips - 1), self.max_cooldown)
+                stats.open_until = time.monotonic() + cooldown
+                stats.consecutive_failures = 0
+                logger.warning(f"Proxy {proxy} circuit opened for {cooldown}s")
+
+    def snapshot(self):
+        """Return a dict of per-proxy health figures, e.g. for logging"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                proxy: {
+                    'latency': stats.latency,
+                    'error_rate': round(stats.error_rate, 3),
+                    'open_for': max(0.0, round(stats.open_until - now, 1)),
+                    'requests': stats.requests,
+                }
+                for proxy, stats in self._stats.items()
+            }
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_proxy_manager(proxies):
+    """Return the process-wide ProxyManager for a proxy list, creating it on first use"""
+    key = tuple(dict.fromkeys(proxies or []))
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = ProxyManager(key)
+        return manager
@@ -0,0 +1,45 @@
+import hashlib
+
+import requests
+from django.test import SimpleTestCase
+
+from lcwaikiki.product_scraper import ProductScraper
+
+
+def make_response(status_code=200, content=b'<html></html>', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+class ConditionalFetchTests(SimpleTestCase):
+    def test_conditional_headers(self):
+        self.assertEqual(ProductScraper.conditional_headers(None), {})
+        self.assertEqual(
+            ProductScraper.conditional_headers({'etag': '"v1"', 'last_modified': None, 'body_hash': 'x'}),
+            {'If-None-Match': '"v1"'},
+        )
+        self.assertEqual(
+            ProductScraper.conditional_headers({'etag': '"v1"', 'last_modified': 'Mon, 05 Oct 2026 10:00:00 GMT'}),
+            {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 05 Oct 2026 10:00:00 GMT'},
+        )
+
+    def test_not_modified(self):
+        self.assertTrue(ProductScraper.check_not_modified(make_response(304, b''), {'etag': '"v1"'}))
+
+    def test_identical_body(self):
+        body = b'<html>same</html>'
+        validators = {'body_hash': hashlib.sha256(body).hexdigest()}
+        self.assertTrue(ProductScraper.check_not_modified(make_response(content=body), validators))
+        self.assertFalse(ProductScraper.check_not_modified(make_response(content=b'<html>new</html>'), validators))
+        self.assertFalse(ProductScraper.check_not_modified(make_response(content=body), None))
+
+    def test_response_validators(self):
+        response = make_response(content=b'body', headers={'ETag': '"v2"'})
+        self.assertEqual(ProductScraper.response_validators(response), {
+            'etag': '"v2"',
+            'last_modified': None,
+            'body_hash': hashlib.sha256(b'body').hexdigest(),
+        })
@@ -0,0 +1,342 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+
+from django.test import SimpleTestCase
+
+from lcwaikiki.crawl_engine import (
+    AdaptiveRateLimiter, AsyncCrawlEngine, DelayQueue, HostLimiter, RetryLater, RetryPolicy, SessionPool,
+    ThreadedCrawlEngine, get_rate_limiter, submit_retrying,
+)
+
+from .server import LocalServer
+
+
+class ThreadedCrawlEngineTests(SimpleTestCase):
+    def test_results_keep_submission_order(self):
+        engine = ThreadedCrawlEngine(max_workers=4)
+
+        def work(item):
+            time.sleep(0.01 * (5 - item))  # Later items finish first
+            return item * 10
+
+        results = list(engine.map(work, range(5)))
+        self.assertEqual(results, [(item, item * 10, None) for item in range(5)])
+
+    def test_items_are_consumed_lazily(self):
+        engine = ThreadedCrawlEngine(max_workers=2, max_in_flight=3)
+        pulled = []
+        ahead = []
+
+        def items():
+            for item in range(20):
+                pulled.append(item)
+                yield item
+
+        for item, _, _ in engine.map(lambda item: item, items()):
+            # Never more than max_in_flight items taken before their results are consumed
+            ahead.append(len(pulled) - item)
+        self.assertEqual(len(pulled), 20)
+        self.assertLessEqual(max(ahead), 3)
+
+    def test_concurrency_is_bounded(self):
+        engine = ThreadedCrawlEngine(max_workers=8, per_host_limit=2)
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def work(item):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+
+        list(engine.map(work, range(20), host_for=lambda item: 'example.com'))
+        self.assertEqual(running['max'], 2)
+
+    def test_limiter_slot_released_on_error(self):
+        limiter = HostLimiter(1)
+        engine = ThreadedCrawlEngine(max_workers=2, limiter=limiter)
+
+        def work(item):
+            if item % 2:
+                raise ValueError(f'bad item {item}')
+            return item
+
+        with self.assertLogs('lcwaikiki.crawl_engine', level='ERROR'):
+            results = list(engine.map(work, range(4), host_for=lambda item: 'example.com'))
+        self.assertEqual([result for _, result, _ in results], [0, None, 2, None])
+        self.assertIsInstance(results[1][2], ValueError)
+        self.assertTrue(limiter.try_acquire('example.com'))
+
+    def test_should_stop_drains_in_flight_items(self):
+        engine = ThreadedCrawlEngine(max_workers=2, max_in_flight=2)
+        stop = threading.Event()
+        seen = []
+        for item, _, _ in engine.map(lambda item: item, range(100), should_stop=stop.is_set):
+            seen.append(item)
+            stop.set()
+        self.assertEqual(seen, [0, 1])
+
+    def test_unordered_yields_as_completed(self):
+        engine = ThreadedCrawlEngine(max_workers=2)
+        release = threading.Event()
+
+        def work(item):
+            if item == 0:
+                release.wait(2)
+            return item
+
+        seen = []
+        for item, _, _ in engine.map(work, range(2), ordered=False):
+            seen.append(item)
+            release.set()
+        self.assertEqual(seen, [1, 0])
+
+    def test_shared_executor_outlives_map(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        engine = ThreadedCrawlEngine(max_workers=2, executor=executor)
+        self.assertEqual([r for _, r, _ in engine.map(lambda item: item, range(3))], [0, 1, 2])
+        self.assertEqual(executor.submit(lambda: 'still open').result(), 'still open')
+
+
+class DelayQueueTests(SimpleTestCase):
+    def test_runs_callbacks_in_due_order(self):
+        queue = DelayQueue(name='test-delay-queue')
+        ran = []
+        done = threading.Event()
+        queue.schedule(0.1, lambda: (ran.append('late'), done.set()))
+        queue.schedule(0, lambda: ran.append('now'))
+        queue.schedule(0.05, lambda: ran.append('soon'))
+        self.assertTrue(done.wait(2))
+        self.assertEqual(ran, ['now', 'soon', 'late'])
+        self.assertEqual(len(queue), 0)
+
+    def test_failing_callback_does_not_stop_the_queue(self):
+        queue = DelayQueue(name='test-delay-queue')
+        done = threading.Event()
+        with self.assertLogs('lcwaikiki.crawl_engine', level='ERROR'):
+            queue.schedule(0, lambda: 1 / 0)
+            queue.schedule(0.01, done.set)
+            self.assertTrue(done.wait(2))
+
+
+class SubmitRetryingTests(SimpleTestCase):
+    def setUp(self):
+        self.queue = DelayQueue(name='test-retry-scheduler')
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_retry_frees_the_worker(self):
+        finished = []
+
+        def flaky(attempt=1):
+            if attempt < 3:
+                raise RetryLater(0.1, lambda: flaky(attempt + 1))
+            finished.append('flaky')
+            return attempt
+
+        def quick():
+            finished.append('quick')
+            return 'ok'
+
+        started = time.monotonic()
+        flaky_future = submit_retrying(self.executor, flaky, delay_queue=self.queue)
+        quick_future = submit_retrying(self.executor, quick, delay_queue=self.queue)
+
+        # The single worker runs `quick` while `flaky` waits on the delay queue
+        self.assertEqual(quick_future.result(timeout=2), 'ok')
+        self.assertEqual(flaky_future.result(timeout=2), 3)
+        self.assertEqual(finished, ['quick', 'flaky'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    def test_exception_is_propagated(self):
+        def broken():
+            raise ValueError('boom')
+
+        future = submit_retrying(self.executor, broken, delay_queue=self.queue)
+        with self.assertRaisesMessage(ValueError, 'boom'):
+            future.result(timeout=2)
+
+    def test_retry_after_shutdown_fails_the_future(self):
+        def retried():
+            raise RetryLater(0.1, lambda: 'never')
+
+        future = submit_retrying(self.executor, retried, delay_queue=self.queue)
+        time.sleep(0.02)
+        self.executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=2)
+
+
+class AdaptiveRateLimiterTests(SimpleTestCase):
+    def test_backs_off_and_recovers(self):
+        limiter = AdaptiveRateLimiter(ceiling=4, initial=2, cooldown=0)
+        self.assertTrue(limiter.try_acquire('example.com'))
+        self.assertEqual(limiter.release('example.com', 429), 1.0)
+        self.assertEqual(limiter.limit('example.com'), 1)
+        for _ in range(3):
+            limiter.acquire('example.com')
+            self.assertIsNone(limiter.release('example.com', 200))
+        self.assertEqual(limiter.limit('example.com'), 2)
+
+    def test_linked_limiters_back_off_together(self):
+        listing = AdaptiveRateLimiter(ceiling=12, cooldown=60)
+        requests = AdaptiveRateLimiter(ceiling=4, cooldown=60)
+        listing.link(requests)
+        listing.acquire('example.com')
+        self.assertEqual(listing.release('example.com', 429), 3.0)
+        self.assertEqual(requests.limit('example.com'), 1)
+        # Within the cooldown the backoff is not applied twice
+        requests.acquire('example.com')
+        self.assertIsNone(requests.release('example.com', 503))
+        self.assertEqual((listing.limit('example.com'), requests.limit('example.com')), (3, 1))
+        self.assertEqual(requests.limit('other.com'), 2)
+
+    def test_release_notifies_listeners(self):
+        limiter = AdaptiveRateLimiter(ceiling=2)
+        released = []
+        limiter.add_listener(lambda: released.append(True))
+        limiter.acquire('example.com')
+        limiter.release('example.com', 200)
+        self.assertEqual(released, [True])
+
+
+class RecordingStateStore:
+    """ScraperStateStore stand-in recording the thread of every call"""
+
+    def __init__(self):
+        self.threads = []
+        self.values = {}
+
+    def get(self, key):
+        self.threads.append(threading.current_thread().name)
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.threads.append(threading.current_thread().name)
+        self.values[key] = value
+
+
+class AsyncCrawlEngineLimiterTests(SimpleTestCase):
+    def fetch_all(self, engine, server, count=10):
+        urls = [f'{server.url}/page/{n}' for n in range(count)]
+        return list(engine.map(urls, url_for=lambda url: url))
+
+    @staticmethod
+    def slow(handler):
+        time.sleep(0.05)
+        return 200, b'ok', None
+
+    def test_shared_limiter_caps_concurrency(self):
+        limiter = HostLimiter(2)
+        rate_limiter = AdaptiveRateLimiter(ceiling=5)
+        engine = AsyncCrawlEngine(concurrency=20, limiter=limiter, rate_limiter=rate_limiter)
+        with LocalServer(self.slow) as server:
+            results = self.fetch_all(engine, server, count=12)
+            host = server.url.split('//')[1]
+
+        self.assertEqual([response.status_code for _, response, _ in results], [200] * 12)
+        self.assertLessEqual(server.max_concurrent, 2)
+        self.assertEqual(rate_limiter._in_flight[host], 0)
+        self.assertTrue(all(limiter.try_acquire(host) for _ in range(2)))
+
+    def test_engine_keeps_the_rate_limiters_ceiling(self):
+        rate_limiter = AdaptiveRateLimiter(ceiling=2)
+        engine = AsyncCrawlEngine(concurrency=16, rate_limiter=rate_limiter)
+        with LocalServer(self.slow) as server:
+            self.fetch_all(engine, server, count=8)
+        # A shared limiter sized for thread pools keeps capping the async engine
+        self.assertEqual((rate_limiter.ceiling, rate_limiter.initial), (2, 1))
+        self.assertEqual(engine.concurrency, 2)
+        self.assertLessEqual(server.max_concurrent, 2)
+
+    def test_concurrency_is_capped_at_the_ceiling(self):
+        rate_limiter = get_rate_limiter()
+        engine = AsyncCrawlEngine(concurrency=rate_limiter.ceiling + 50, rate_limiter=rate_limiter)
+        self.assertEqual(engine.concurrency, rate_limiter.ceiling)
+        self.assertEqual(AsyncCrawlEngine(concurrency=1, rate_limiter=rate_limiter).concurrency, 1)
+        self.assertEqual(AsyncCrawlEngine(concurrency=16).concurrency, 16)
+
+    def test_slots_released_when_a_request_raises(self):
+        def broken_headers():
+            raise RuntimeError('header hook failed')
+
+        limiter = HostLimiter(1)
+        rate_limiter = AdaptiveRateLimiter(ceiling=1)
+        engine = AsyncCrawlEngine(
+            concurrency=4, limiter=limiter, rate_limiter=rate_limiter, headers_factory=broken_headers,
+            retry_policy=RetryPolicy(max_retries=2, retry_delay=0, max_proxy_attempts=1),
+        )
+        with LocalServer(lambda handler: (200, b'ok', None)) as server:
+            with self.assertLogs('lcwaikiki.crawl_engine', level='WARNING'):
+                results = self.fetch_all(engine, server, count=4)
+            host = server.url.split('//')[1]
+
+        self.assertEqual([response for _, response, _ in results], [None] * 4)
+        self.assertEqual(rate_limiter._in_flight[host], 0)
+        self.assertTrue(limiter.try_acquire(host))
+
+    def test_shared_limits_are_read_and_written_off_the_event_loop(self):
+        store = RecordingStateStore()
+        rate_limiter = AdaptiveRateLimiter(ceiling=4, cooldown=0, state_store=store, sync_interval=0)
+        engine = AsyncCrawlEngine(
+            concurrency=2, rate_limiter=rate_limiter,
+            retry_policy=RetryPolicy(max_retries=1, retry_delay=0, max_proxy_attempts=1),
+        )
+        with LocalServer(lambda handler: (503, b'busy', None)) as server:
+            with self.assertLogs('lcwaikiki.crawl_engine', level='WARNING'):
+                self.fetch_all(engine, server, count=3)
+            host = server.url.split('//')[1]
+
+        self.assertIn(f'rate_limit:{host}', store.values)
+        self.assertTrue(store.threads)
+        self.assertNotIn('async-crawl-engine', store.threads)
+
+
+class SessionPoolTests(SimpleTestCase):
+    def sessions_of_thread(self, pool, *proxies):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.extend(pool.get(proxy) for proxy in proxies))
+        thread.start()
+        thread.join()
+        return sessions
+
+    def test_one_session_per_thread_and_proxy(self):
+        pool = SessionPool()
+        direct, proxied = pool.get(), pool.get('http://proxy-a:8080')
+        self.assertIs(pool.get(), direct)
+        self.assertIs(pool.get('http://proxy-a:8080'), proxied)
+        self.assertIsNot(direct, proxied)
+        self.assertEqual(proxied.proxies, {'http': 'http://proxy-a:8080', 'https': 'http://proxy-a:8080'})
+        self.assertEqual(direct.proxies, {})
+
+        other_direct, other_proxied = self.sessions_of_thread(pool, None, 'http://proxy-a:8080')
+        self.assertIsNot(other_direct, direct)
+        self.assertIsNot(other_proxied, proxied)
+
+    def test_close_closes_sessions_of_every_thread(self):
+        pool = SessionPool()
+        sessions = [pool.get(), pool.get('http://proxy-a:8080')] + self.sessions_of_thread(pool, None)
+        with mock.patch.object(requests.Session, 'close', autospec=True) as close:
+            pool.close()
+        self.assertCountEqual([call.args[0] for call in close.call_args_list], sessions)
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def test_direct_connection_gets_every_round(self):
+        policy = RetryPolicy(max_retries=2, retry_delay=1, max_proxy_attempts=3)
+        self.assertEqual(policy.proxy_rounds([]), 3)
+        self.assertEqual(policy.proxy_rounds([], max_proxy_attempts=1), 1)
+        self.assertEqual(RetryPolicy(max_proxy_attempts=None).proxy_rounds(['a', 'b']), 2)
+
+    def test_round_and_backoff(self):
+        policy = RetryPolicy(max_retries=2, retry_delay=1.5)
+        self.assertFalse(policy.round_over(1, None))
+        self.assertTrue(policy.round_over(2, None))
+        self.assertEqual(policy.backoff(2), 3.0)
@@ -0,0 +1,72 @@
+import gzip
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from lcwaikiki.management.commands.discover_from_sitemap import STATE_KEY
+from lcwaikiki.models import ProductNewUrl, ScraperState
+from lcwaikiki.product_models import Product
+
+from .server import LocalServer
+
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+LAST_RUN = '2024-05-01T00:00:00+00:00'
+
+
+def sitemap_index(server_url):
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{NAMESPACE}">'
+        f'<sitemap><loc>{server_url}/products-1.xml</loc><lastmod>2024-05-02</lastmod></sitemap>'
+        f'<sitemap><loc>{server_url}/products-2.xml</loc><lastmod>2024-04-01</lastmod></sitemap>'
+        '</sitemapindex>'
+    ).encode()
+
+
+PRODUCTS = (
+    f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{NAMESPACE}">'
+    '<url><loc>https://www.lcw.com/yeni-gomlek-o-1</loc><lastmod>2024-05-02T10:00:00+03:00</lastmod></url>'
+    '<url><loc>https://www.lcw.com/eski-gomlek-o-2</loc><lastmod>2024-04-30</lastmod></url>'
+    '<url><loc>https://www.lcw.com/bilinen-gomlek-o-3</loc><lastmod>2024-05-03</lastmod></url>'
+    '<url><loc>https://www.lcw.com/erkek-gomlek</loc><lastmod>2024-05-03</lastmod></url>'
+    '</urlset>'
+).encode()
+
+
+class DiscoverFromSitemapTests(TestCase):
+    def setUp(self):
+        ScraperState.set_value(STATE_KEY, {'last_run': LAST_RUN})
+        Product.objects.create(url='https://www.lcw.com/bilinen-gomlek-o-3', title='Shirt', needs_refresh=False)
+        self.failing_paths = set()
+
+    def respond(self, handler):
+        if handler.path in self.failing_paths:
+            return 500, b'error', None
+        if handler.path == '/sitemap.xml.gz':
+            return 200, gzip.compress(sitemap_index(self.server.url)), {'Content-Type': 'application/x-gzip'}
+        if handler.path == '/products-1.xml':
+            return 200, PRODUCTS, {'Content-Type': 'application/xml'}
+        return 404, b'', None
+
+    def discover(self):
+        with LocalServer(self.respond) as self.server:
+            call_command('discover_from_sitemap', sitemap_url=f'{self.server.url}/sitemap.xml.gz', stdout=StringIO())
+        return [path for _, path in self.server.requests]
+
+    def test_only_entries_changed_since_the_last_run_are_processed(self):
+        self.assertEqual(self.discover(), ['/sitemap.xml.gz', '/products-1.xml'])
+
+        self.assertEqual(
+            list(ProductNewUrl.objects.values_list('url', flat=True)), ['https://www.lcw.com/yeni-gomlek-o-1']
+        )
+        self.assertTrue(Product.objects.get(url='https://www.lcw.com/bilinen-gomlek-o-3').needs_refresh)
+        state = ScraperState.get_value(STATE_KEY)
+        self.assertGreater(state['last_run'], LAST_RUN)
+        self.assertEqual(state['stats'], {'sitemaps': 2, 'seen': 2, 'new': 1, 'refresh': 1})
+
+    def test_last_run_kept_when_a_sitemap_fails(self):
+        self.failing_paths.add('/products-1.xml')
+        self.discover()
+
+        self.assertEqual(ScraperState.get_value(STATE_KEY), {'last_run': LAST_RUN})
+        self.assertFalse(ProductNewUrl.objects.exists())
@@ -0,0 +1,67 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from lcwaikiki.inventory_cache import InventoryCache, inventory_tier
+from lcwaikiki.models import InventorySnapshot
+from lcwaikiki.product_scraper import ProductScraper
+
+
+class InventoryTierTests(SimpleTestCase):
+    def test_tiers(self):
+        self.assertEqual(inventory_tier({'size_general_stock': 2}, discount_ratio=20), 'low_stock')
+        self.assertEqual(inventory_tier({'size_general_stock': 10}, discount_ratio=20), 'discounted')
+        self.assertEqual(inventory_tier({'size_general_stock': 0}), 'default')
+
+
+class InventoryCacheTests(TestCase):
+    def setUp(self):
+        self.cache = InventoryCache()
+
+    def test_entries_expire_by_max_age(self):
+        self.cache.set_many({'111': {'n': 1}}, '870')
+        self.assertEqual(self.cache.get_many({'111': 60}, '870'), {'111': {'n': 1}})
+        self.assertEqual(self.cache.get_many({'111': 0}, '870'), {})
+        self.assertEqual(self.cache.get_many({'111': 60}, '34'), {})
+
+        with mock.patch('lcwaikiki.inventory_cache.timezone.now', return_value=timezone.now() + timedelta(seconds=120)):
+            self.assertEqual(self.cache.get_many({'111': 60}, '870'), {})
+
+    def test_flushed_entries_are_shared_across_runs(self):
+        self.cache.set_many({'111': {'n': 1}}, '870')
+        self.assertEqual(InventoryCache().get_many({'111': 60}, '870'), {})
+
+        self.cache.flush()
+        self.cache.flush()  # Nothing left to write
+        self.assertEqual(InventorySnapshot.objects.count(), 1)
+        self.assertEqual(InventoryCache().get_many({'111': 60}, '870'), {'111': {'n': 1}})
+
+
+class TieredFreshnessTests(TestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+        self.scraper.config = mock.Mock(active_cities=['870'])
+        self.scraper.inventory_cache = InventoryCache()
+        # Both responses are 1000 s old: within the default TTL, past the low stock one
+        for ref in ('111', '222'):
+            InventorySnapshot.objects.create(
+                size_reference=ref, city_id='870', data={'cached': ref},
+                fetched_at=timezone.now() - timedelta(seconds=1000),
+            )
+
+    def test_low_stock_sizes_are_refetched_first(self):
+        product_data = {
+            'product': {'url': 'https://www.lcw.com/gomlek-o-1'},
+            'sizes': [
+                {'size_name': 'M', 'size_general_stock': 20, 'in_stock': True, 'product_option_size_reference': '111'},
+                {'size_name': 'L', 'size_general_stock': 2, 'in_stock': True, 'product_option_size_reference': '222'},
+            ],
+        }
+        with mock.patch.object(self.scraper, 'fetch_inventory_nowait', return_value={'fetched': True}) as fetch:
+            inventories = self.scraper.fetch_product_inventory(product_data, 'https://www.lcw.com/gomlek-o-1')
+
+        fetch.assert_called_once_with('222', 'https://www.lcw.com/gomlek-o-1', '870')
+        self.assertEqual(inventories, {'M': [{'cached': '111'}], 'L': [{'fetched': True}]})
@@ -0,0 +1,79 @@
+from django.test import SimpleTestCase
+
+from lcwaikiki.listing_parsers import PARSERS, get_parser, is_available
+
+LISTING_PAGE = '''<!DOCTYPE html>
+<html><body>
+<div class="product-list-heading">
+  <span class="product-list-heading__product-count"><p>1.234 Ürün</p></span>
+</div>
+<div class="product-grid">
+  <div class="product-card product-card--one-of-4" data-id="1">
+    <a href="/erkek-gomlek-o-1?color=mavi&amp;size=M"><img src="1.jpg"></a>
+    <div class="product-price">
+      <span class="product-price__old-price">1.299,99 TL</span>
+      <span class="product-price__price">649,99 TL</span>
+      <span class="product-price__discount">%50</span>
+    </div>
+  </div>
+  <div class="product-card" data-id="2">
+    <a class="product-card__link" href='/kadin-elbise-o-2'>Elbise</a>
+    <div class="product-price">
+      <span class="product-price__old-price">400 TL</span>
+      <span class="product-price__price">300 TL</span>
+    </div>
+  </div>
+  <div class="product-card">
+    <div class="product-card__image">Bağlantısız kart</div>
+  </div>
+  <div class="product-card">
+    <a href="/cocuk-tisort-o-4"><span>Tişört</span></a>
+    <span class="product-price__price">
+      <b>1.499</b> TL
+    </span>
+    <div class="product-card__out-of-stock">Tükendi</div>
+  </div>
+  <div class="product-card product-card--small">
+    <a href="/bebek-body-o-5">Body</a>
+  </div>
+</div>
+<div class="paginator">
+  <div class="paginator__info-text">
+    <span class="paginator__info-text-viewed-products">96</span> / 1.234
+  </div>
+</div>
+</body></html>
+'''
+
+
+class ListingParserParityTests(SimpleTestCase):
+    def test_backends_return_identical_results(self):
+        reference = get_parser('bs4')
+        expected_cards = reference.product_cards(LISTING_PAGE)
+        expected_counts = reference.listing_counts(LISTING_PAGE)
+
+        self.assertEqual(expected_counts, (1234, 96))
+        self.assertEqual(expected_cards, [
+            {'position': 1, 'href': '/erkek-gomlek-o-1?color=mavi&size=M', 'price': '649.99',
+             'discount_ratio': '0.50', 'in_stock': True},
+            {'position': 2, 'href': '/kadin-elbise-o-2', 'price': '300.00', 'discount_ratio': '0.25', 'in_stock': True},
+            {'position': 4, 'href': '/cocuk-tisort-o-4', 'price': '1499.00', 'discount_ratio': None, 'in_stock': False},
+            {'position': 5, 'href': '/bebek-body-o-5', 'price': None, 'discount_ratio': None, 'in_stock': True},
+        ])
+
+        for name in PARSERS:
+            with self.subTest(parser=name):
+                if not is_available(name):
+                    continue
+                parser = get_parser(name)
+                self.assertEqual(parser.product_cards(LISTING_PAGE), expected_cards)
+                self.assertEqual(parser.listing_counts(LISTING_PAGE), expected_counts)
+
+    def test_page_without_cards(self):
+        for name in PARSERS:
+            with self.subTest(parser=name):
+                if not is_available(name):
+                    continue
+                parser = get_parser(name)
+                self.assertEqual(parser.product_cards('<html><body><p>Sonuç yok</p></body></html>'), [])
+                self.assertEqual(parser.listing_counts('<html><body></body></html>'), (None, None))
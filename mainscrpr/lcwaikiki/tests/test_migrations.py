@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+
+class MigrationTestCase(TransactionTestCase):
+    """Migrate to `migrate_from`, let setUpBeforeMigration add rows, then migrate to `migrate_to`"""
+
+    migrate_from = None
+    migrate_to = None
+
+    def setUp(self):
+        super().setUp()
+        executor = MigrationExecutor(connection)
+        latest = executor.loader.graph.leaf_nodes()
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(latest))
+
+        executor.migrate([self.migrate_from])
+        self.setUpBeforeMigration(executor.loader.project_state([self.migrate_from]).apps)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([self.migrate_to])
+        self.apps = executor.loader.project_state([self.migrate_to]).apps
+
+    def setUpBeforeMigration(self, apps):
+        pass
+
+
+class UniqueAvailableUrlMigrationTests(MigrationTestCase):
+    migrate_from = ('lcwaikiki', '0006_update_store_foreign_key')
+    migrate_to = ('lcwaikiki', '0007_productavailableurl_unique_url')
+
+    def setUpBeforeMigration(self, apps):
+        ProductAvailableUrl = apps.get_model('lcwaikiki', 'ProductAvailableUrl')
+        now = timezone.now()
+        self.latest = ProductAvailableUrl.objects.create(
+            page_id='3', product_id_in_page='1', url='https://www.lcw.com/a-o-1', last_checking=now,
+        )
+        for page_id, age in (('1', 2), ('2', 1)):
+            ProductAvailableUrl.objects.create(
+                page_id=page_id, product_id_in_page='1', url='https://www.lcw.com/a-o-1',
+                last_checking=now - timedelta(days=age),
+            )
+        ProductAvailableUrl.objects.create(
+            page_id='1', product_id_in_page='2', url='https://www.lcw.com/b-o-2', last_checking=now,
+        )
+
+    def test_most_recently_checked_row_is_kept(self):
+        ProductAvailableUrl = self.apps.get_model('lcwaikiki', 'ProductAvailableUrl')
+        self.assertEqual(
+            sorted(ProductAvailableUrl.objects.values_list('url', 'page_id')),
+            [('https://www.lcw.com/a-o-1', '3'), ('https://www.lcw.com/b-o-2', '1')],
+        )
+        self.assertEqual(ProductAvailableUrl.objects.get(url='https://www.lcw.com/a-o-1').id, self.latest.id)
@@ -0,0 +1,178 @@
+from django.test import SimpleTestCase
+
+from lcwaikiki.product_extractor import ProductRecord, SizeRecord, extract_json, extract_product, scan_object
+
+URL = 'https://www.lcwaikiki.com/tr-TR/TR/urun/LC-WAIKIKI/erkek/Gomlek/123/456-o-789'
+
+# A detail page with the embedded product JSON, which overrides most HTML values
+JSON_PAGE = '''<html><head>
+<meta name="ProductCodeColorCode" content="W1AB23Z8-CVL">
+</head><body>
+<h1 class="product-title"> HTML Title </h1>
+<span class="product-code">W1AB23Z8</span>
+<span class="selected-color">Mavi</span>
+<span class="price-regular">1.299,99 TL</span>
+<span class="discount-rate">%20</span>
+<div id="collapseOne"> <p>Pamuklu</p> </div>
+<ul class="size-list"><li class="size" data-id="1">S</li></ul>
+<div class="product-image"><img src="//img.lcwaikiki.com/html.jpg"></div>
+<script>
+var cartOperationViewModel = {
+  "ModelName": "Regular Fit Gomlek",
+  "CategoryName": "Gomlek",
+  "ProductId": "W1AB23Z8",
+  "Color": "Lacivert",
+  "ProductPrices": {"Price": "899,99 TL", "DiscountRatio": "30"},
+  "Pictures": [
+    {"ExtraMedium800": "//img.lcwaikiki.com/a.jpg"},
+    {"ExtraMedium800": "", "MediumImage": "https://img.lcwaikiki.com/b.jpg"}
+  ],
+  "ProductSizes": [
+    {"Size": {"Value": "S", "SizeId": "11"}, "Stock": 4, "UrunOptionSizeRef": "111", "BarcodeList": ["86"]},
+    {"Size": {"Value": "M", "SizeId": "12"}, "Stock": 0, "UrunOptionSizeRef": "112", "BarcodeList": []}
+  ]
+};
+</script>
+</body></html>'''
+
+# A detail page without product JSON, so every value comes from the HTML
+HTML_PAGE = '''<html><body>
+<h1 class="product-title">Basic Tisort</h1>
+<span class="product-code">W2CD45Z8</span>
+<span class="selected-color">Beyaz</span>
+<span class="price-regular">249,90 TL</span>
+<div id="collapseOne"><p>Yumusak</p></div>
+<ul class="size-list">
+  <li class="size" data-id="21">XS</li>
+  <li class="size disabled" data-id="22">S</li>
+</ul>
+<div class="product-image">
+  <img src="//img.lcwaikiki.com/c.jpg"><img src=""><img alt="no source">
+</div>
+<p>Out of stock in some sizes</p>
+</body></html>'''
+
+
+class ScanObjectTests(SimpleTestCase):
+    def scan(self, text):
+        start = text.index('{')
+        end = scan_object(text, start)
+        return text[start:end] if end != -1 else None
+
+    def test_nested_object(self):
+        self.assertEqual(self.scan('x = {"a": {"b": {}}}; y = 1;'), '{"a": {"b": {}}}')
+
+    def test_braces_and_terminator_in_strings(self):
+        text = 'x = {"a": "};", "b": \'{\', "c": "}"}; rest'
+        self.assertEqual(self.scan(text), '{"a": "};", "b": \'{\', "c": "}"}')
+
+    def test_escaped_quotes(self):
+        text = r'x = {"a": "say \"}\" now", "b": "\\"}; rest'
+        self.assertEqual(self.scan(text), r'{"a": "say \"}\" now", "b": "\\"}')
+
+    def test_comments(self):
+        text = 'x = {"a": 1, // } not the end\n /* } */ "b": 2}; rest'
+        self.assertEqual(self.scan(text), '{"a": 1, // } not the end\n /* } */ "b": 2}')
+
+    def test_unterminated(self):
+        self.assertEqual(scan_object('{"a": {"b": 1}', 0), -1)
+        self.assertEqual(scan_object('{"a": "}', 0), -1)
+        self.assertEqual(scan_object('{"a": 1 /* }', 0), -1)
+
+
+class ExtractJsonTests(SimpleTestCase):
+    def test_cart_view_model(self):
+        text = '<script>var cartOperationViewModel = {"ProductId": 7, "Name": "a }; b"};</script>'
+        self.assertEqual(extract_json(text), {'ProductId': 7, 'Name': 'a }; b'})
+
+    def test_javascript_cleanup(self):
+        text = (
+            'cartOperationViewModel = {\n'
+            '  "a": undefined, // comment\n'
+            '  "b": NaN,\n'
+            '  "c": "undefined, NaN // kept",\n'
+            '  "d": [1, 2,],\n'
+            '};'
+        )
+        with self.assertLogs('lcwaikiki.product_extractor', level='WARNING'):
+            data = extract_json(text)
+        self.assertEqual(data, {'a': None, 'b': 0, 'c': 'undefined, NaN // kept', 'd': [1, 2]})
+
+    def test_product_info_meta_fallback(self):
+        text = '<meta name="product-info" content="{&quot;ProductId&quot;: 3}">'
+        self.assertEqual(extract_json(text), {'ProductId': 3})
+
+    def test_variable_fallback(self):
+        text = 'var productDetailData = {"ProductId": 4};'
+        self.assertEqual(extract_json(text), {'ProductId': 4})
+
+    def test_broken_assignment_falls_through(self):
+        text = 'cartOperationViewModel = {"a": ; var modal_data = {"ProductId": 5};'
+        with self.assertLogs('lcwaikiki.product_extractor', level='ERROR'):
+            self.assertEqual(extract_json(text), {'ProductId': 5})
+
+    def test_no_json(self):
+        with self.assertLogs('lcwaikiki.product_extractor', level='WARNING'):
+            self.assertIsNone(extract_json('<html></html>'))
+
+
+class ExtractProductTests(SimpleTestCase):
+    """The values the multi-pass extraction produced for the same pages"""
+
+    def test_json_page(self):
+        record = extract_product(JSON_PAGE, URL)
+        self.assertEqual(record, ProductRecord(
+            url=URL,
+            title='Regular Fit Gomlek',
+            category='Gomlek',
+            description='<p>Pamuklu</p>',
+            product_code='W1AB23Z8',
+            color='Lacivert',
+            price=899.99,
+            discount_ratio=0.3,
+            in_stock=True,
+            images=['https://img.lcwaikiki.com/a.jpg', 'https://img.lcwaikiki.com/b.jpg'],
+            sizes=[
+                SizeRecord('S', '11', 4, '111', ['86'], True),
+                SizeRecord('M', '12', 0, '112', [], False),
+            ]
+        ))
+
+    def test_html_page(self):
+        with self.assertLogs('lcwaikiki.product_extractor', level='WARNING'):
+            record = extract_product(HTML_PAGE, URL)
+        self.assertEqual(record, ProductRecord(
+            url=URL,
+            title='Basic Tisort',
+            description='<p>Yumusak</p>',
+            product_code='W2CD45Z8',
+            color='Beyaz',
+            price=249.9,
+            in_stock=False,
+            # An img with an empty src is kept, one without src is not
+            images=['https://img.lcwaikiki.com/c.jpg', ''],
+            sizes=[
+                SizeRecord('XS', '21', 1, None, [], True),
+                SizeRecord('S', '22', 0, None, [], False),
+            ]
+        ))
+
+    def test_product_data(self):
+        data = extract_product(JSON_PAGE, URL).to_product_data()
+        self.assertEqual(data['product']['price'], 899.99)
+        self.assertNotIn('sizes', data['product'])
+        self.assertEqual(data['sizes'][0], {
+            'size_name': 'S', 'size_id': '11', 'size_general_stock': 4,
+            'product_option_size_reference': '111', 'barcode_list': ['86'], 'in_stock': True
+        })
+
+    def test_html_parser_matches(self):
+        with self.assertLogs('lcwaikiki.product_extractor', level='WARNING'):
+            self.assertEqual(
+                extract_product(HTML_PAGE, URL, features='html.parser'),
+                extract_product(HTML_PAGE, URL)
+            )
+        self.assertEqual(
+            extract_product(JSON_PAGE, URL, features='html.parser'),
+            extract_product(JSON_PAGE, URL)
+        )
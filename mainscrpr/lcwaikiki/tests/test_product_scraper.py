@@ -0,0 +1,435 @@
+import hashlib
+import threading
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+
+from lcwaikiki.crawl_engine import AdaptiveRateLimiter, RetryLater
+from lcwaikiki.inventory_cache import InventoryCache
+from lcwaikiki.models import InventorySnapshot, ProductNewUrl
+from lcwaikiki.product_models import City, Product, ProductSize, SizeStoreStock, Store
+from lcwaikiki.product_scraper import DetailPipeline, ProductScraper, StagedScrapePipeline
+
+from .server import LocalServer
+
+URL = 'https://www.lcwaikiki.com/tr-TR/TR/urun/test/o-1'
+
+
+def not_modified(status_code=304, **headers):
+    """A response that check_not_modified marked as not modified"""
+    return mock.Mock(not_modified=True, status_code=status_code, headers=headers, content=b'page')
+
+
+class RequestSlotTests(TestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+
+    def test_rate_limiter_slot_released_on_unexpected_error(self):
+        self.scraper.rate_limiter = AdaptiveRateLimiter(ceiling=1)
+        session = mock.Mock()
+        session.request.side_effect = KeyError('hook')
+        with mock.patch.object(self.scraper.sessions, 'get', return_value=session):
+            with self.assertRaises(KeyError):
+                self.scraper.fetch('https://www.lcw.com/urun-o-1')
+        self.assertTrue(self.scraper.rate_limiter.try_acquire('www.lcw.com'))
+
+    def test_close_releases_pooled_sessions(self):
+        with mock.patch.object(self.scraper.sessions, 'close') as close:
+            self.scraper.close()
+        close.assert_called_once_with()
+
+
+class PostNowaitTests(TestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+        self.scraper.rate_limiter = AdaptiveRateLimiter(ceiling=2)
+        self.scraper.proxy_list = []
+        self.scraper.max_retries, self.scraper.retry_delay, self.scraper.max_proxy_attempts = 3, 0.5, 1
+        self.statuses = [500, 200]
+
+    def respond(self, handler):
+        body = handler.rfile.read(int(handler.headers['Content-Length']))
+        return self.statuses.pop(0), body, {'Content-Type': 'application/json'}
+
+    def test_failed_attempt_raises_retry_later(self):
+        with LocalServer(self.respond) as server:
+            with self.assertRaises(RetryLater) as raised, self.assertLogs('lcwaikiki', level='WARNING'):
+                self.scraper.post_nowait(f'{server.url}/inventory', {'cityId': '870'}, {'Referer': URL})
+            self.assertEqual(raised.exception.delay, 0.5)
+
+            # The resumed attempt is the second of the same request
+            response = raised.exception.resume()
+        self.assertEqual(response.json(), {'cityId': '870'})
+        self.assertEqual(server.requests, [('POST', '/inventory')] * 2)
+
+    def test_gives_up_after_the_last_attempt(self):
+        self.scraper.max_retries = 1
+        with LocalServer(self.respond) as server:
+            with self.assertLogs('lcwaikiki', level='WARNING') as logs:
+                self.assertIsNone(self.scraper.post_nowait(f'{server.url}/inventory', {}))
+        self.assertIn('ERROR:lcwaikiki.product_scraper:All proxy attempts failed', logs.output)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_inventory_attempt_raises_retry_later(self):
+        with LocalServer(self.respond) as server:
+            self.scraper.INVENTORY_API_URL = f'{server.url}/inventory'
+            with self.assertRaises(RetryLater) as raised, self.assertLogs('lcwaikiki', level='WARNING'):
+                self.scraper.fetch_inventory_nowait('111', URL, '870')
+            inventory = raised.exception.resume()
+        self.assertEqual(inventory, {'cityId': '870', 'countyIds': [], 'urunOptionSizeRef': '111'})
+        self.assertEqual(len(server.requests), 2)
+
+    def test_inventory_workers_do_not_sleep(self):
+        failed = set()
+
+        def respond(handler):
+            body = handler.rfile.read(int(handler.headers['Content-Length']))
+            # The first request of city 34 fails
+            if b'"34"' in body and not failed:
+                failed.add('34')
+                return 500, b'{}', {'Content-Type': 'application/json'}
+            return 200, body, {'Content-Type': 'application/json'}
+
+        self.scraper.retry_delay = 0.01
+        with LocalServer(respond) as server, mock.patch('lcwaikiki.product_scraper.time.sleep') as sleep:
+            self.scraper.INVENTORY_API_URL = f'{server.url}/inventory'
+            with self.assertLogs('lcwaikiki', level='WARNING'):
+                inventories = self.scraper.fetch_inventories(['111'], URL, city_ids=['870', '34'])
+        sleep.assert_not_called()
+        self.assertEqual(inventories['34']['111']['cityId'], '34')
+        self.assertEqual(inventories['870']['111']['cityId'], '870')
+        self.assertEqual(len(server.requests), 3)
+
+    def test_single_inventory_request_does_not_sleep_in_the_caller(self):
+        self.scraper.retry_delay = 0.01
+        with LocalServer(self.respond) as server, mock.patch('lcwaikiki.product_scraper.time.sleep') as sleep:
+            self.scraper.INVENTORY_API_URL = f'{server.url}/inventory'
+            with self.assertLogs('lcwaikiki', level='WARNING'):
+                inventories = self.scraper.fetch_inventories(['111'], URL, city_ids=['870'])
+        sleep.assert_not_called()
+        self.assertEqual(inventories['870']['111']['urunOptionSizeRef'], '111')
+        self.assertEqual(len(server.requests), 2)
+
+
+class DetailPipelineTests(TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.scraper = mock.Mock()
+        self.scraper.scrape_product_url.side_effect = self.scrape
+
+    def scrape(self, url):
+        self.started.set()
+        # Held until the test lets the workers go, like a slow product page
+        self.assertTrue(self.release.wait(5))
+        return not url.endswith('fails')
+
+    def test_submit_does_not_wait_for_scraping(self):
+        pipeline = DetailPipeline(concurrency=1, max_pending=2, scraper=self.scraper)
+        self.addCleanup(pipeline.close)
+        self.addCleanup(self.release.set)
+
+        self.assertTrue(pipeline.submit(URL))
+        self.assertTrue(self.started.wait(5))
+        # The only worker is busy: the next URL waits in the queue, a third one is deferred
+        self.assertTrue(pipeline.submit(URL + '-2'))
+        self.assertFalse(pipeline.submit(URL + '-3'))
+        self.assertFalse(pipeline.submit(URL))
+        self.assertEqual(pipeline.deferred, 1)
+
+    def test_close_drains_and_removes_only_scraped_urls(self):
+        urls = [URL, URL + '-fails', URL + '-deferred']
+        ProductNewUrl.objects.bulk_create([ProductNewUrl(url=url) for url in urls])
+        pipeline = DetailPipeline(concurrency=2, max_pending=2, scraper=self.scraper)
+        for url in urls:
+            pipeline.submit(url)
+
+        self.release.set()
+        self.assertEqual(pipeline.close(), 1)
+
+        self.assertEqual(self.scraper.scrape_product_url.call_count, 2)
+        self.scraper.close.assert_called_once()
+        self.assertEqual((pipeline.processed, pipeline.failed), ({URL}, 1))
+        self.assertEqual(
+            set(ProductNewUrl.objects.values_list('url', flat=True)), {URL + '-fails', URL + '-deferred'}
+        )
+
+    def test_connections_are_closed_once_per_worker(self):
+        closed = []
+        pipeline = DetailPipeline(concurrency=2, max_pending=6, scraper=self.scraper)
+        with mock.patch('lcwaikiki.product_scraper.connection') as connection:
+            connection.close.side_effect = lambda: closed.append(threading.current_thread().name)
+            for n in range(6):
+                pipeline.submit(f'{URL}-{n}')
+            self.release.set()
+            pipeline.close()
+
+        self.assertEqual(self.scraper.scrape_product_url.call_count, 6)
+        self.assertEqual(len(closed), 2)
+        self.assertEqual(len(set(closed)), 2)
+
+
+def store_inventory(quantity):
+    return {'storeInventoryInfos': [{
+        'StoreCityId': 870, 'StoreCityName': 'Sakarya', 'StoreCode': 'S1', 'StoreName': 'Serdivan', 'Quantity': quantity,
+    }]}
+
+
+class StagedScrapePipelineTests(TransactionTestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+        self.scraper.config = mock.Mock(use_stores=True, active_cities=['870'])
+        self.scraper.inventory_cache = InventoryCache()
+        self.threads = []
+
+    def product_data(self):
+        return {
+            'product': {'url': URL, 'title': 'Shirt', 'price': 100.0, 'in_stock': True, 'status': 'active'},
+            'sizes': [{
+                'size_name': 'M', 'size_id': '1', 'size_general_stock': 5, 'in_stock': True,
+                'product_option_size_reference': '111',
+            }],
+        }
+
+    def run_pipeline(self):
+        response = mock.Mock(not_modified=False, text='', url=URL, headers={'ETag': '"v1"'}, content=b'page')
+        record = mock.Mock()
+        record.to_product_data.side_effect = self.product_data
+        bulk_create = InventorySnapshot.objects.bulk_create
+
+        def record_thread(*args, **kwargs):
+            self.threads.append(threading.current_thread().name)
+            return bulk_create(*args, **kwargs)
+
+        pipeline = StagedScrapePipeline(self.scraper, parse_processes=1, prepare_workers=2)
+        with mock.patch.object(self.scraper, 'iter_responses', return_value=iter([(URL, response)])), \
+                mock.patch('lcwaikiki.product_scraper.extract_product', return_value=record), \
+                mock.patch.object(self.scraper, 'fetch_inventory_nowait', return_value=store_inventory(3)), \
+                mock.patch.object(InventorySnapshot.objects, 'bulk_create', side_effect=record_thread):
+            return pipeline.run([URL])
+
+    def test_connections_are_closed_once_per_thread(self):
+        closed = []
+        responses = [(f'{URL}-{n}', not_modified()) for n in range(6)]
+        pipeline = StagedScrapePipeline(self.scraper, parse_processes=1, prepare_workers=2)
+        with mock.patch.object(self.scraper, 'iter_responses', return_value=iter(responses)), \
+                mock.patch.object(self.scraper, 'prepare_unchanged_page', return_value=lambda: True), \
+                mock.patch('lcwaikiki.product_scraper.connection') as connection:
+            connection.close.side_effect = lambda: closed.append(threading.current_thread().name)
+            self.assertEqual(pipeline.run([url for url, _ in responses]), (6, 0))
+
+        # Each prepare thread once and the writer, not once per product
+        self.assertEqual(len(closed), 3)
+        self.assertEqual(len(set(closed)), 3)
+        self.assertIn('product-writer', closed)
+
+    def test_writer_saves_product_and_inventory(self):
+        self.assertEqual(self.run_pipeline(), (1, 0))
+
+        product = Product.objects.get(url=URL)
+        self.assertEqual(product.etag, '"v1"')
+        self.assertEqual(product.content_hash, ProductScraper.content_hash(self.product_data()))
+        size = product.sizes.get()
+        self.assertEqual(size.size_general_stock, 3)
+        self.assertEqual(SizeStoreStock.objects.get(product_size=size).stock, 3)
+        self.assertEqual(InventorySnapshot.objects.get(size_reference='111', city_id='870').data, store_inventory(3))
+
+    def test_not_modified_page_refreshes_inventory(self):
+        product = Product.objects.create(url=URL, title='Shirt', price=100, needs_refresh=True)
+        size = ProductSize.objects.create(
+            product=product, size_name='M', size_general_stock=5, product_option_size_reference='111',
+        )
+        response = not_modified()
+        pipeline = StagedScrapePipeline(self.scraper, parse_processes=1, prepare_workers=2)
+        with mock.patch.object(self.scraper, 'iter_responses', return_value=iter([(URL, response)])), \
+                mock.patch.object(self.scraper, 'fetch_inventory_nowait', return_value=store_inventory(3)):
+            self.assertEqual(pipeline.run([URL]), (1, 0))
+
+        size.refresh_from_db()
+        self.assertEqual(size.size_general_stock, 3)
+        self.assertFalse(Product.objects.get(url=URL).needs_refresh)
+
+    def test_prepare_threads_do_not_write(self):
+        self.run_pipeline()
+        self.assertEqual(self.threads, ['product-writer'])
+
+
+class ContentHashSkipTests(TestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+
+    def product_data(self, price=100.0):
+        return {
+            'product': {'url': URL, 'title': 'Shirt', 'price': price, 'in_stock': True, 'status': 'active'},
+            'sizes': [{'size_name': 'M', 'size_general_stock': 2}, {'size_name': 'S', 'size_general_stock': 1}],
+        }
+
+    def test_hash_ignores_validators_and_size_order(self):
+        data = self.product_data()
+        other = self.product_data()
+        other['product'].update(etag='"v9"', body_hash='y')
+        other['sizes'].reverse()
+        self.assertEqual(ProductScraper.content_hash(data), ProductScraper.content_hash(other))
+        self.assertNotEqual(ProductScraper.content_hash(data), ProductScraper.content_hash(self.product_data(90.0)))
+
+    def test_unchanged_product_only_updates_validators(self):
+        Product.objects.create(
+            url=URL, title='Shirt', price=100, needs_refresh=True, etag='"v1"', body_hash='old',
+            content_hash=ProductScraper.content_hash(self.product_data()),
+        )
+        validators = {'etag': '"v2"', 'last_modified': None, 'body_hash': 'new'}
+
+        write = self.scraper.prepare_product_data(URL, self.product_data(), validators)
+        self.assertEqual(write.func, self.scraper.write_unchanged_product)
+        self.assertTrue(write())
+
+        product = Product.objects.get(url=URL)
+        self.assertFalse(product.needs_refresh)
+        self.assertEqual((product.etag, product.body_hash), ('"v2"', 'new'))
+
+    def test_changed_product_is_saved(self):
+        Product.objects.create(url=URL, title='Shirt', price=100, content_hash='stale')
+        validators = {'etag': '"v2"', 'last_modified': None, 'body_hash': 'new'}
+
+        write = self.scraper.prepare_product_data(URL, self.product_data(90.0), validators)
+        self.assertEqual(write.func, self.scraper.write_product_data)
+        self.assertTrue(write())
+
+        product = Product.objects.get(url=URL)
+        self.assertEqual(product.price, 90)
+        self.assertEqual(product.etag, '"v2"')
+        self.assertEqual(product.content_hash, ProductScraper.content_hash(self.product_data(90.0)))
+
+
+class UnchangedProductInventoryTests(TestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+        self.scraper.config = mock.Mock(use_stores=True, active_cities=['870'])
+        self.scraper.inventory_cache = InventoryCache()
+        self.product_data = {
+            'product': {'url': URL, 'title': 'Shirt', 'price': 100.0, 'in_stock': True, 'status': 'active'},
+            'sizes': [{
+                'size_name': 'M', 'size_general_stock': 5, 'in_stock': True, 'product_option_size_reference': '111',
+            }],
+        }
+        product = Product.objects.create(
+            url=URL, title='Shirt', price=100, content_hash=ProductScraper.content_hash(self.product_data),
+        )
+        self.size = ProductSize.objects.create(
+            product=product, size_name='M', size_general_stock=5, product_option_size_reference='111',
+        )
+        self.validators = {'etag': '"v2"', 'last_modified': None, 'body_hash': 'new'}
+
+    def test_expired_inventory_is_refreshed(self):
+        with mock.patch.object(self.scraper, 'fetch_inventory_nowait', return_value=store_inventory(2)) as fetch:
+            write = self.scraper.prepare_product_data(URL, self.product_data, self.validators)
+        self.assertEqual(write.func, self.scraper.write_unchanged_product)
+        fetch.assert_called_once()
+        self.assertTrue(write())
+
+        self.size.refresh_from_db()
+        self.assertEqual(self.size.size_general_stock, 2)
+        self.assertEqual(SizeStoreStock.objects.get(product_size=self.size).stock, 2)
+        self.assertEqual(Product.objects.get(url=URL).etag, '"v2"')
+
+    def test_not_modified_page_refreshes_expired_inventory(self):
+        Product.objects.filter(url=URL).update(needs_refresh=True)
+        with mock.patch.object(self.scraper, 'fetch_inventory_nowait', return_value=store_inventory(2)) as fetch:
+            self.assertTrue(self.scraper.process_product_url(URL, response=not_modified()))
+        fetch.assert_called_once_with('111', URL, '870')
+
+        self.size.refresh_from_db()
+        self.assertEqual(self.size.size_general_stock, 2)
+        self.assertEqual(SizeStoreStock.objects.get(product_size=self.size).stock, 2)
+        self.assertFalse(Product.objects.get(url=URL).needs_refresh)
+
+        # Within the TTL the next 304 makes no inventory request
+        with mock.patch.object(self.scraper, 'fetch_inventory_nowait') as fetch:
+            self.assertTrue(self.scraper.process_product_url(URL, response=not_modified()))
+        fetch.assert_not_called()
+
+    def test_not_modified_page_saves_new_validators(self):
+        Product.objects.filter(url=URL).update(etag='"v1"', last_modified='Mon', body_hash='old', needs_refresh=True)
+        self.scraper.config = None
+        self.assertTrue(self.scraper.process_product_url(URL, response=not_modified(ETag='"v2"')))
+        # A 304 has no body: the stored body hash and Last-Modified are kept
+        self.assertEqual(
+            Product.objects.filter(url=URL).values_list('etag', 'last_modified', 'body_hash', 'needs_refresh').get(),
+            ('"v2"', 'Mon', 'old', False)
+        )
+
+    def test_identical_body_saves_new_validators(self):
+        body_hash = hashlib.sha256(b'page').hexdigest()
+        Product.objects.filter(url=URL).update(etag='"v1"', body_hash=body_hash)
+        self.scraper.config = None
+        response = not_modified(200, ETag='"v3"', **{'Last-Modified': 'Tue'})
+        self.assertTrue(self.scraper.process_product_url(URL, response=response))
+        self.assertEqual(
+            Product.objects.filter(url=URL).values_list('etag', 'last_modified', 'body_hash').get(),
+            ('"v3"', 'Tue', body_hash)
+        )
+
+    def test_fresh_inventory_is_not_requested_or_rewritten(self):
+        self.scraper.inventory_cache.set_many({'111': store_inventory(2)}, '870')
+        with mock.patch.object(self.scraper, 'fetch_inventory_nowait') as fetch:
+            write = self.scraper.prepare_product_data(URL, self.product_data, self.validators)
+        fetch.assert_not_called()
+        self.assertEqual(write.args[-1], {})
+        self.assertTrue(write())
+
+        self.size.refresh_from_db()
+        self.assertEqual(self.size.size_general_stock, 5)
+
+
+def city_store(city_id, store_code, quantity):
+    return {
+        'StoreCityId': int(city_id), 'StoreCityName': f'City {city_id}', 'StoreCode': store_code,
+        'StoreName': store_code, 'Quantity': quantity,
+    }
+
+
+class MultiCityInventoryTests(TestCase):
+    def setUp(self):
+        self.scraper = ProductScraper()
+        self.addCleanup(self.scraper.close)
+        self.scraper.config = mock.Mock(use_stores=True, active_cities=['870', '34'])
+        self.scraper.inventory_cache = InventoryCache()
+
+    def test_each_reference_is_requested_once_per_city(self):
+        with mock.patch.object(self.scraper, 'fetch_inventory_nowait', side_effect=lambda ref, url, city: {ref: city}) as fetch:
+            inventories = self.scraper.fetch_inventories(['111', '111', '222'], URL, city_ids=['870', '34', '870'])
+
+        self.assertEqual(fetch.call_count, 4)
+        self.assertEqual(inventories, {
+            '870': {'111': {'111': '870'}, '222': {'222': '870'}},
+            '34': {'111': {'111': '34'}, '222': {'222': '34'}},
+        })
+
+    def test_cities_are_merged_into_one_stock_upsert(self):
+        product = Product.objects.create(url=URL, title='Shirt', price=100)
+        size = ProductSize.objects.create(product=product, size_name='M', size_general_stock=9)
+        SizeStoreStock.objects.create(
+            product_size=size, stock=7,
+            store=Store.objects.create(store_code='S1', store_name='Old', city=City.objects.create(city_id='870', name='Sakarya')),
+        )
+        responses = [
+            {'storeInventoryInfos': [city_store('870', 'S1', 2), city_store('6', 'S9', 4)]},
+            # The store of another active city, plus S1 listed again
+            {'storeInventoryInfos': [city_store('34', 'S2', 3), city_store('870', 'S1', 2)]},
+        ]
+
+        # City, Store and SizeStoreStock upserts and the ProductSize update, inside one savepoint
+        with self.assertNumQueries(6):
+            self.assertTrue(self.scraper.store_inventories([(size, data) for data in responses]))
+
+        stocks = dict(SizeStoreStock.objects.filter(product_size=size).values_list('store_id', 'stock'))
+        self.assertEqual(stocks, {'S1': 2, 'S2': 3})
+        self.assertFalse(Store.objects.filter(store_code='S9').exists())
+        self.assertEqual(set(City.objects.values_list('city_id', flat=True)), {'870', '34'})
+        size.refresh_from_db()
+        self.assertEqual(size.size_general_stock, 5)
@@ -0,0 +1,106 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from lcwaikiki.proxy_manager import ProxyManager
+
+A, B, C = 'http://proxy-a:8080', 'http://proxy-b:8080', 'http://proxy-c:8080'
+
+
+class FakeClock:
+    """Stands in for the time module of lcwaikiki.proxy_manager"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class ProxyManagerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('lcwaikiki.proxy_manager.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = ProxyManager([A, B, C], alpha=0.5, failure_threshold=3, cooldown=60, max_cooldown=200)
+
+    def stats(self, proxy):
+        return self.manager._stats[proxy]
+
+    def trip(self, proxy, times=1):
+        with self.assertLogs('lcwaikiki.proxy_manager', level='WARNING'):
+            for _ in range(times):
+                self.manager.report_failure(proxy, trip=True)
+
+    def test_latency_and_error_rate_are_moving_averages(self):
+        self.manager.report_success(A, 1.0)
+        self.manager.report_success(A, 3.0)
+        self.assertEqual(self.stats(A).latency, 2.0)
+
+        self.manager.report_failure(A)
+        self.assertEqual(self.stats(A).error_rate, 0.5)
+        self.manager.report_success(A, 2.0)
+        self.assertEqual(self.stats(A).error_rate, 0.25)
+        self.assertEqual(self.stats(A).requests, 4)
+
+    def test_acquire_prefers_unmeasured_then_best_score(self):
+        self.manager.report_success(A, 1.0)
+        self.manager.report_success(B, 0.5)
+        self.assertEqual(self.manager.acquire(), C)
+
+        self.manager.report_success(C, 0.8)
+        self.assertEqual(self.manager.acquire(), B)
+        # A failure weighs the latency by the error rate: 0.5 * (1 + 4 * 0.5) > 0.8
+        self.manager.report_failure(B)
+        self.assertEqual(self.manager.acquire(), C)
+        self.assertEqual(self.manager.acquire(exclude={C}), A)
+        self.assertIsNone(self.manager.acquire(exclude={A, B, C}))
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.manager.report_failure(A)
+        self.manager.report_failure(A)
+        self.assertTrue(self.manager.is_available(A))
+        with self.assertLogs('lcwaikiki.proxy_manager', level='WARNING') as logs:
+            self.manager.report_failure(A)
+        self.assertEqual(logs.output, [f'WARNING:lcwaikiki.proxy_manager:Proxy {A} circuit opened for 60s'])
+        self.assertFalse(self.manager.is_available(A))
+        self.assertNotEqual(self.manager.acquire(), A)
+
+        self.clock.now += 60
+        self.assertTrue(self.manager.is_available(A))
+
+    def test_trip_opens_the_circuit_at_once(self):
+        self.trip(B)
+        self.assertFalse(self.manager.is_available(B))
+        self.assertTrue(self.manager.is_available(None))
+
+    def test_cooldown_doubles_up_to_the_maximum(self):
+        cooldowns = []
+        for _ in range(4):
+            self.trip(A)
+            cooldowns.append(self.stats(A).open_until - self.clock.now)
+            self.clock.now = self.stats(A).open_until
+        self.assertEqual(cooldowns, [60, 120, 200, 200])
+
+        # A success closes the circuit and resets the backoff
+        self.manager.report_success(A, 1.0)
+        self.trip(A)
+        self.assertEqual(self.stats(A).open_until - self.clock.now, 60)
+
+    def test_probe_when_every_circuit_is_open(self):
+        self.trip(A)  # Open until 1060
+        self.clock.now += 10
+        self.trip(B)  # Until 1070
+        self.trip(C, times=2)  # Until 1130
+
+        # The proxy whose cooldown ends first is handed out as a probe
+        self.assertEqual(self.manager.acquire(), A)
+        self.assertEqual(self.manager.acquire(exclude={A}), B)
+        self.assertEqual(self.manager.snapshot()[C]['open_for'], 120)
+
+    def test_unknown_proxies_and_direct_connections_are_ignored(self):
+        self.manager.report_failure(None, trip=True)
+        self.manager.report_success('http://unknown:1', 1.0)
+        self.assertTrue(self.manager.is_available('http://unknown:1'))
+        self.assertEqual(self.manager.snapshot()[A]['requests'], 0)
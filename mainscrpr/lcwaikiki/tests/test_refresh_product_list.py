@@ -0,0 +1,553 @@
+import hashlib
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from urllib3.connectionpool import HTTPSConnectionPool
+from urllib3.exceptions import ProtocolError
+
+from lcwaikiki.crawl_engine import AdaptiveRateLimiter, get_rate_limiter
+from lcwaikiki.management.commands.refresh_product_list import (
+    APIManager, DataManager, NewArrivalsScanner, ProductScraper, RequestSession, ScraperConfig, ScraperUtils,
+    ShardedCrawler
+)
+from lcwaikiki.models import ListingPageFingerprint, ProductAvailableUrl, ProductDeletedUrl, ProductNewUrl, ScraperState
+from lcwaikiki.product_models import Product
+
+
+def product(page, n):
+    return {'url': f'https://example.com/p-{page}-{n}', 'page': page}
+
+
+class TemporaryCheckpointMixin:
+    """Keep the checkpoint files of a test in a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for name in ('DATA_FILE', 'CHECKPOINT_FILE', 'JOURNAL_FILE'):
+            patcher = mock.patch.object(
+                ScraperConfig, name, os.path.join(directory.name, getattr(ScraperConfig, name))
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class CheckpointJournalTests(TemporaryCheckpointMixin, SimpleTestCase):
+
+    def interrupted_run(self):
+        """Crawl pages 1 and 2, sync page 1 and stop without compacting"""
+        manager = DataManager(shard='test')
+        manager.add_products(1, [product(1, 1), product(1, 2)])
+        manager.add_products(2, [product(2, 1), product(1, 1)])  # Duplicate of a page 1 product
+        manager.mark_synced([1])
+        manager.save_checkpoint()
+        manager._journal.close()
+        return manager
+
+    def test_replay_after_interrupt(self):
+        first = self.interrupted_run()
+
+        resumed = DataManager(shard='test')
+        self.assertEqual(resumed._completed_pages, {1, 2})
+        self.assertEqual(resumed.unsynced_pages(), [2])
+        self.assertEqual([p['url'] for p in resumed.unsynced_products()], ['https://example.com/p-2-1'])
+        self.assertEqual(resumed.repeated_products(2), [product(1, 1)])
+        self.assertEqual(resumed.run_started_at, first.run_started_at)
+        resumed.clear_checkpoint()
+
+    def test_truncated_last_line(self):
+        self.interrupted_run()
+        with open(DataManager._shard_path(ScraperConfig.JOURNAL_FILE, 'test'), 'a', encoding='utf-8') as f:
+            f.write('{"page": 3, "products": [{"url": "https://exa')
+
+        resumed = DataManager(shard='test')
+        self.assertEqual(resumed._completed_pages, {1, 2})
+
+        # New entries start on their own line, so the next resume still reads them
+        resumed.add_products(3, [product(3, 1)])
+        resumed.save_checkpoint()
+        resumed._journal.close()
+        again = DataManager(shard='test')
+        self.assertEqual(again._completed_pages, {1, 2, 3})
+        again.clear_checkpoint()
+
+    def test_compaction_keeps_state(self):
+        first = self.interrupted_run()
+        first.compact()
+        self.assertFalse(os.path.exists(first.journal_file))
+
+        resumed = DataManager(shard='test')
+        self.assertEqual(resumed._completed_pages, {1, 2})
+        self.assertEqual(resumed.unsynced_pages(), [2])
+        self.assertEqual(len(resumed._products), 3)
+        self.assertEqual(resumed.repeated_products(2), [product(1, 1)])
+        self.assertEqual(resumed.run_started_at, first.run_started_at)
+        resumed.clear_checkpoint()
+
+    @mock.patch.object(ScraperConfig, 'COMPACTION_MIN_JOURNAL_BYTES', 1)
+    def test_compaction_waits_for_the_journal_to_outgrow_the_snapshot(self):
+        manager = DataManager(shard='test')
+        manager.add_products(1, [product(1, 1)])
+        manager.save_checkpoint()
+        # With no snapshot yet, the first checkpoint past the minimum compacts
+        self.assertFalse(os.path.exists(manager.journal_file))
+        snapshot_size = os.path.getsize(manager.data_file) + os.path.getsize(manager.checkpoint_file)
+
+        page = 1
+        while True:
+            page += 1
+            manager.add_products(page, [product(page, 1)])
+            manager._journal.flush()
+            journal_size = os.path.getsize(manager.journal_file)
+            manager.save_checkpoint()
+            if not os.path.exists(manager.journal_file):
+                break
+            self.assertLess(journal_size, ScraperConfig.COMPACTION_JOURNAL_RATIO * snapshot_size)
+        self.assertGreaterEqual(journal_size, ScraperConfig.COMPACTION_JOURNAL_RATIO * snapshot_size)
+        self.assertGreater(page, 2)
+
+        resumed = DataManager(shard='test')
+        self.assertEqual(resumed._completed_pages, set(range(1, page + 1)))
+        resumed.clear_checkpoint()
+
+
+class AvailableUrlUpsertTests(TestCase):
+    def test_reposted_urls_are_updated_in_place(self):
+        api = APIManager()
+        api.post_available_urls([
+            {'page_id': '1', 'product_id_in_page': '1', 'url': 'https://www.lcw.com/a-o-1', 'brand': 'lcw'},
+            {'page_id': '1', 'product_id_in_page': '2', 'url': 'https://www.lcw.com/b-o-2', 'brand': 'lcw'},
+        ])
+        first = ProductAvailableUrl.objects.get(url='https://www.lcw.com/a-o-1')
+
+        api.post_available_urls([
+            {'page_id': '2', 'product_id_in_page': '5', 'url': 'https://www.lcw.com/a-o-1', 'brand': 'lcw'},
+            # Listed twice in one batch, the first occurrence wins
+            {'page_id': '2', 'product_id_in_page': '6', 'url': 'https://www.lcw.com/c-o-3', 'brand': 'lcw'},
+            {'page_id': '3', 'product_id_in_page': '1', 'url': 'https://www.lcw.com/c-o-3', 'brand': 'lcw'},
+        ])
+
+        self.assertEqual(ProductAvailableUrl.objects.count(), 3)
+        updated = ProductAvailableUrl.objects.get(url='https://www.lcw.com/a-o-1')
+        self.assertEqual((updated.id, updated.page_id, updated.product_id_in_page), (first.id, '2', '5'))
+        self.assertGreater(updated.last_checking, first.last_checking)
+        self.assertEqual(updated.created_at, first.created_at)
+        self.assertEqual(ProductAvailableUrl.objects.get(url='https://www.lcw.com/c-o-3').page_id, '2')
+
+
+def listed(*urls, page='1', brand='test-brand'):
+    return [
+        {'page_id': page, 'product_id_in_page': str(n), 'url': f'https://www.lcw.com/{url}', 'brand': brand}
+        for n, url in enumerate(urls, start=1)
+    ]
+
+
+def url_set(model):
+    return {url.rsplit('/', 1)[1] for url in model.objects.values_list('url', flat=True)}
+
+
+class RunMarkerDetectionTests(TestCase):
+    def setUp(self):
+        self.api = APIManager()
+
+    def crawl(self, products, brand='test-brand'):
+        """One run of a shard: listed rows are upserted after the run marker"""
+        run_started_at = timezone.now()
+        self.api.post_available_urls(products)
+        return (
+            run_started_at,
+            self.api.post_new_urls_since(run_started_at, brand=brand),
+            self.api.post_deleted_urls_before(run_started_at, brand=brand),
+        )
+
+    def test_new_and_deleted_urls_across_two_runs(self):
+        Product.objects.create(url='https://www.lcw.com/scraped-o-2', title='Shirt', price=10)
+
+        _, new, deleted = self.crawl(listed('a-o-1', 'scraped-o-2'))
+        self.assertEqual((new, deleted), (1, 0))
+        self.assertEqual(url_set(ProductNewUrl), {'a-o-1'})
+
+        _, new, deleted = self.crawl(listed('scraped-o-2', 'c-o-3'))
+        self.assertEqual((new, deleted), (1, 1))
+        self.assertEqual(url_set(ProductNewUrl), {'a-o-1', 'c-o-3'})
+        self.assertEqual(url_set(ProductDeletedUrl), {'a-o-1'})
+
+        # Already recorded URLs are not inserted twice
+        _, new, deleted = self.crawl(listed('scraped-o-2', 'c-o-3'))
+        self.assertEqual((new, deleted), (0, 0))
+        self.assertEqual(ProductDeletedUrl.objects.count(), 1)
+
+    def test_other_brands_are_left_to_their_shard(self):
+        self.api.post_available_urls(listed('other-o-9', brand='other-brand'))
+        _, _, deleted = self.crawl(listed('a-o-1'))
+        self.assertEqual(deleted, 0)
+        self.assertFalse(ProductDeletedUrl.objects.exists())
+
+    def test_unsharded_sweep(self):
+        self.api.post_available_urls(
+            listed('a-o-1') + listed('gone-o-8', brand='dropped-brand') + listed('legacy-o-9', brand='')
+        )
+        run_started_at, _, _ = self.crawl(listed('a-o-1'))
+
+        self.assertEqual(self.api.post_unsharded_deleted_urls_before(run_started_at, ['test-brand']), 2)
+        self.assertEqual(url_set(ProductDeletedUrl), {'gone-o-8', 'legacy-o-9'})
+
+
+class ListingPriceTests(TestCase):
+    def setUp(self):
+        self.api = APIManager()
+
+    def product(self, name, price, discount_ratio=None, in_stock=True):
+        product = Product.objects.create(url=f'https://www.lcw.com/{name}', title=name, in_stock=in_stock)
+        # Product.save() applies the price_config, so the stored values are set directly
+        Product.objects.filter(pk=product.pk).update(price=price, discount_ratio=discount_ratio)
+        return product
+
+    @staticmethod
+    def card(name, price, discount_ratio=None, in_stock=True):
+        return {
+            'url': f'https://www.lcw.com/{name}', 'page': 1, 'position': 1,
+            'price': price, 'discount_ratio': discount_ratio, 'in_stock': in_stock,
+        }
+
+    def stored(self, name):
+        product = Product.objects.get(url=f'https://www.lcw.com/{name}')
+        return product.price, product.discount_ratio, product.in_stock
+
+    def test_price_discount_and_stock_are_updated(self):
+        self.product('a-o-1', '100.00')
+        self.product('b-o-2', '50.00', discount_ratio='0.10')
+        self.product('c-o-3', '20.00')
+
+        updated = self.api.apply_listing_prices([
+            self.card('a-o-1', '80.00', discount_ratio='0.20'),
+            self.card('b-o-2', '12.00'),  # Went off sale: the badge is gone
+            self.card('c-o-3', '20.00', in_stock=False),
+            self.card('unscraped-o-4', '10.00'),
+            self.card('c-o-3', None),  # Cards without a parsed price are ignored
+        ])
+
+        self.assertEqual(updated, 3)
+        self.assertEqual(self.stored('a-o-1'), (Decimal('80.00'), Decimal('0.20'), True))
+        self.assertEqual(self.stored('b-o-2'), (Decimal('12.00'), Decimal('0.00'), True))
+        self.assertEqual(self.stored('c-o-3'), (Decimal('20.00'), None, False))
+        self.assertFalse(Product.objects.filter(url='https://www.lcw.com/unscraped-o-4').exists())
+
+    def test_unchanged_products_are_not_written(self):
+        self.product('a-o-1', '100.00')
+        self.product('b-o-2', '50.00', discount_ratio='0.10')
+        self.product('c-o-3', '20.00', discount_ratio='0.00')
+        cards = [
+            self.card('a-o-1', '100.00'),
+            self.card('b-o-2', '50.00', discount_ratio='0.10'),
+            self.card('c-o-3', '20.00'),
+        ]
+
+        # The price_config and product lookups, no update
+        with self.assertNumQueries(2):
+            self.assertEqual(self.api.apply_listing_prices(cards), 0)
+
+
+class RequestSessionTests(TestCase):
+    def test_connection_errors_are_not_retried_by_urllib3(self):
+        session = RequestSession()
+        with mock.patch.object(HTTPSConnectionPool, '_make_request', side_effect=ProtocolError('reset')) as request:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                session.fetch('https://example.com/listing')
+        # The caller's retry_later owns the retries, so one failure is one attempt
+        self.assertEqual(request.call_count, 1)
+
+    def test_rate_limiter_slot_released_on_unexpected_error(self):
+        session = RequestSession()
+        session.rate_limiter = AdaptiveRateLimiter(ceiling=1)
+        with mock.patch.object(session.session, 'get', side_effect=KeyError('hook')):
+            with self.assertRaises(KeyError):
+                session.fetch('https://example.com/listing')
+        self.assertTrue(session.rate_limiter.try_acquire('example.com'))
+
+    def test_listing_pages_have_their_own_linked_pool(self):
+        session = RequestSession()
+        self.assertIs(session.rate_limiter, get_rate_limiter('listing'))
+        self.assertIsNot(session.rate_limiter, get_rate_limiter())
+        # Sized for the listing workers, not for max_concurrent_requests
+        self.assertEqual(session.rate_limiter.ceiling, ScraperConfig.MAX_WORKERS)
+        self.assertIn(get_rate_limiter(), session.rate_limiter._peers)
+
+
+class CheckpointExpiryTests(TemporaryCheckpointMixin, SimpleTestCase):
+    def start_run(self):
+        manager = DataManager(shard='test')
+        manager.add_products(1, [product(1, 1)])
+        manager.save_checkpoint()
+        manager._journal.close()
+        return manager
+
+    def test_resume_limit(self):
+        first = self.start_run()
+        with mock.patch.object(ScraperConfig, 'CHECKPOINT_MAX_RESUMES', 2):
+            for resumes in (1, 2):
+                resumed = DataManager(shard='test')
+                resumed._journal.close()
+                self.assertEqual((resumed.resumes, resumed.run_started_at), (resumes, first.run_started_at))
+
+            fresh = DataManager(shard='test')
+        self.assertEqual(fresh.resumes, 0)
+        self.assertEqual(fresh._completed_pages, set())
+        self.assertGreater(fresh.run_started_at, first.run_started_at)
+        fresh.clear_checkpoint()
+
+    def test_age_limit(self):
+        self.start_run()
+        with mock.patch.object(ScraperConfig, 'CHECKPOINT_MAX_AGE', -1):
+            fresh = DataManager(shard='test')
+        self.assertEqual(fresh._completed_pages, set())
+        fresh.clear_checkpoint()
+
+
+def cards(page, count):
+    return [{
+        'page': page, 'position': position, 'url': f'https://www.lcw.com/urun-{page}-{position}',
+        'price': None, 'discount_ratio': None, 'in_stock': True,
+    } for position in range(1, count + 1)]
+
+
+class ShardCompletionTests(TemporaryCheckpointMixin, TestCase):
+    PER_PAGE = 2
+
+    def run_shard(self, listing, total_pages=None):
+        """Run a shard against `listing` (page -> cards); return it with the pages it fetched"""
+        shard = ProductScraper('test-brand')
+        fetched = []
+
+        def crawl_pages(pages):
+            for page in pages:
+                fetched.append(page)
+                yield page, listing.get(page, []), None
+
+        def total():
+            shard.per_page = self.PER_PAGE
+            return total_pages or max(listing)
+
+        with mock.patch.object(shard, 'get_total_pages', side_effect=total), \
+                mock.patch.object(shard, '_crawl_pages', side_effect=crawl_pages), \
+                mock.patch.object(APIManager, 'post_deleted_urls_before', return_value=0) as deleted:
+            shard.run()
+        return shard, fetched, deleted
+
+    def test_stale_count_ends_at_the_last_partial_page(self):
+        listing = {1: cards(1, 2), 2: cards(2, 2), 3: cards(3, 1)}
+        shard, fetched, deleted = self.run_shard(listing, total_pages=5)
+
+        self.assertEqual(fetched, [1, 2, 3, 4, 5])
+        self.assertEqual(shard.last_page, 3)
+        self.assertTrue(shard.is_complete)
+        deleted.assert_called_once()
+        self.assertEqual(ProductAvailableUrl.objects.filter(brand='test-brand').count(), 5)
+        self.assertFalse(os.path.exists(shard.data_manager.checkpoint_file))
+
+    def test_empty_page_inside_the_listing_is_crawled_again(self):
+        listing = {1: cards(1, 2), 3: cards(3, 1)}  # Page 2 came back without cards
+        shard, _, deleted = self.run_shard(listing, total_pages=3)
+        self.assertFalse(shard.is_complete)
+        deleted.assert_not_called()
+        self.assertTrue(os.path.exists(shard.data_manager.checkpoint_file))
+
+        listing[2] = cards(2, 2)
+        resumed, fetched, deleted = self.run_shard(listing, total_pages=3)
+        self.assertEqual(fetched, [2])
+        self.assertTrue(resumed.is_complete)
+        deleted.assert_called_once()
+        self.assertEqual(resumed.data_manager.run_started_at, shard.data_manager.run_started_at)
+
+    def test_later_cards_move_the_end(self):
+        listing = {1: cards(1, 1), 2: cards(2, 2), 3: cards(3, 1)}  # The listing grew while it was crawled
+        shard, _, _ = self.run_shard(listing, total_pages=4)
+        self.assertEqual(shard.last_page, 3)
+        self.assertTrue(shard.is_complete)
+
+
+class ListingFingerprintTests(TemporaryCheckpointMixin, TestCase):
+    def run_shard(self, listing):
+        """A complete shard run against `listing` (page -> cards) with the real deleted URL detection"""
+        shard = ProductScraper('test-brand')
+
+        def total():
+            shard.per_page = 2
+            return max(listing)
+
+        crawl = lambda pages: ((page, listing[page], None) for page in pages)
+        with mock.patch.object(shard, 'get_total_pages', side_effect=total), \
+                mock.patch.object(shard, '_crawl_pages', side_effect=crawl):
+            shard.run()
+        self.assertTrue(shard.is_complete)
+        return shard
+
+    @staticmethod
+    def last_checking():
+        return dict(ProductAvailableUrl.objects.values_list('url', 'last_checking'))
+
+    def test_unchanged_page_is_skipped_and_kept(self):
+        listing = {1: cards(1, 2), 2: cards(2, 1)}
+        self.run_shard(listing)
+        before = self.last_checking()
+
+        listing[2] = cards(2, 1)
+        listing[2][0]['url'] = 'https://www.lcw.com/urun-2-9'  # Page 2 changed, page 1 did not
+        self.run_shard(listing)
+        after = self.last_checking()
+
+        # Page 1 was not rewritten, yet its URLs count as seen
+        for url in ('https://www.lcw.com/urun-1-1', 'https://www.lcw.com/urun-1-2'):
+            self.assertEqual(after[url], before[url])
+        self.assertEqual(url_set(ProductDeletedUrl), {'urun-2-1'})
+        self.assertIn('https://www.lcw.com/urun-2-9', after)
+        self.assertEqual(
+            ListingPageFingerprint.objects.get(brand='test-brand', page_id='2').fingerprint,
+            hashlib.sha1(b'https://www.lcw.com/urun-2-9').hexdigest(),
+        )
+
+    def test_stale_fingerprints_are_rewritten(self):
+        listing = {1: cards(1, 2)}
+        self.run_shard(listing)
+        before = self.last_checking()
+
+        with mock.patch.object(ScraperConfig, 'FINGERPRINT_MAX_AGE', -1):
+            self.run_shard(listing)
+        after = self.last_checking()
+        self.assertTrue(all(after[url] > before[url] for url in before))
+        self.assertFalse(ProductDeletedUrl.objects.exists())
+
+    def test_page_sharing_a_url_with_an_earlier_page(self):
+        listing = {1: cards(1, 2), 2: cards(2, 2)}
+        listing[2][0] = dict(listing[1][1], page=2, position=1)  # Page 2 repeats urun-1-2
+        self.run_shard(listing)
+        fingerprint = ListingPageFingerprint.objects.get(brand='test-brand', page_id='2')
+        # The whole page counts, not only the URLs the crawl had not seen yet
+        self.assertEqual(
+            fingerprint.fingerprint,
+            hashlib.sha1(b'https://www.lcw.com/urun-1-2\nhttps://www.lcw.com/urun-2-2').hexdigest(),
+        )
+
+        listing[1] = cards(1, 3)
+        del listing[1][1]  # urun-1-2 left page 1, page 2 did not change
+        self.run_shard(listing)
+
+        self.assertEqual(
+            ListingPageFingerprint.objects.get(brand='test-brand', page_id='2').written_at, fingerprint.written_at
+        )
+        # Its row moved to the skipped page, which still lists it
+        self.assertEqual(ProductAvailableUrl.objects.get(url='https://www.lcw.com/urun-1-2').page_id, '2')
+        self.assertFalse(ProductDeletedUrl.objects.exists())
+
+        # On the next run both pages are unchanged and nothing is written
+        with mock.patch.object(APIManager, 'post_available_urls') as post:
+            self.run_shard(listing)
+        post.assert_called_once_with([])
+        self.assertFalse(ProductDeletedUrl.objects.exists())
+
+    def test_removed_url_is_deleted(self):
+        listing = {1: cards(1, 2), 2: cards(2, 2)}
+        self.run_shard(listing)
+
+        listing[2] = cards(2, 1)  # The last product of page 2 is gone
+        self.run_shard(listing)
+        self.assertEqual(url_set(ProductDeletedUrl), {'urun-2-2'})
+
+
+class TotalPagesTests(TemporaryCheckpointMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.shard = ProductScraper('test-brand')
+        self.addCleanup(self.shard.data_manager.clear_checkpoint)
+
+    def total_pages(self, counts=None, error=None):
+        parser = mock.Mock()
+        parser.listing_counts.return_value = counts
+        with mock.patch.object(self.shard.session, 'get', side_effect=error, return_value=mock.Mock(text='')), \
+                mock.patch('lcwaikiki.management.commands.refresh_product_list.get_parser', return_value=parser):
+            return self.shard.get_total_pages()
+
+    def test_count(self):
+        self.assertEqual(self.total_pages((200, 96)), 3)
+        self.assertEqual(ScraperState.get_value('listing_count:test-brand'), {'product_count': 200, 'per_page': 96})
+
+    def test_empty_brand(self):
+        self.assertEqual(self.total_pages((0, 96)), 0)
+
+    def test_failed_count_uses_the_shards_last_count(self):
+        self.assertIsNone(self.total_pages(error=requests.exceptions.ConnectionError('down')))
+        self.total_pages((100, 48))
+        self.assertEqual(self.total_pages(error=requests.exceptions.ConnectionError('down')), 3)
+        self.assertEqual(self.total_pages((None, None)), 3)
+
+
+class ShardedCrawlerTests(TemporaryCheckpointMixin, TestCase):
+    def crawler(self, **kwargs):
+        with mock.patch.object(ShardedCrawler, '_setup_signal_handlers'), \
+                mock.patch.object(ShardedCrawler, '_get_brands', return_value=['test-brand']):
+            return ShardedCrawler(brands=['test-brand'], **kwargs)
+
+    def test_host_limit_follows_the_engine(self):
+        self.assertEqual(self.crawler().limiter.per_host_limit, ScraperConfig.MAX_PER_HOST)
+        self.assertEqual(self.crawler(engine='async').limiter.per_host_limit, ScraperConfig.ASYNC_CONCURRENCY)
+        self.assertEqual(self.crawler(engine='async', concurrency=40).limiter.per_host_limit, 40)
+
+    def test_async_shards_share_the_process_rate_limiter(self):
+        shared = get_rate_limiter('listing')
+        ceiling = shared.ceiling
+        crawler = self.crawler(engine='async', concurrency=40)
+        self.assertIs(crawler.shards[0].rate_limiter, shared)
+        self.assertEqual(shared.ceiling, ceiling)
+
+
+class NewArrivalsScannerTests(TestCase):
+    def scan(self, listing, stop_after=2, pipeline=None):
+        """Scan `listing` (page -> cards); return the scanner, the new URL count and the pages fetched"""
+        with mock.patch.object(NewArrivalsScanner, '_setup_signal_handlers'):
+            scanner = NewArrivalsScanner(brands=['test-brand'], stop_after=stop_after, max_pages=20, pipeline=pipeline)
+        fetched = []
+
+        def scrape_page(page):
+            fetched.append(page)
+            return listing.get(page, cards(page, 2))
+
+        with mock.patch.object(scanner, 'scrape_page', side_effect=scrape_page), \
+                mock.patch.object(ScraperUtils, 'setup_logging'):
+            total_new = scanner.run()
+        return scanner, total_new, sorted(fetched)
+
+    def test_unknown_urls_are_posted_as_new(self):
+        ProductAvailableUrl.objects.create(page_id='1', product_id_in_page='1', url='https://www.lcw.com/urun-1-1')
+        Product.objects.create(url='https://www.lcw.com/urun-2-1', title='Shirt', price=10)
+        listing = {1: cards(1, 2), 2: cards(2, 2), 3: []}
+
+        _, total_new, _ = self.scan(listing)
+        self.assertEqual(total_new, 2)
+        self.assertEqual(url_set(ProductNewUrl), {'urun-1-2', 'urun-2-2'})
+
+    def test_stops_after_pages_without_unknown_urls(self):
+        ProductNewUrl.objects.bulk_create([
+            ProductNewUrl(url=f'https://www.lcw.com/urun-{page}-{position}')
+            for page in range(2, 21) for position in (1, 2)
+        ])
+
+        _, total_new, fetched = self.scan({}, stop_after=2)
+        self.assertEqual(total_new, 2)  # Only page 1 had unknown URLs
+        # Pages 2 and 3 end the scan; at most `stop_after` more were already in flight
+        self.assertLessEqual(max(fetched), 5)
+        self.assertEqual(fetched[:3], [1, 2, 3])
+
+    def test_unknown_urls_are_handed_to_the_pipeline(self):
+        pipeline = mock.Mock()
+        listing = {1: cards(1, 2), 2: []}
+        ProductNewUrl.objects.create(url='https://www.lcw.com/urun-1-1')
+
+        self.scan(listing, pipeline=pipeline)
+        pipeline.submit.assert_called_once_with('https://www.lcw.com/urun-1-2')
+        pipeline.close.assert_called_once()